@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, AsyncGenerator, Deque, Dict, Optional
+
+from autogen_core import CancellationToken
+
+from metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_WAIT = metrics_registry.histogram(
+    "admission_wait_seconds", "请求从申请准入到获得运行名额的排队耗时")
+ADMISSION_REJECTIONS = metrics_registry.counter(
+    "admission_rejections_total", "被准入控制拒绝的请求数", ("reason",))
+
+
+class RateLimitExceeded(RuntimeError):
+    """请求速率超出限制"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"请求过于频繁，请{retry_after:.0f}秒后重试")
+        self.retry_after = retry_after
+
+
+class AdmissionQueueFull(RuntimeError):
+    """等待队列已满"""
+
+
+class TokenBucket:
+    """令牌桶：按固定速率补充令牌，最多积累burst个"""
+
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionTicket:
+    """一次请求的准入凭证：排队等待直到获得运行名额，结束时必须release"""
+
+    def __init__(self, controller: "AdmissionController", key: str):
+        self.controller = controller
+        self.key = key
+        self.granted = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self._event = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """在等待队列中的位置（从1开始），已获得名额时为0"""
+        if self.granted:
+            return 0
+        try:
+            return self.controller._waiting.index(self) + 1
+        except ValueError:
+            return 0
+
+    async def wait(
+        self,
+        cancellation_token: Optional[CancellationToken] = None,
+        update_interval: float = 1.0
+    ) -> AsyncGenerator[int, None]:
+        """等待获得名额，排队期间位置变化时产出当前位置；令牌取消或凭证已释放时放弃排队"""
+        last_position = None
+        while not self.granted:
+            if self.released or (cancellation_token is not None and cancellation_token.is_cancelled()):
+                self.release()
+                raise asyncio.CancelledError()
+            position = self.position
+            if position != last_position:
+                last_position = position
+                yield position
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=update_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+
+    def release(self):
+        """释放名额，或在排队时取消排队"""
+        if self.released:
+            return
+        self.released = True
+        self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    LLM请求准入控制：全局并发上限 + 每个调用方（API Key或客户端地址）的并发上限 + 令牌桶限速 + 有界等待队列
+
+    名额按排队顺序分配；某个调用方达到自身并发上限时跳过它，不阻塞后面其他调用方的请求
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 16,
+        max_per_key: int = 2,
+        max_queue: int = 64,
+        rate_per_minute: float = 30,
+        burst: int = 10,
+        max_tracked_keys: int = 10000
+    ):
+        """
+        初始化准入控制
+
+        Args:
+            max_concurrent: 全局同时运行的请求数上限
+            max_per_key: 每个调用方同时运行的请求数上限
+            max_queue: 等待队列长度上限，超出时直接拒绝
+            rate_per_minute: 每个调用方每分钟可发起的请求数，0表示不限速
+            burst: 令牌桶容量（允许的突发请求数）
+            max_tracked_keys: 最多保留的调用方限速状态数
+        """
+        self.max_concurrent = max_concurrent
+        self.max_per_key = max_per_key
+        self.max_queue = max_queue
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_tracked_keys = max_tracked_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._waiting: Deque[AdmissionTicket] = deque()
+        self._running: Dict[str, int] = {}
+        self._in_flight = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "16")),
+            max_per_key=int(os.getenv("ADMISSION_MAX_PER_KEY", "2")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+            rate_per_minute=float(os.getenv("RATE_LIMIT_PER_MINUTE", "30")),
+            burst=int(os.getenv("RATE_LIMIT_BURST", "10")),
+        )
+
+    def enter(self, key: str) -> AdmissionTicket:
+        """
+        申请准入，立即返回凭证（可能需要排队）
+
+        Raises:
+            RateLimitExceeded: 调用方请求速率超限
+            AdmissionQueueFull: 等待队列已满
+        """
+        if self.rate_per_minute > 0:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_per_minute / 60, self.burst)
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_tracked_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            retry_after = bucket.try_acquire()
+            if retry_after > 0:
+                self.rate_limited += 1
+                ADMISSION_REJECTIONS.inc(reason="rate_limited")
+                raise RateLimitExceeded(retry_after)
+
+        ticket = AdmissionTicket(self, key)
+        if self._can_run(key) and not self._waiting:
+            self._grant(ticket)
+            return ticket
+        if len(self._waiting) >= self.max_queue:
+            self.rejected += 1
+            ADMISSION_REJECTIONS.inc(reason="queue_full")
+            logger.warning(f"准入等待队列已满({self.max_queue})，拒绝请求: {key}")
+            raise AdmissionQueueFull("服务繁忙，等待队列已满，请稍后重试")
+        self._waiting.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "max_per_key": self.max_per_key,
+            "max_queue": self.max_queue,
+            "rate_per_minute": self.rate_per_minute,
+            "burst": self.burst,
+            "admitted_total": self.admitted,
+            "rate_limited_total": self.rate_limited,
+            "rejected_total": self.rejected,
+            "avg_wait_seconds": round(self.total_wait_seconds / self.admitted, 3) if self.admitted else 0.0,
+        }
+
+    def _can_run(self, key: str) -> bool:
+        return self._in_flight < self.max_concurrent and self._running.get(key, 0) < self.max_per_key
+
+    def _grant(self, ticket: AdmissionTicket):
+        ticket.granted = True
+        self._in_flight += 1
+        self._running[ticket.key] = self._running.get(ticket.key, 0) + 1
+        self.admitted += 1
+        waited = time.monotonic() - ticket.enqueued_at
+        self.total_wait_seconds += waited
+        ADMISSION_WAIT.observe(waited)
+        ticket._event.set()
+
+    def _dispatch(self):
+        """按排队顺序分配空闲名额，并通知仍在排队的请求位置变化"""
+        if self._in_flight < self.max_concurrent:
+            for ticket in list(self._waiting):
+                if self._in_flight >= self.max_concurrent:
+                    break
+                if self._running.get(ticket.key, 0) < self.max_per_key:
+                    self._waiting.remove(ticket)
+                    self._grant(ticket)
+        for ticket in self._waiting:
+            ticket._event.set()
+
+    def _release(self, ticket: AdmissionTicket):
+        if ticket.granted:
+            self._in_flight -= 1
+            remaining = self._running.get(ticket.key, 1) - 1
+            if remaining > 0:
+                self._running[ticket.key] = remaining
+            else:
+                self._running.pop(ticket.key, None)
+        else:
+            try:
+                self._waiting.remove(ticket)
+            except ValueError:
+                pass
+        self._dispatch()
+
+
+# 全局准入控制实例
+admission_controller = AdmissionController.from_env()
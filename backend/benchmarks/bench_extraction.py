@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+文档提取基准：生成合成的PDF、DOCX、XLSX、CSV、JSON和大文本/代码文件，经 MarkerDocumentService.extract_document_content
+提取，按格式和PDF处理方式统计吞吐、延迟分位数和峰值内存
+
+PDF处理方式:
+    fallback  PyPDF2基础处理（不使用Marker）
+    stub      用PyPDF2逐页读取模拟Marker转换，测量服务自身的开销（线程池、缓存、图像引用处理等），
+              可用 --stub-page-ms 模拟每页的推理耗时
+    real      真实Marker模型（需已安装marker-pdf并提前下载好模型；强制使用CPU、禁止联网）
+
+每个（格式, 方式, 大小）组合在独立子进程中运行，峰值内存互不影响。不需要网络和GPU。
+
+用法（在 backend 目录下运行）:
+    python benchmarks/bench_extraction.py
+    python benchmarks/bench_extraction.py --formats pdf txt --sizes 64 1024 --repeat 10
+    python benchmarks/bench_extraction.py --formats pdf --pdf-modes stub real --stub-page-ms 200
+    python benchmarks/bench_extraction.py --json results.json   # 保存结果，便于对比回归
+"""
+import os
+import sys
+import csv
+import json
+import math
+import time
+import shutil
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+FORMATS = ["pdf", "docx", "xlsx", "csv", "json", "txt", "py"]
+PDF_MODES = ["fallback", "stub", "real"]
+
+WORDS = [
+    "login", "order", "payment", "inventory", "notify", "permission", "report", "search", "timeout", "retry",
+    "cache", "session", "token", "request", "response", "validate", "boundary", "concurrency", "error", "state",
+]
+CHINESE = ["用户登录", "订单管理", "支付结算", "库存同步", "消息通知", "权限控制", "接口超时", "参数校验", "异常处理", "并发控制"]
+
+
+def _ascii_line(rng: random.Random, width: int = 90) -> str:
+    words = []
+    size = 0
+    while size < width:
+        word = rng.choice(WORDS) if rng.random() > 0.1 else str(rng.randint(1, 9999))
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def _mixed_line(rng: random.Random) -> str:
+    return f"{rng.choice(CHINESE)}：{_ascii_line(rng, 60)}，规则{rng.randint(1, 999)}。"
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path: str, target_bytes: int, rng: random.Random) -> int:
+    """手写一个只含文本的多页PDF（内置Helvetica字体，不依赖任何PDF库），返回页数"""
+    lines_per_page = 45
+    pages: List[List[str]] = []
+    size = 0
+    while size < target_bytes or not pages:
+        lines = [_ascii_line(rng) for _ in range(lines_per_page)]
+        pages.append(lines)
+        size += sum(len(line) + 1 for line in lines)
+
+    count = len(pages)
+    font_id = 3 + count * 2
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + i * 2} 0 R' for i in range(count))}] /Count {count} >>",
+    ]
+    for i, lines in enumerate(pages):
+        stream = "BT /F1 9 Tf 14 TL 40 780 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + i * 2} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+    return count
+
+
+def write_docx(path: str, target_bytes: int, rng: random.Random) -> int:
+    from docx import Document
+
+    document = Document()
+    size = 0
+    section = 0
+    while size < target_bytes:
+        section += 1
+        document.add_heading(f"{section}. {rng.choice(CHINESE)}", level=2)
+        for _ in range(rng.randint(3, 8)):
+            paragraph = _mixed_line(rng)
+            document.add_paragraph(paragraph)
+            size += len(paragraph.encode("utf-8"))
+    document.save(path)
+    return 0
+
+
+def write_xlsx(path: str, target_bytes: int, rng: random.Random) -> int:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    size = 0
+    sheet_index = 0
+    while size < target_bytes:
+        sheet_index += 1
+        sheet = workbook.create_sheet(f"Sheet{sheet_index}")
+        sheet.append(["用例编号", "模块", "步骤", "预期结果", "优先级"])
+        for row in range(2000):
+            values = [f"TC-{sheet_index}-{row}", rng.choice(CHINESE), _ascii_line(rng, 40), _ascii_line(rng, 30), rng.choice("PHML")]
+            sheet.append(values)
+            size += sum(len(str(value)) for value in values)
+            if size >= target_bytes:
+                break
+    workbook.save(path)
+    return 0
+
+
+def write_csv(path: str, target_bytes: int, rng: random.Random) -> int:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "module", "description", "amount", "status"])
+        row = 0
+        while f.tell() < target_bytes:
+            row += 1
+            writer.writerow([row, rng.choice(CHINESE), _ascii_line(rng, 50), rng.randint(1, 100000), rng.choice(WORDS)])
+    return 0
+
+
+def write_json(path: str, target_bytes: int, rng: random.Random) -> int:
+    records = []
+    size = 0
+    while size < target_bytes:
+        record = {
+            "id": len(records) + 1,
+            "module": rng.choice(CHINESE),
+            "description": _ascii_line(rng, 60),
+            "tags": rng.sample(WORDS, 3),
+            "metrics": {"latency_ms": rng.randint(1, 5000), "success": rng.random() > 0.1},
+        }
+        records.append(record)
+        size += len(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"records": records}, f, ensure_ascii=False)
+    return 0
+
+
+def write_txt(path: str, target_bytes: int, rng: random.Random) -> int:
+    with open(path, "w", encoding="utf-8") as f:
+        size = 0
+        while size < target_bytes:
+            line = _mixed_line(rng) + "\n"
+            f.write(line)
+            size += len(line.encode("utf-8"))
+    return 0
+
+
+def write_py(path: str, target_bytes: int, rng: random.Random) -> int:
+    with open(path, "w", encoding="utf-8") as f:
+        size = 0
+        index = 0
+        while size < target_bytes:
+            index += 1
+            word = rng.choice(WORDS)
+            block = (
+                f"def handle_{word}_{index}(request, retries={rng.randint(1, 5)}):\n"
+                f"    \"\"\"{rng.choice(CHINESE)}\"\"\"\n"
+                f"    for attempt in range(retries):\n"
+                f"        if request.get(\"{word}\") == {rng.randint(0, 999)}:\n"
+                f"            return {{\"status\": \"{rng.choice(WORDS)}\", \"attempt\": attempt}}\n"
+                f"    raise ValueError(\"{_ascii_line(rng, 30)}\")\n\n\n"
+            )
+            f.write(block)
+            size += len(block)
+    return 0
+
+
+WRITERS = {
+    "pdf": write_pdf,
+    "docx": write_docx,
+    "xlsx": write_xlsx,
+    "csv": write_csv,
+    "json": write_json,
+    "txt": write_txt,
+    "py": write_py,
+}
+
+
+class StubRendered:
+    """模拟Marker渲染结果"""
+
+    def __init__(self, markdown: str, pages: int):
+        self.markdown = markdown
+        self.pages = pages
+
+
+class StubConverter:
+    """模拟Marker转换器：用PyPDF2逐页提取文本，每页附一个图像引用，可选模拟每页推理耗时"""
+
+    def __init__(self, page_ms: float = 0.0):
+        self.page_ms = page_ms
+
+    def __call__(self, file_path: str) -> StubRendered:
+        import PyPDF2
+
+        reader = PyPDF2.PdfReader(file_path)
+        parts = []
+        for index, page in enumerate(reader.pages):
+            parts.append(f"## Page {index + 1}\n\n{page.extract_text()}\n\n![](_page_{index}_Picture_0.jpeg)")
+            if self.page_ms:
+                time.sleep(self.page_ms / 1000)
+        return StubRendered("\n\n".join(parts), len(reader.pages))
+
+
+def stub_text_from_rendered(rendered: StubRendered):
+    images = {f"_page_{index}_Picture_0.jpeg": b"" for index in range(rendered.pages)}
+    return rendered.markdown, {"pages": rendered.pages}, images
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩分位数"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(file_format: str, mode: str, size_kb: int, repeat: int, stub_page_ms: float, with_cache: bool, seed: int) -> Dict[str, Any]:
+    """在当前进程中运行一个组合（由子进程调用）"""
+    workdir = tempfile.mkdtemp(prefix="bench_extraction_")
+    try:
+        return _run_case(workdir, file_format, mode, size_kb, repeat, stub_page_ms, with_cache, seed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def _measure(service, path: str, repeat: int):
+    """首次提取（冷启动）单独计时，之后连续提取repeat次"""
+    start = time.perf_counter()
+    first = await service.extract_document_content(path, os.path.basename(path))
+    cold_ms = (time.perf_counter() - start) * 1000
+    runs = []
+    if first["success"]:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            extracted = await service.extract_document_content(path, os.path.basename(path))
+            runs.append(((time.perf_counter() - start) * 1000, extracted))
+    return first, cold_ms, runs
+
+
+def _run_case(workdir: str, file_format: str, mode: str, size_kb: int, repeat: int, stub_page_ms: float, with_cache: bool, seed: int) -> Dict[str, Any]:
+    os.environ["MARKER_POOL_WORKERS"] = "0"
+    os.environ["MARKER_CACHE_ENABLED"] = "true" if with_cache else "false"
+    os.environ["MARKER_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ.pop("EXTRACTION_PROFILE_DIR", None)
+    # 离线、仅CPU运行
+    os.environ.setdefault("TORCH_DEVICE", "cpu")
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    result: Dict[str, Any] = {"format": file_format, "mode": mode, "size_kb": size_kb}
+    path = os.path.join(workdir, f"sample.{file_format}")
+    try:
+        pages = WRITERS[file_format](path, size_kb * 1024, random.Random(seed))
+    except ImportError as e:
+        return {**result, "skipped": f"缺少依赖: {e.name}"}
+    result["bytes"] = os.path.getsize(path)
+    result["pages"] = pages
+
+    import marker_service as ms
+
+    if file_format == "pdf":
+        if mode == "real" and not ms.MARKER_AVAILABLE:
+            return {**result, "skipped": "Marker未安装"}
+        if mode == "fallback":
+            ms.MARKER_AVAILABLE = False
+        elif mode == "stub":
+            ms.MARKER_AVAILABLE = True
+            ms.text_from_rendered = stub_text_from_rendered
+    service = ms.MarkerDocumentService()
+    if file_format == "pdf" and mode == "stub":
+        converter = StubConverter(stub_page_ms)
+        service._ensure_converter = lambda config=None, retry_failed=False: converter
+
+    result["rss_baseline_mb"] = round(current_rss_mb(), 1)
+
+    # 第一次提取包含模型加载等冷启动开销，单独统计
+    first, result["cold_ms"], runs = asyncio.run(_measure(service, path, repeat))
+    if not first["success"]:
+        return {**result, "error": first.get("error", "提取失败")}
+
+    latencies: List[float] = []
+    stages: Dict[str, float] = {}
+    cache_hits = 0
+    for latency, extracted in runs:
+        latencies.append(latency)
+        metadata = extracted["metadata"]
+        cache_hits += bool(metadata.get("cache_hit"))
+        for name, seconds in metadata.get("extraction_stats", {}).get("stages", {}).items():
+            stages[name] = stages.get(name, 0.0) + seconds * 1000
+
+    total_seconds = sum(latencies) / 1000
+    pages = first["metadata"].get("pages") or 0
+    result.update({
+        "pages": pages,
+        "method": first["metadata"].get("extraction_method"),
+        "runs": repeat,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": total_seconds * 1000 / repeat,
+        "mb_per_s": result["bytes"] * repeat / total_seconds / (1024 * 1024) if total_seconds else None,
+        "pages_per_s": pages * repeat / total_seconds if pages and total_seconds else None,
+        "cache_hits": cache_hits,
+        "stages_ms": {name: total / repeat for name, total in stages.items()},
+        "rss_peak_mb": round(peak_rss_mb(), 1),
+    })
+    return result
+
+
+def run_isolated(args: argparse.Namespace, file_format: str, mode: str, size_kb: int) -> Dict[str, Any]:
+    """在子进程中运行一个组合，峰值内存只反映该组合"""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker",
+        "--formats", file_format, "--pdf-modes", mode if file_format == "pdf" else "fallback", "--sizes", str(size_kb),
+        "--repeat", str(args.repeat), "--stub-page-ms", str(args.stub_page_ms), "--seed", str(args.seed),
+    ]
+    if args.with_cache:
+        command.append("--with-cache")
+    completed = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True, timeout=args.timeout)
+    lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+    if completed.returncode != 0 or not lines:
+        error = (completed.stderr.strip().splitlines() or ["子进程异常退出"])[-1]
+        return {"format": file_format, "mode": mode, "size_kb": size_kb, "error": error}
+    return {**json.loads(lines[-1]), "mode": mode}
+
+
+def _fmt(value: Optional[float], digits: int = 1) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_results(results: List[Dict[str, Any]]):
+    print(
+        f"{'格式':<6} {'方式':<9} {'大小KB':>7} {'页数':>5} {'冷启动ms':>9} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8}"
+        f" {'MB/s':>8} {'页/s':>8} {'基线MB':>7} {'峰值MB':>7}"
+    )
+    for r in results:
+        head = f"{r['format']:<6} {r['mode']:<9} {r['size_kb']:>7}"
+        if "skipped" in r or "error" in r:
+            print(f"{head}  {'跳过: ' + r['skipped'] if 'skipped' in r else '失败: ' + r['error']}")
+            continue
+        print(
+            f"{head} {r['pages'] or '-':>5} {_fmt(r['cold_ms']):>9} {_fmt(r['p50_ms']):>8} {_fmt(r['p95_ms']):>8}"
+            f" {_fmt(r['p99_ms']):>8} {_fmt(r['mb_per_s'], 2):>8} {_fmt(r['pages_per_s']):>8}"
+            f" {_fmt(r['rss_baseline_mb']):>7} {_fmt(r['rss_peak_mb']):>7}"
+        )
+
+    print("\n各阶段平均耗时(ms)")
+    for r in results:
+        if r.get("stages_ms"):
+            stages = "  ".join(f"{name}={ms:.2f}" for name, ms in sorted(r["stages_ms"].items(), key=lambda item: -item[1]))
+            cache = f"  缓存命中 {r['cache_hits']}/{r['runs']}" if r.get("cache_hits") else ""
+            print(f"  {r['format']:<6} {r['mode']:<9} {r['size_kb']:>7}KB  {stages}{cache}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文档提取基准（离线，仅CPU）")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=FORMATS)
+    parser.add_argument("--pdf-modes", nargs="+", choices=PDF_MODES, default=["fallback", "stub"], help="PDF处理方式")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 1024], help="合成文件的文本量（KB）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个组合计时的提取次数（不含首次冷启动）")
+    parser.add_argument("--stub-page-ms", type=float, default=0.0, help="stub方式下模拟的每页推理耗时")
+    parser.add_argument("--with-cache", action="store_true", help="开启提取结果缓存（默认关闭，测量的是完整提取）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=int, default=1800, help="单个组合的超时时间（秒）")
+    parser.add_argument("--json", help="把结果保存为JSON文件")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_case(args.formats[0], args.pdf_modes[0], args.sizes[0], args.repeat, args.stub_page_ms, args.with_cache, args.seed)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    results = []
+    for file_format in args.formats:
+        modes = args.pdf_modes if file_format == "pdf" else ["-"]
+        for mode in modes:
+            for size_kb in args.sizes:
+                results.append(run_isolated(args, file_format, mode, size_kb))
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
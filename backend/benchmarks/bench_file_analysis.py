@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+文件分析上下文构建基准：对比整篇放入（full）与检索片段（retrieval）两种模式
+
+用法（在 backend 目录下运行）:
+    python benchmarks/bench_file_analysis.py --sizes 20000 200000 2000000
+    python benchmarks/bench_file_analysis.py --sizes 200000 --live   # 调用真实模型，测量首字延迟
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import RetrievalIndexCache, estimate_tokens  # noqa: E402
+
+MODULES = ["用户登录", "订单管理", "支付结算", "库存同步", "消息通知", "权限控制", "报表导出", "搜索推荐"]
+TERMS = ["接口", "参数", "校验", "超时", "重试", "缓存", "日志", "权限", "状态", "异常", "边界", "并发"]
+QUESTIONS = [
+    "支付结算模块的超时重试策略是什么？",
+    "权限控制有哪些校验规则？",
+    "订单管理的并发异常如何处理？",
+    "总结一下消息通知模块的主要功能",
+]
+
+
+def generate_document(target_chars: int, seed: int = 42) -> str:
+    """生成指定大小的合成Markdown需求文档"""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    section = 0
+    while size < target_chars:
+        module = MODULES[section % len(MODULES)]
+        section += 1
+        parts.append(f"## {section}. {module}")
+        for _ in range(rng.randint(3, 6)):
+            sentence = "，".join(
+                f"{module}{rng.choice(TERMS)}需要满足规则{rng.randint(1, 999)}"
+                for _ in range(rng.randint(4, 10))
+            )
+            parts.append(sentence + "。")
+        size = sum(len(p) + 2 for p in parts)
+    return "\n\n".join(parts)[:target_chars]
+
+
+def bench_offline(sizes, top_k: int, repeat: int):
+    print(f"{'文档字符数':>10} {'full tokens':>12} {'检索 tokens':>12} {'压缩比':>8} {'建索引(ms)':>11} {'检索p50(ms)':>12}")
+    for size in sizes:
+        document = generate_document(size)
+        full_tokens = estimate_tokens(document)
+
+        cache = RetrievalIndexCache()
+        start = time.perf_counter()
+        index = cache.get(document)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        latencies = []
+        retrieval_tokens = []
+        for _ in range(repeat):
+            for question in QUESTIONS:
+                start = time.perf_counter()
+                chunks = index.search(question, top_k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                retrieval_tokens.append(sum(estimate_tokens(c.text) for c in chunks))
+
+        avg_tokens = statistics.mean(retrieval_tokens)
+        print(
+            f"{size:>10} {full_tokens:>12} {avg_tokens:>12.0f} {full_tokens / max(avg_tokens, 1):>8.1f}"
+            f" {build_ms:>11.1f} {statistics.median(latencies):>12.2f}"
+        )
+
+
+async def bench_live(sizes):
+    """调用真实模型，比较两种模式的首字延迟和总耗时（需要配置API_KEY）"""
+    from chat_service import ChatService
+
+    service = ChatService()
+    for size in sizes:
+        document = generate_document(size)
+        for mode in ("full", "retrieval"):
+            start = time.perf_counter()
+            first_token = None
+            try:
+                async for _ in service.file_analysis_stream(QUESTIONS[0], document, mode=mode):
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+            except Exception as e:
+                print(f"{size:>10} {mode:>10} 调用失败: {e}")
+                continue
+            total = time.perf_counter() - start
+            print(f"{size:>10} {mode:>10} 首字 {first_token or 0:.2f}s 总耗时 {total:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文件分析 full / retrieval 模式基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20000, 200000, 2000000], help="文档字符数")
+    parser.add_argument("--top-k", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="调用真实模型测量延迟")
+    args = parser.parse_args()
+
+    bench_offline(args.sizes, args.top_k, args.repeat)
+    if args.live:
+        asyncio.run(bench_live(args.sizes))
+
+
+if __name__ == "__main__":
+    main()
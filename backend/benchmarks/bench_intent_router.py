@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+意图路由基准：对比逐个子串判断（原实现）与预编译正则单遍扫描的耗时，并校验两者结果一致
+
+用法（在 backend 目录下运行）:
+    python benchmarks/bench_intent_router.py --sizes 100 10000 200000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_router import DEFAULT_RULES, IntentRouter  # noqa: E402
+
+FILLER = ["系统", "需求", "模块", "接口", "登录", "订单", "数据", "页面", "功能", "流程", "the", "user", "api", "service"]
+MESSAGES = [
+    "帮我设计登录模块的测试用例",
+    "请总结这个文件的主要内容",
+    "how to write test case for payment api",
+    "帮我优化一下简历里的项目经验，突出测试经验",
+    "今天天气怎么样",
+]
+
+
+def legacy_route(message: str) -> bool:
+    """原 _should_use_test_team 实现，用作对照"""
+    message_lower = message.lower()
+    for pattern in DEFAULT_RULES["trigger"]:
+        if pattern in message_lower:
+            if any(exclude in message_lower for exclude in DEFAULT_RULES["exclude"]):
+                continue
+            has_action = any(action in message_lower for action in DEFAULT_RULES["action"])
+            has_test_object = any(obj in message_lower for obj in DEFAULT_RULES["object"])
+            if has_action and has_test_object:
+                return True
+    return False
+
+
+def generate_message(base: str, target_chars: int, rng: random.Random) -> str:
+    """在消息后拼接随机文本（模拟附带文件内容的长提示）"""
+    parts = [base]
+    size = len(base)
+    while size < target_chars:
+        word = rng.choice(FILLER)
+        parts.append(word)
+        size += len(word) + 1
+    return " ".join(parts)[:max(target_chars, len(base))]
+
+
+def timeit(func, message: str, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(message)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="意图路由基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 200000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    router = IntentRouter()
+    rng = random.Random(42)
+    print(f"{'消息字符数':>10} {'原实现p50(ms)':>14} {'预编译p50(ms)':>14} {'加速比':>8}")
+    for size in args.sizes:
+        legacy_times, compiled_times = [], []
+        for base in MESSAGES:
+            message = generate_message(base, size, rng)
+            assert legacy_route(message) == router.route(message).use_team, f"结果不一致: {base}"
+            legacy_times.append(timeit(legacy_route, message, args.repeat))
+            compiled_times.append(timeit(router.route, message, args.repeat))
+        legacy = statistics.mean(legacy_times)
+        compiled = statistics.mean(compiled_times)
+        print(f"{size:>10} {legacy:>14.3f} {compiled:>14.3f} {legacy / compiled if compiled else 0:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,67 +2,33 @@ import asyncio
 import os
 import sys
 import json
-from typing import AsyncGenerator, Dict, List, Any
+import uuid
+import copy
+import hashlib
+from typing import AsyncGenerator, Callable, Dict, List, Any, Optional, Set
 from autogen_agentchat.agents import AssistantAgent, UserProxyAgent
 from autogen_agentchat.conditions import SourceMatchTermination, TextMentionTermination
 from autogen_agentchat.messages import ModelClientStreamingChunkEvent, TextMessage, UserInputRequestedEvent
 from autogen_agentchat.teams import RoundRobinGroupChat
 from autogen_core import CancellationToken
 from autogen_core.models import ModelFamily
-from autogen_ext.models.openai import OpenAIChatCompletionClient
 from dotenv import load_dotenv
 
+from context_manager import SummarizingChatCompletionContext, TokenUsageTracker
+from intent_router import IntentRouter
+from metrics import RequestTimer
+from model_client_pool import ModelClientFactory
+from response_cache import CachedTeamRun, TeamResponseCache
+from retrieval import RetrievalIndexCache, estimate_tokens
+from session_manager import CappedChatCompletionContext, SessionManager
+from session_persistence import MemorySessionStore, create_session_store_from_env
+from team_review import BlockReviewer, IncrementalReviewSplitter, split_review_blocks
+
 # 加载环境变量
 load_dotenv()
 
-class ChatService:
-    def __init__(self):
-        self.sessions: Dict[str, AssistantAgent | RoundRobinGroupChat] = {}
-        self.model_client = self._create_model_client()
-        self.feedback_queue = asyncio.Queue()
-        # 智能体信息配置
-        self.agent_info = {
-            "primary": {
-                "name": "测试用例设计师",
-                "description": "负责设计专业、全面的测试用例",
-                "avatar": "🧪",
-                "color": "#1890ff"
-            },
-            "critic": {
-                "name": "质量评审专家",
-                "description": "负责评审测试用例质量并提出改进建议",
-                "avatar": "🔍",
-                "color": "#52c41a"
-            },
-            "chat_assistant": {
-                "name": "智能助手",
-                "description": "通用智能助手，回答各种问题",
-                "avatar": "🤖",
-                "color": "#722ed1"
-            }
-        }
-
-    async def put_feedback(self, message: Dict[str, Any]):
-        await self.feedback_queue.put(message)
-
-    async def user_input_callback(self, prompt: str, cancellation_token: CancellationToken | None) -> str:
-        print(f"user_input_callback被调用: prompt={prompt}")
-
-        try:
-            print("等待用户反馈...")
-            feedback = await self.feedback_queue.get()
-            print(f"收到用户反馈: {feedback}")
-            return feedback.get("content", "APPROVE")
-        except Exception as e:
-            print(f"获取用户反馈失败: {str(e)}")
-            return "APPROVE"  # 默认批准
-
-    def _create_team(self, session_id: str):
-        if session_id not in self.sessions:
-            primary_agent = AssistantAgent(
-                "primary",
-                model_client=self._create_model_client(),
-                system_message="""
+# 测试用例设计师的系统提示
+PRIMARY_SYSTEM_MESSAGE = """
             **# 角色与目标**
     
             你是一名拥有超过10年经验的资深软件测试架构师，精通各种测试方法论（如：等价类划分、边界值分析、因果图、场景法等），并且对用户体验和系统性能有深刻的理解。你的任务是为我接下来描述的功能模块，设计一份专业、全面、且易于执行的高质量测试用例。
@@ -105,15 +71,10 @@ class ChatService:
             **# 开始设计**
     
             请基于以上所有信息，开始设计测试用例。
-                """,
-                model_client_stream=True,
-            )
+                """
 
-            # Create the critic agent.
-            critic_agent = AssistantAgent(
-                "critic",
-                model_client=self._create_model_client(),
-                system_message="""
+# 质量评审专家的系统提示
+CRITIC_SYSTEM_MESSAGE = """
             ** 角色与目标**
     
             你是一名拥有超过15年软件质量保证（SQA）经验的测试主管（Test Lead）。你以严谨、细致和注重细节而闻名，曾负责过多个大型复杂项目的质量保障工作。你的核心任务是**评审**我接下来提供的测试用例，找出其中潜在的问题、遗漏和可以改进的地方，以确保测试套件的**高效、全面和易于维护**。
@@ -174,27 +135,202 @@ class ChatService:
     
             请基于以上所有信息和你的专业经验，开始评审工作，并生成报告。
     
-                """,
+                """
+
+class ChatService:
+    def __init__(self):
+        # 会话：空闲超时和数量上限淘汰，每个智能体只保留最近若干条消息
+        self.sessions = SessionManager(
+            max_sessions=int(os.getenv("SESSION_MAX_COUNT", "1000")),
+            idle_ttl_seconds=int(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600")),
+            on_evict=self._on_session_evicted,
+        )
+        # 会话状态持久化：每次运行结束后保存，内存中不存在或已过期时从存储恢复
+        self.session_store = create_session_store_from_env()
+        self.session_persist_ttl = int(os.getenv("SESSION_PERSIST_TTL_SECONDS", str(7 * 24 * 3600)))
+        # session_id -> 内存中会话状态对应的存储版本号
+        self.session_versions: Dict[str, str] = {}
+        self.max_history_messages = int(os.getenv("SESSION_MAX_HISTORY_MESSAGES", "40"))
+        # 上下文管理：buffer（只保留最近N条消息）/ summary（按token预算截取，较早的对话压缩成摘要）
+        self.context_mode = os.getenv("CONTEXT_MODE", "buffer").lower()
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        self.context_summary_max_tokens = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "800"))
+        # 按会话统计token消耗
+        self.token_usage = TokenUsageTracker()
+        # 所有会话和智能体共享模型客户端（连接池 + 全局并发上限）
+        self.model_client_factory = ModelClientFactory.from_env()
+        self.model_client = self._create_model_client()
+        # 按会话隔离的用户反馈通道：session_id -> 队列
+        self.feedback_channels: Dict[str, asyncio.Queue] = {}
+        # 正在等待用户反馈的会话
+        self.pending_feedback: Set[str] = set()
+        # 正在运行的会话，同一会话同时只允许一个运行
+        self.active_runs: Set[str] = set()
+        self.feedback_timeout = float(os.getenv("FEEDBACK_TIMEOUT_SECONDS", "1800"))
+        # agent_end 事件内容：full 重复完整内容，digest 只发送长度和哈希（客户端已通过 chunk 收到全文）
+        self.agent_end_content = os.getenv("AGENT_END_CONTENT", "full").lower()
+        # 预编译的意图路由规则
+        self.intent_router = IntentRouter.from_env()
+        # 挂起模式：团队在等待用户审批时保存检查点并结束本次运行，收到反馈后在新的流中恢复
+        self.suspend_on_approval = os.getenv("TEAM_SUSPEND_ON_APPROVAL", "false").lower() in ("1", "true", "yes")
+        self.checkpoint_store = self.session_store or MemorySessionStore()
+        # 测试团队评审方式：sequential（评审专家在主智能体完成后整体评审）/ parallel（按模块切分后并行评审）
+        # / pipelined（主智能体输出完整的表格行后评审专家即开始评审，两者交替流式输出）
+        self.team_review_mode = os.getenv("TEAM_REVIEW_MODE", "sequential").lower()
+        if self.team_review_mode not in ("sequential", "parallel", "pipelined"):
+            print(f"未知的 TEAM_REVIEW_MODE: {self.team_review_mode}，使用 sequential")
+            self.team_review_mode = "sequential"
+        self.review_max_concurrency = int(os.getenv("TEAM_REVIEW_MAX_CONCURRENCY", "4"))
+        self.review_max_rows = int(os.getenv("TEAM_REVIEW_MAX_ROWS", "20"))
+        # 测试团队响应缓存（可选）：新会话提交相同任务时直接回放之前的运行结果
+        self.response_cache = TeamResponseCache.from_env()
+        if self.response_cache is not None and not self.suspend_on_approval:
+            # 阻塞审批模式下运行过程中包含用户输入，无法回放
+            print("团队响应缓存需要同时开启 TEAM_SUSPEND_ON_APPROVAL，已禁用")
+            self.response_cache = None
+        # 文件分析模式：full（整篇放入系统消息）/ retrieval（检索相关片段）/ auto（按文档大小选择）
+        self.file_analysis_mode = os.getenv("FILE_ANALYSIS_MODE", "auto")
+        self.file_analysis_full_max_tokens = int(os.getenv("FILE_ANALYSIS_FULL_MAX_TOKENS", "8000"))
+        self.file_analysis_top_k = int(os.getenv("FILE_ANALYSIS_TOP_K", "6"))
+        self.retrieval_indexes = RetrievalIndexCache(chunk_chars=int(os.getenv("FILE_ANALYSIS_CHUNK_CHARS", "1200")))
+        # 智能体信息配置
+        self.agent_info = {
+            "primary": {
+                "name": "测试用例设计师",
+                "description": "负责设计专业、全面的测试用例",
+                "avatar": "🧪",
+                "color": "#1890ff"
+            },
+            "critic": {
+                "name": "质量评审专家",
+                "description": "负责评审测试用例质量并提出改进建议",
+                "avatar": "🔍",
+                "color": "#52c41a"
+            },
+            "chat_assistant": {
+                "name": "智能助手",
+                "description": "通用智能助手，回答各种问题",
+                "avatar": "🤖",
+                "color": "#722ed1"
+            }
+        }
+
+    def _get_feedback_channel(self, session_id: str) -> asyncio.Queue:
+        if session_id not in self.feedback_channels:
+            self.feedback_channels[session_id] = asyncio.Queue(maxsize=1)
+        return self.feedback_channels[session_id]
+
+    def _release_feedback_channel(self, session_id: str):
+        """没有等待者且没有积压反馈时释放通道"""
+        queue = self.feedback_channels.get(session_id)
+        if queue is not None and queue.empty() and session_id not in self.pending_feedback:
+            del self.feedback_channels[session_id]
+
+    async def put_feedback(self, message: Dict[str, Any], session_id: str = "default") -> bool:
+        """
+        将用户反馈投递到指定会话
+
+        只有会话中有智能体正在等待反馈时才投递，否则拒绝，避免过期的反馈被之后的审批直接消费
+
+        Returns:
+            反馈是否已交给等待中的智能体（运行已挂起时记录到检查点，返回False）
+        """
+        checkpoint = await self._load_checkpoint(session_id)
+        if checkpoint is not None:
+            # 运行已挂起：记录反馈，由恢复接口在新的流中继续
+            checkpoint["pending_input"] = message.get("content")
+            await self.checkpoint_store.set(f"checkpoint:{session_id}", json.dumps(checkpoint, default=str), ex=self.session_persist_ttl)
+            return False
+
+        if session_id not in self.pending_feedback:
+            print(f"会话没有等待中的审批，忽略反馈: {session_id}")
+            return False
+        # 每次等待只接受一条反馈，重复提交会被拒绝
+        self.pending_feedback.discard(session_id)
+        self._get_feedback_channel(session_id).put_nowait(message)
+        return True
+
+    def _make_user_input_func(self, session_id: str):
+        """创建绑定会话的用户输入函数，供UserProxyAgent使用"""
+        async def input_func(prompt: str, cancellation_token: CancellationToken | None) -> str:
+            return await self.user_input_callback(session_id, prompt, cancellation_token)
+        return input_func
+
+    async def user_input_callback(self, session_id: str, prompt: str, cancellation_token: CancellationToken | None) -> str:
+        print(f"user_input_callback被调用: session={session_id}, prompt={prompt}")
+
+        queue = self._get_feedback_channel(session_id)
+        get_task = asyncio.ensure_future(queue.get())
+        if cancellation_token is not None:
+            # 取消运行时立即停止等待
+            cancellation_token.link_future(get_task)
+
+        self.pending_feedback.add(session_id)
+        try:
+            print("等待用户反馈...")
+            feedback = await asyncio.wait_for(get_task, timeout=self.feedback_timeout)
+            print(f"收到用户反馈: {feedback}")
+            return feedback.get("content", "APPROVE")
+        except asyncio.TimeoutError:
+            # 超时默认批准，结束本轮运行并释放资源
+            print(f"等待用户反馈超时: {session_id}")
+            return "APPROVE"
+        except asyncio.CancelledError:
+            print(f"等待用户反馈已取消: {session_id}")
+            raise
+        except Exception as e:
+            print(f"获取用户反馈失败: {str(e)}")
+            return "APPROVE"  # 默认批准
+        finally:
+            self.pending_feedback.discard(session_id)
+            self._release_feedback_channel(session_id)
+
+    def _create_team(self, session_id: str):
+        if session_id not in self.sessions:
+            primary_agent = AssistantAgent(
+                "primary",
+                model_client=self._create_model_client(),
+                system_message=PRIMARY_SYSTEM_MESSAGE,
                 model_client_stream=True,
-            )
-            user_proxy = UserProxyAgent(
-                name="user_proxy",
-                input_func=self.user_input_callback
+                model_context=self._create_model_context(session_id),
             )
 
-            # Define a termination condition that stops the task if the critic approves.
-            # source_match_termination = SourceMatchTermination(["critic"])
+            if self.team_review_mode in ("parallel", "pipelined"):
+                # 评审由服务端在主智能体发言后单独进行，团队中只保留主智能体
+                self.sessions[session_id] = RoundRobinGroupChat([primary_agent], max_turns=1)
+                return self.sessions[session_id]
 
+            # Create the critic agent.
+            critic_agent = AssistantAgent(
+                "critic",
+                model_client=self._create_model_client(),
+                system_message=CRITIC_SYSTEM_MESSAGE,
+                model_client_stream=True,
+                model_context=self._create_model_context(session_id),
+            )
             text_termination = TextMentionTermination("APPROVE")
 
-            # Create a team with the primary and critic agents.
-            team = RoundRobinGroupChat([primary_agent, critic_agent, user_proxy], termination_condition=text_termination)
+            if self.suspend_on_approval:
+                # 挂起模式：评审专家发言后结束本次运行，由服务端保存检查点等待用户审批
+                source_match_termination = SourceMatchTermination(["critic"])
+                team = RoundRobinGroupChat(
+                    [primary_agent, critic_agent],
+                    termination_condition=text_termination | source_match_termination
+                )
+            else:
+                user_proxy = UserProxyAgent(
+                    name="user_proxy",
+                    input_func=self._make_user_input_func(session_id)
+                )
+
+                # Create a team with the primary and critic agents.
+                team = RoundRobinGroupChat([primary_agent, critic_agent, user_proxy], termination_condition=text_termination)
             self.sessions[session_id] = team
         return self.sessions[session_id]
 
     def _create_model_client(self):
-        """创建模型客户端"""
-        return OpenAIChatCompletionClient(
+        """获取模型客户端（同一端点和模型共享同一个客户端）"""
+        return self.model_client_factory.get(
             model=os.getenv("MODEL", "deepseek-chat"),
             base_url=os.getenv("BASE_URL", "https://api.deepseek.com/v1"),
             api_key=os.getenv("API_KEY"),
@@ -208,6 +344,82 @@ class ChatService:
             }
         )
     
+    def _on_session_evicted(self, session_id: str, session: Any, reason: str):
+        self.session_versions.pop(session_id, None)
+        self._release_feedback_channel(session_id)
+
+    async def _load_session(self, session_id: str, use_team: bool) -> AssistantAgent | RoundRobinGroupChat:
+        """
+        获取会话对应的智能体或团队
+
+        启用持久化时，若存储中的版本与内存中的不一致（内存中不存在，或其他worker更新过），
+        则按存储的状态重建会话
+        """
+        if self.session_store is not None:
+            try:
+                version = await self.session_store.get(f"session:{session_id}:version")
+                if version is not None and version != self.session_versions.get(session_id):
+                    raw = await self.session_store.get(f"session:{session_id}")
+                    if raw:
+                        record = json.loads(raw)
+                        self.sessions.pop(session_id)
+                        if record["kind"] == "team":
+                            session = self._create_team(session_id)
+                        else:
+                            session = self._get_or_create_agent(session_id)
+                        await session.load_state(record["state"])
+                        self.session_versions[session_id] = version
+                        print(f"会话已从存储恢复: {session_id} ({record['kind']})")
+            except Exception as e:
+                print(f"恢复会话失败: {session_id}, {str(e)}")
+
+        if use_team:
+            return self._create_team(session_id)
+        return self._get_or_create_agent(session_id)
+
+    async def _save_session(self, session_id: str):
+        """将会话状态保存到存储"""
+        if self.session_store is None:
+            return
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        try:
+            kind = "team" if isinstance(session, RoundRobinGroupChat) else "agent"
+            await self._store_session_record(session_id, kind, await session.save_state())
+        except Exception as e:
+            print(f"保存会话失败: {session_id}, {str(e)}")
+
+    async def _store_session_record(self, session_id: str, kind: str, state: Dict[str, Any]):
+        """写入会话状态并更新版本号"""
+        version = uuid.uuid4().hex
+        await self.session_store.set(
+            f"session:{session_id}",
+            json.dumps({"kind": kind, "state": state}, default=str),
+            ex=self.session_persist_ttl
+        )
+        await self.session_store.set(f"session:{session_id}:version", version, ex=self.session_persist_ttl)
+        self.session_versions[session_id] = version
+
+    async def _is_new_session(self, session_id: str) -> bool:
+        """会话是否没有任何历史（内存和存储中都不存在）"""
+        if session_id in self.sessions:
+            return False
+        if self.session_store is not None:
+            return await self.session_store.get(f"session:{session_id}:version") is None
+        return True
+
+    def _create_model_context(self, session_id: str) -> CappedChatCompletionContext | SummarizingChatCompletionContext:
+        """创建会话智能体的模型上下文，限制每次请求发送的历史大小"""
+        if self.context_mode == "summary":
+            return SummarizingChatCompletionContext(
+                self.model_client,
+                token_budget=self.context_token_budget,
+                summary_max_tokens=self.context_summary_max_tokens,
+                on_usage=lambda usage: self.token_usage.record(session_id, usage, kind="summary"),
+            )
+        return CappedChatCompletionContext(buffer_size=self.max_history_messages)
+
     def _get_or_create_agent(self, session_id: str) -> AssistantAgent:
         """获取或创建会话对应的智能体"""
         if session_id not in self.sessions:
@@ -235,6 +447,7 @@ class ChatService:
                                 
                                 请根据用户的具体需求提供最合适的帮助。""",
                 model_client_stream=True,  # 启用流式输出
+                model_context=self._create_model_context(session_id),
             )
         return self.sessions[session_id]
 
@@ -242,105 +455,241 @@ class ChatService:
     
     def _should_use_test_team(self, message: str) -> bool:
         """判断是否应该使用测试用例编写团队"""
-        message_lower = message.lower()
-
-        # 首先检查是否包含测试相关的明确请求
-        test_design_patterns = [
-            # 明确的测试用例设计请求
-            "设计测试用例", "编写测试用例", "写测试用例", "制定测试用例",
-            "创建测试用例", "生成测试用例", "测试用例设计", "测试用例编写",
-            "测试用例", "用例设计", "用例编写", "用例制定", "用例创建",
-
-            # 明确的测试计划/方案设计
-            "设计测试计划", "编写测试计划", "制定测试计划", "测试计划设计",
-            "设计测试方案", "编写测试方案", "制定测试方案", "测试方案设计",
-            "测试计划", "测试方案", "测试策略",
-
-            # 测试相关的动作词
-            "测试", "用例", "test case", "test plan", "testing",
-
-            # 英文版本
-            "design test case", "write test case", "create test case",
-            "test case design", "test plan design", "design test plan"
-        ]
-
-        # 检查是否包含测试设计请求
-        for pattern in test_design_patterns:
-            if pattern in message_lower:
-                # 进一步检查是否真的是测试用例设计请求
-                if self._is_test_design_request(message_lower):
-                    return True
-
-        return False
-
-    def _is_test_design_request(self, message_lower: str) -> bool:
-        """更精确地判断是否是测试设计请求"""
-        # 排除明显不是测试设计的场景
-        exclude_scenarios = [
-            # 简历相关
-            "简历", "resume", "cv", "工作经历", "项目经验",
-            # 面试相关
-            "面试", "求职", "招聘", "职位", "岗位", "人才", "候选人",
-            # 纯文档分析（不涉及测试设计）
-            "分析这个文档", "总结这个文件", "评价这个材料", "这个文档说了什么",
-            "文档内容", "文件内容", "材料内容"
-        ]
-
-        # 如果包含明确的排除场景，返回False
-        for exclude in exclude_scenarios:
-            if exclude in message_lower:
-                return False
-
-        # 包含测试设计相关的动作词
-        design_actions = [
-            "设计", "编写", "写", "制定", "创建", "生成", "帮我", "请", "如何",
-            "design", "write", "create", "generate", "help", "how to"
-        ]
-
-        # 包含测试相关的对象
-        test_objects = [
-            "测试用例", "测试计划", "测试方案", "用例", "测试",
-            "test case", "test plan", "testing", "test"
-        ]
-
-        # 检查是否同时包含动作词和测试对象
-        has_action = any(action in message_lower for action in design_actions)
-        has_test_object = any(obj in message_lower for obj in test_objects)
-
-        return has_action and has_test_object
-
-    async def chat_stream(self, message: str, session_id: str = "default") -> AsyncGenerator[str, None]:
-        """流式聊天"""
+        decision = self.intent_router.route(message)
+        if decision.use_team:
+            print(f"路由到测试团队，命中: {decision.evidence}")
+        return decision.use_team
+
+    async def chat_stream(self, message: str, session_id: str = "default", agent_end_content: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """流式聊天（每行一个JSON事件）"""
+        async for event in self.chat_events(message, session_id, agent_end_content):
+            yield json.dumps(event) + "\n"
+
+    async def chat_events(
+        self,
+        message: str,
+        session_id: str = "default",
+        agent_end_content: Optional[str] = None,
+        cancellation_token: Optional[CancellationToken] = None,
+        include_stats: bool = False
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        流式聊天，产出事件字典，由调用方决定编码方式
+
+        Args:
+            agent_end_content: agent_end 事件内容格式 full / digest，默认使用服务配置
+            cancellation_token: 取消令牌，客户端断开时取消可中止正在进行的模型请求
+            include_stats: 是否在末尾追加 stats 事件（首段输出耗时、输出速度、各智能体耗时等）
+        """
+        timer = RequestTimer("chat")
+        events = self._single_flight(session_id, self._chat_events(message, session_id, agent_end_content, cancellation_token, timer))
+        async for event in timer.track(events, include_stats):
+            yield event
+
+    async def _single_flight(self, session_id: str, events: AsyncGenerator[Dict[str, Any], None]) -> AsyncGenerator[Dict[str, Any], None]:
+        """同一会话同时只允许一个运行，避免并发请求同时操作同一个智能体"""
+        if session_id in self.active_runs:
+            await events.aclose()
+            yield {
+                "type": "error",
+                "code": "session_busy",
+                "content": "该会话正在处理另一个请求，请等待当前回复完成后再试"
+            }
+            return
+        self.active_runs.add(session_id)
+        try:
+            async for event in events:
+                yield event
+        finally:
+            self.active_runs.discard(session_id)
+            await events.aclose()
+
+    async def _chat_events(
+        self,
+        message: str,
+        session_id: str,
+        agent_end_content: Optional[str],
+        cancellation_token: Optional[CancellationToken],
+        timer: RequestTimer
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        # 新消息取代尚未审批的挂起运行
+        await self._delete_checkpoint(session_id)
+
         # 根据消息内容智能选择使用单个智能体还是测试团队
-        if self._should_use_test_team(message):
-            agent = self._create_team(session_id)
-            use_team = True
+        with timer.phase("routing"):
+            use_team = self._should_use_test_team(message)
+        timer.mode = "team" if use_team else "single"
+
+        # 只有新会话的结果与历史无关，才能使用响应缓存
+        cache_key = None
+        if use_team and self.response_cache is not None and await self._is_new_session(session_id):
+            cache_key = TeamResponseCache.make_key(
+                message,
+                [PRIMARY_SYSTEM_MESSAGE, CRITIC_SYSTEM_MESSAGE],
+                os.getenv("MODEL", "deepseek-chat"),
+                variant=self.team_review_mode
+            )
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                print(f"命中团队响应缓存: {session_id}")
+                timer.mode = "cached"
+                async for event in self._replay_team_run(session_id, cached, agent_end_content):
+                    yield event
+                return
+
+        with timer.phase("session_load"):
+            agent = await self._load_session(session_id, use_team)
+
+        if use_team and self.team_review_mode in ("parallel", "pipelined"):
+            run = self._review_run(agent, message, message, session_id, agent_end_content, cancellation_token)
+        else:
+            run = self._stream_run(agent, message, use_team, session_id, agent_end_content, cancellation_token=cancellation_token)
+
+        transcript: List[Dict[str, Any]] = []
+        failed = False
+        async for event in run:
+            if cache_key is not None:
+                # 记录各智能体的输出，用于缓存回放
+                if event["type"] == "agent_start":
+                    transcript.append({"agent": event["agent"], "parts": []})
+                elif event["type"] == "chunk" and transcript:
+                    # 流水线评审模式下两个智能体的片段交替出现，按智能体归属
+                    entry = next((message for message in reversed(transcript) if message["agent"] == event.get("agent")), transcript[-1])
+                    entry["parts"].append(event["content"])
+                elif event["type"] == "error":
+                    failed = True
+            yield event
+
+        if cache_key is not None and transcript and not failed:
+            await self._cache_team_run(cache_key, session_id, transcript)
+
+    async def _cache_team_run(self, cache_key: str, session_id: str, transcript: List[Dict[str, Any]]):
+        """运行结束后保存发言记录和团队状态到响应缓存"""
+        try:
+            checkpoint = await self._load_checkpoint(session_id)
+            extra = {}
+            if checkpoint is not None:
+                state, suspended = checkpoint["state"], True
+                extra = {key: value for key, value in checkpoint.items() if key not in ("state", "pending_input")}
+            else:
+                team = self.sessions.get(session_id)
+                if not isinstance(team, RoundRobinGroupChat):
+                    return
+                state, suspended = await team.save_state(), False
+            self.response_cache.put(cache_key, CachedTeamRun(
+                transcript=[{"agent": message["agent"], "content": "".join(message["parts"])} for message in transcript],
+                state=json.loads(json.dumps(state, default=str)),
+                suspended=suspended,
+                checkpoint_extra=extra,
+            ))
+        except Exception as e:
+            print(f"写入团队响应缓存失败: {str(e)}")
+
+    async def _replay_team_run(self, session_id: str, cached: CachedTeamRun, agent_end_content: Optional[str] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """以原有事件格式回放缓存的团队运行，并恢复运行结束时的会话状态"""
+        end_mode = agent_end_content or self.agent_end_content
+        for message in cached.transcript:
+            agent = message["agent"]
+            yield {
+                "type": "agent_start",
+                "agent": agent,
+                "agent_info": self.agent_info.get(agent, {
+                    "name": agent,
+                    "description": f"{agent}智能体",
+                    "avatar": "🤖",
+                    "color": "#1890ff"
+                }),
+                "content": ""
+            }
+            yield {
+                "type": "chunk",
+                "agent": agent,
+                "content": message["content"]
+            }
+            yield self._agent_end_event(agent, [message["content"]], end_mode)
+
+        state = copy.deepcopy(cached.state)
+        if self.session_store is not None:
+            await self._store_session_record(session_id, "team", state)
+        if cached.suspended:
+            await self.checkpoint_store.set(
+                f"checkpoint:{session_id}",
+                json.dumps({"state": state, "pending_input": None, **cached.checkpoint_extra}, default=str),
+                ex=self.session_persist_ttl
+            )
+            self.session_versions.pop(session_id, None)
+            yield {
+                "type": "user_proxy",
+                "content": "",
+                "agent": "user_proxy",
+                "message": "需要用户审批才能继续",
+                "suspended": True
+            }
         else:
-            agent = self._get_or_create_agent(session_id)
-            use_team = False
+            self.sessions.pop(session_id)
+            team = self._create_team(session_id)
+            await team.load_state(state)
 
+    def _agent_end_event(self, agent: str, parts: List[str], mode: str) -> Dict[str, Any]:
+        """构建 agent_end 事件：完整内容或长度+哈希摘要"""
+        content = "".join(parts).strip()
+        if mode == "digest":
+            return {
+                "type": "agent_end",
+                "agent": agent,
+                "length": len(content),
+                "sha256": hashlib.sha256(content.encode('utf-8')).hexdigest()
+            }
+        return {
+            "type": "agent_end",
+            "agent": agent,
+            "content": content
+        }
+
+    async def _stream_run(
+        self,
+        agent: AssistantAgent | RoundRobinGroupChat,
+        task: str,
+        use_team: bool,
+        session_id: str,
+        agent_end_content: Optional[str] = None,
+        allow_suspend: bool = True,
+        transcript: Optional[List[TextMessage]] = None,
+        on_token: Optional[Callable[[str, str], None]] = None,
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        运行智能体或团队，并将过程转换为前端事件流
+
+        Args:
+            allow_suspend: 挂起模式下运行结束且未批准时是否保存检查点
+            transcript: 提供时收集运行中的完整消息
+            on_token: 提供时对每个流式片段回调 (source, content)
+            cancellation_token: 取消令牌，取消时中止运行
+        """
+        end_mode = agent_end_content or self.agent_end_content
         current_agent = None
-        agent_content = ""
+        # 按片段累积当前智能体的输出，结束时再拼接，避免逐token拼接字符串
+        agent_parts: List[str] = []
+        last_message = ""
 
         try:
             # 使用 run_stream 方法获取流式响应
-            stream = agent.run_stream(task=message)
+            stream = agent.run_stream(task=task, cancellation_token=cancellation_token)
             async for item in stream:
                 if isinstance(item, ModelClientStreamingChunkEvent):
+                    if on_token is not None and item.content:
+                        on_token(item.source, item.content)
                     if use_team:
                         # 团队模式：处理多智能体切换
                         if hasattr(item, 'source') and item.source != current_agent:
                             # 如果之前有智能体在工作，先结束它
                             if current_agent is not None:
-                                yield json.dumps({
-                                    "type": "agent_end",
-                                    "agent": current_agent,
-                                    "content": agent_content.strip()
-                                }) + "\n"
+                                yield self._agent_end_event(current_agent, agent_parts, end_mode)
 
                             # 开始新的智能体
                             current_agent = item.source if hasattr(item, 'source') else "primary"
-                            agent_content = ""
+                            agent_parts = []
 
                             # 发送智能体开始事件
                             agent_data = self.agent_info.get(current_agent, {
@@ -350,52 +699,53 @@ class ChatService:
                                 "color": "#1890ff"
                             })
 
-                            yield json.dumps({
+                            yield {
                                 "type": "agent_start",
                                 "agent": current_agent,
                                 "agent_info": agent_data,
                                 "content": ""
-                            }) + "\n"
+                            }
 
                         # 累积内容并流式输出
                         if item.content:
-                            agent_content += item.content
-                            yield json.dumps({
+                            agent_parts.append(item.content)
+                            yield {
                                 "type": "chunk",
                                 "agent": current_agent or "primary",
                                 "content": item.content
-                            }) + "\n"
+                            }
                     else:
                         # 单智能体模式：直接输出内容
                         if item.content:
-                            yield json.dumps({
+                            yield {
                                 "type": "chunk",
                                 "content": item.content
-                            }) + "\n"
+                            }
                 elif isinstance(item, UserInputRequestedEvent):
                     print(f"收到UserInputRequestedEvent: {item.content}, source: {item.source}")
-                    yield json.dumps({
+                    yield {
                         "type": "user_proxy",
                         "content": item.content,
                         "agent": item.source,
                         "message": "需要用户审批才能继续"
-                    }) + "\n"
+                    }
                 elif isinstance(item, TextMessage):
+                    # 完整消息产出的 chunk 带 final 标记，供计时区分流式片段和随后重复发送的完整消息
+                    last_message = item.content
+                    self.token_usage.record(session_id, item.models_usage)
+                    if transcript is not None:
+                        transcript.append(item)
                     if use_team:
                         # 团队模式：处理完整消息，检查智能体切换
                         message_source = item.source
                         if message_source != current_agent:
                             # 如果之前有智能体在工作，先结束它
                             if current_agent is not None:
-                                yield json.dumps({
-                                    "type": "agent_end",
-                                    "agent": current_agent,
-                                    "content": agent_content.strip()
-                                }) + "\n"
+                                yield self._agent_end_event(current_agent, agent_parts, end_mode)
 
                             # 开始新的智能体
                             current_agent = message_source
-                            agent_content = item.content
+                            agent_parts = [item.content]
 
                             # 发送智能体开始事件
                             agent_data = self.agent_info.get(current_agent, {
@@ -405,41 +755,53 @@ class ChatService:
                                 "color": "#1890ff"
                             })
 
-                            yield json.dumps({
+                            yield {
                                 "type": "agent_start",
                                 "agent": current_agent,
                                 "agent_info": agent_data,
                                 "content": ""
-                            }) + "\n"
+                            }
 
                             # 输出完整内容
-                            yield json.dumps({
+                            yield {
                                 "type": "chunk",
                                 "agent": current_agent,
-                                "content": item.content
-                            }) + "\n"
+                                "content": item.content,
+                                "final": True
+                            }
                         else:
                             # 同一智能体的后续消息
-                            agent_content += item.content
-                            yield json.dumps({
+                            agent_parts.append(item.content)
+                            yield {
                                 "type": "chunk",
                                 "agent": current_agent,
-                                "content": item.content
-                            }) + "\n"
+                                "content": item.content,
+                                "final": True
+                            }
                     else:
                         # 单智能体模式：直接输出内容
-                        yield json.dumps({
+                        yield {
                             "type": "chunk",
-                            "content": item.content
-                        }) + "\n"
+                            "content": item.content,
+                            "final": True
+                        }
 
             # 结束最后一个智能体（仅在团队模式下）
             if use_team and current_agent is not None:
-                yield json.dumps({
-                    "type": "agent_end",
-                    "agent": current_agent,
-                    "content": agent_content.strip()
-                }) + "\n"
+                yield self._agent_end_event(current_agent, agent_parts, end_mode)
+
+            await self._save_session(session_id)
+
+            if use_team and allow_suspend and self.suspend_on_approval and "APPROVE" not in last_message:
+                # 保存检查点并释放运行中的团队，等待用户审批后恢复
+                await self._save_checkpoint(session_id, agent)
+                yield {
+                    "type": "user_proxy",
+                    "content": "",
+                    "agent": "user_proxy",
+                    "message": "需要用户审批才能继续",
+                    "suspended": True
+                }
 
         except Exception as e:
             error_data = {
@@ -448,15 +810,333 @@ class ChatService:
             }
             if use_team:
                 error_data["agent"] = current_agent or "system"
-            yield json.dumps(error_data) + "\n"
+            yield error_data
     
+    async def _review_run(
+        self,
+        team: RoundRobinGroupChat,
+        task: str,
+        requirement: str,
+        session_id: str,
+        agent_end_content: Optional[str] = None,
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        服务端评审模式的团队运行：主智能体生成测试用例，按片段评审（parallel 或 pipelined），再等待用户审批
+
+        Args:
+            task: 本轮交给主智能体的任务
+            requirement: 用户最初的需求，评审时作为上下文
+        """
+        end_mode = agent_end_content or self.agent_end_content
+        while True:
+            reviews: List[Dict[str, Any]] = []
+            result: Dict[str, Any] = {"document": "", "failed": False}
+            if self.team_review_mode == "pipelined":
+                round_events = self._pipelined_round(team, task, requirement, session_id, agent_end_content, reviews, result, cancellation_token)
+            else:
+                round_events = self._parallel_round(team, task, requirement, session_id, agent_end_content, reviews, result, cancellation_token)
+            async for event in round_events:
+                yield event
+            if result["failed"] or not result["document"]:
+                return
+            if all("APPROVE" in review["content"] for review in reviews):
+                return
+            report = self._merge_reviews(reviews)
+
+            if self.suspend_on_approval:
+                await self._save_checkpoint(session_id, team, review=report, requirement=requirement)
+                yield {
+                    "type": "user_proxy",
+                    "content": "",
+                    "agent": "user_proxy",
+                    "message": "需要用户审批才能继续",
+                    "suspended": True
+                }
+                return
+
+            yield {
+                "type": "user_proxy",
+                "content": "",
+                "agent": "user_proxy",
+                "message": "需要用户审批才能继续"
+            }
+            feedback = await self.user_input_callback(session_id, "", cancellation_token)
+            if "APPROVE" in feedback:
+                return
+            task = self._revision_task(report, feedback)
+
+    async def _parallel_round(
+        self,
+        team: RoundRobinGroupChat,
+        task: str,
+        requirement: str,
+        session_id: str,
+        agent_end_content: Optional[str],
+        reviews: List[Dict[str, Any]],
+        result: Dict[str, Any],
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """主智能体完成后并行评审所有片段"""
+        messages: List[TextMessage] = []
+        async for event in self._stream_run(
+            team, task, True, session_id, agent_end_content,
+            allow_suspend=False, transcript=messages, cancellation_token=cancellation_token
+        ):
+            result["failed"] = result["failed"] or event["type"] == "error"
+            yield event
+        result["document"] = next((message.content for message in reversed(messages) if message.source == "primary"), "")
+        if result["failed"] or not result["document"]:
+            return
+        async for event in self._parallel_review(
+            requirement, result["document"], session_id, agent_end_content or self.agent_end_content, reviews, cancellation_token
+        ):
+            yield event
+
+    async def _pipelined_round(
+        self,
+        team: RoundRobinGroupChat,
+        task: str,
+        requirement: str,
+        session_id: str,
+        agent_end_content: Optional[str],
+        reviews: List[Dict[str, Any]],
+        result: Dict[str, Any],
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """主智能体流式输出的同时，评审专家依次评审已经完整输出的表格片段，两者的事件交替输出"""
+        end_mode = agent_end_content or self.agent_end_content
+        output: asyncio.Queue = asyncio.Queue()
+        blocks: asyncio.Queue = asyncio.Queue()
+        splitter = IncrementalReviewSplitter(self.review_max_rows)
+        reviewer = BlockReviewer(
+            self.model_client,
+            CRITIC_SYSTEM_MESSAGE,
+            on_usage=lambda usage: self.token_usage.record(session_id, usage),
+        )
+        messages: List[TextMessage] = []
+
+        def on_token(source: str, content: str):
+            if source == "primary":
+                for block in splitter.feed(content):
+                    blocks.put_nowait(block)
+
+        async def run_primary():
+            try:
+                async for event in self._stream_run(
+                    team, task, True, session_id, agent_end_content,
+                    allow_suspend=False, transcript=messages, on_token=on_token, cancellation_token=cancellation_token
+                ):
+                    result["failed"] = result["failed"] or event["type"] == "error"
+                    await output.put(event)
+            finally:
+                result["document"] = next((message.content for message in reversed(messages) if message.source == "primary"), "")
+                if not splitter.fed and result["document"] and not result["failed"]:
+                    # 模型未流式输出时，整篇切分
+                    splitter.feed(result["document"])
+                if not result["failed"]:
+                    for block in splitter.finish():
+                        blocks.put_nowait(block)
+                blocks.put_nowait(None)
+
+        async def run_critic():
+            parts: List[str] = []
+            while True:
+                block = await blocks.get()
+                if block is None:
+                    break
+                if not parts:
+                    await output.put({
+                        "type": "agent_start",
+                        "agent": "critic",
+                        "agent_info": self.agent_info["critic"],
+                        "content": ""
+                    })
+                index = len(reviews)
+                heading = f"### {index + 1}. {block.title}\n\n"
+                parts.append(heading)
+                await output.put({"type": "chunk", "agent": "critic", "content": heading})
+                review_parts: List[str] = []
+                async for piece in reviewer.review_stream(requirement, block, index, cancellation_token):
+                    review_parts.append(piece)
+                    await output.put({"type": "chunk", "agent": "critic", "content": piece})
+                parts.append("".join(review_parts) + "\n\n")
+                await output.put({"type": "chunk", "agent": "critic", "content": "\n\n"})
+                reviews.append({"index": index, "title": block.title, "content": "".join(review_parts)})
+            if parts:
+                await output.put(self._agent_end_event("critic", parts, end_mode))
+
+        async def run_all():
+            try:
+                await asyncio.gather(run_primary(), run_critic())
+            finally:
+                output.put_nowait(None)
+
+        runner = asyncio.create_task(run_all())
+        try:
+            while True:
+                event = await output.get()
+                if event is None:
+                    break
+                yield event
+            await runner
+        finally:
+            if not runner.done():
+                runner.cancel()
+
+    async def _parallel_review(
+        self,
+        requirement: str,
+        document: str,
+        session_id: str,
+        end_mode: str,
+        reviews: List[Dict[str, Any]],
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """切分测试用例并行评审，以 critic 智能体事件输出，评审结果追加到reviews"""
+        blocks = split_review_blocks(document, self.review_max_rows)
+        reviewer = BlockReviewer(
+            self.model_client,
+            CRITIC_SYSTEM_MESSAGE,
+            max_concurrency=self.review_max_concurrency,
+            on_usage=lambda usage: self.token_usage.record(session_id, usage),
+        )
+        print(f"并行评审: {len(blocks)}个片段，并发{self.review_max_concurrency}")
+
+        yield {
+            "type": "agent_start",
+            "agent": "critic",
+            "agent_info": self.agent_info["critic"],
+            "content": ""
+        }
+        parts: List[str] = []
+        async for review in reviewer.review(requirement, blocks, cancellation_token):
+            reviews.append(review)
+            part = f"### {review['index'] + 1}. {review['title']}\n\n{review['content'].strip()}\n\n"
+            parts.append(part)
+            yield {
+                "type": "chunk",
+                "agent": "critic",
+                "content": part
+            }
+        yield self._agent_end_event("critic", parts, end_mode)
+
+    def _merge_reviews(self, reviews: List[Dict[str, Any]]) -> str:
+        """合并各片段的评审意见"""
+        return "\n\n".join(f"### {review['index'] + 1}. {review['title']}\n\n{review['content'].strip()}" for review in reviews)
+
+    def _revision_task(self, report: str, feedback: str) -> str:
+        """根据评审意见和用户意见生成下一轮交给主智能体的任务"""
+        return f"评审专家的评审意见：\n{report}\n\n用户意见：{feedback}\n\n请根据以上评审意见和用户意见修改测试用例。"
+
+    async def _save_checkpoint(self, session_id: str, team: RoundRobinGroupChat, **extra: Any):
+        """保存等待审批的团队状态，并从内存中释放团队"""
+        state = await team.save_state()
+        await self.checkpoint_store.set(
+            f"checkpoint:{session_id}",
+            json.dumps({"state": state, "pending_input": None, **extra}, default=str),
+            ex=self.session_persist_ttl
+        )
+        self.sessions.pop(session_id)
+        self.session_versions.pop(session_id, None)
+        print(f"团队运行已挂起，等待用户审批: {session_id}")
+
+    async def _load_checkpoint(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self.checkpoint_store.get(f"checkpoint:{session_id}")
+        return json.loads(raw) if raw else None
+
+    async def _delete_checkpoint(self, session_id: str):
+        await self.checkpoint_store.delete(f"checkpoint:{session_id}")
+
+    async def is_suspended(self, session_id: str) -> bool:
+        """会话是否有挂起等待审批的团队运行"""
+        return await self.checkpoint_store.get(f"checkpoint:{session_id}") is not None
+
+    async def resume_stream(self, session_id: str, user_input: Optional[str] = None, agent_end_content: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """恢复挂起的团队运行（每行一个JSON事件）"""
+        async for event in self.resume_events(session_id, user_input, agent_end_content):
+            yield json.dumps(event) + "\n"
+
+    async def resume_events(
+        self,
+        session_id: str,
+        user_input: Optional[str] = None,
+        agent_end_content: Optional[str] = None,
+        cancellation_token: Optional[CancellationToken] = None,
+        include_stats: bool = False
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        从检查点恢复挂起的团队运行
+
+        Args:
+            session_id: 会话ID
+            user_input: 用户反馈，未提供时使用之前通过反馈接口提交的内容
+            agent_end_content: agent_end 事件内容格式 full / digest
+            cancellation_token: 取消令牌，客户端断开时取消
+            include_stats: 是否在末尾追加 stats 事件
+        """
+        timer = RequestTimer("resume", mode="team")
+        events = self._single_flight(session_id, self._resume_events(session_id, user_input, agent_end_content, cancellation_token, timer))
+        async for event in timer.track(events, include_stats):
+            yield event
+
+    async def _resume_events(
+        self,
+        session_id: str,
+        user_input: Optional[str],
+        agent_end_content: Optional[str],
+        cancellation_token: Optional[CancellationToken],
+        timer: RequestTimer
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        with timer.phase("checkpoint_load"):
+            checkpoint = await self._load_checkpoint(session_id)
+        if checkpoint is None:
+            yield {
+                "type": "error",
+                "content": "没有等待审批的运行，可能已过期或已处理"
+            }
+            return
+
+        content = user_input or checkpoint.get("pending_input")
+        if not content:
+            yield {
+                "type": "error",
+                "content": "缺少用户反馈内容"
+            }
+            return
+
+        await self._delete_checkpoint(session_id)
+        if "APPROVE" in content:
+            # 用户批准，流程结束，无需再运行团队
+            return
+
+        with timer.phase("session_load"):
+            self.sessions.pop(session_id)
+            team = self._create_team(session_id)
+            await team.load_state(checkpoint["state"])
+        if checkpoint.get("review") is not None:
+            # 并行评审模式：把评审意见和用户反馈一起交给主智能体
+            run = self._review_run(
+                team,
+                self._revision_task(checkpoint["review"], content),
+                checkpoint.get("requirement") or content,
+                session_id,
+                agent_end_content,
+                cancellation_token
+            )
+        else:
+            run = self._stream_run(team, content, True, session_id, agent_end_content, cancellation_token=cancellation_token)
+        async for event in run:
+            yield event
+
     async def chat(self, message: str, session_id: str = "default") -> str:
         """非流式聊天"""
-        agent = self._get_or_create_agent(session_id)
+        agent = await self._load_session(session_id, use_team=False)
         
         try:
             # 不需要将执行的过程展示给用户
             result = await agent.run(task=message)
+            await self._save_session(session_id)
             # 获取最后一条助手消息
             for msg in reversed(result.messages):
                 if isinstance(msg, TextMessage) and msg.source == "assistant":
@@ -465,25 +1145,109 @@ class ChatService:
         except Exception as e:
             return f"抱歉，处理您的请求时出现了错误：{str(e)}"
     
-    def clear_session(self, session_id: str):
+    async def clear_session(self, session_id: str):
         """清除会话"""
         if session_id in self.sessions:
             del self.sessions[session_id]
+        self.session_versions.pop(session_id, None)
+        self._release_feedback_channel(session_id)
+        self.token_usage.pop(session_id)
+        if self.session_store is not None:
+            await self.session_store.delete(f"session:{session_id}")
+            await self.session_store.delete(f"session:{session_id}:version")
     
     def get_session_count(self) -> int:
         """获取当前会话数量"""
+        self.sessions.purge_expired()
         return len(self.sessions)
 
-    async def file_analysis_stream(self, user_question: str, file_content: str, session_id: str = "default") -> AsyncGenerator[str, None]:
-        """专门用于文件分析的流式聊天"""
+    def get_session_stats(self) -> Dict[str, Any]:
+        """获取会话统计信息"""
+        return {
+            **self.sessions.get_stats(),
+            "max_history_messages": self.max_history_messages,
+            "model_clients": self.model_client_factory.get_stats(),
+            "response_cache": self.response_cache.get_stats() if self.response_cache is not None else None,
+            "context_mode": self.context_mode,
+            "token_usage": self.token_usage.get_stats(),
+        }
+
+    def get_session_usage(self, session_id: str) -> Dict[str, int]:
+        """获取会话累计token消耗"""
+        return self.token_usage.get(session_id)
+
+    async def close(self):
+        """释放模型连接池和会话存储"""
+        await self.model_client_factory.aclose()
+        if self.session_store is not None:
+            await self.session_store.close()
+
+    async def _build_file_context(self, user_question: str, file_content: str, mode: Optional[str] = None) -> str:
+        """
+        构建文件分析的上下文：小文件整篇放入，大文件只放入与问题相关的片段
+
+        Args:
+            user_question: 用户问题
+            file_content: 文件内容
+            mode: full / retrieval / auto，默认使用服务配置
+        """
+        mode = mode or self.file_analysis_mode
+        if mode == "auto":
+            mode = "retrieval" if estimate_tokens(file_content) > self.file_analysis_full_max_tokens else "full"
+        if mode != "retrieval":
+            return f"用户上传了以下文件内容：\n{file_content}"
+
+        # 索引构建是CPU密集操作，放到线程池中避免阻塞事件循环
+        loop = asyncio.get_event_loop()
+        index = await loop.run_in_executor(None, self.retrieval_indexes.get, file_content)
+        chunks = index.search(user_question, self.file_analysis_top_k)
+        excerpts = "\n\n".join(
+            f"[片段 {chunk.index + 1}{' · ' + chunk.heading if chunk.heading else ''}]\n{chunk.text}"
+            for chunk in chunks
+        )
+        return (
+            f"用户上传了一个较长的文件（共{len(index.chunks)}个片段），"
+            f"以下是与用户问题最相关的{len(chunks)}个片段：\n{excerpts}"
+        )
+
+    async def file_analysis_stream(self, user_question: str, file_content: str, session_id: str = "default", mode: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """专门用于文件分析的流式聊天（每行一个JSON事件）"""
+        async for event in self.file_analysis_events(user_question, file_content, session_id, mode):
+            yield json.dumps(event) + "\n"
+
+    async def file_analysis_events(
+        self,
+        user_question: str,
+        file_content: str,
+        session_id: str = "default",
+        mode: Optional[str] = None,
+        cancellation_token: Optional[CancellationToken] = None,
+        include_stats: bool = False
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """专门用于文件分析的流式聊天，产出事件字典；include_stats 时在末尾追加 stats 事件"""
+        timer = RequestTimer("file_analysis")
+        async for event in timer.track(self._file_analysis_events(user_question, file_content, session_id, mode, cancellation_token, timer), include_stats):
+            yield event
+
+    async def _file_analysis_events(
+        self,
+        user_question: str,
+        file_content: str,
+        session_id: str,
+        mode: Optional[str],
+        cancellation_token: Optional[CancellationToken],
+        timer: RequestTimer
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        with timer.phase("file_context"):
+            file_context = await self._build_file_context(user_question, file_content, mode)
+
         # 为每次文件分析创建一个新的智能体，并在系统消息中包含文件内容
         file_analysis_agent = AssistantAgent(
             name="file_analysis_assistant",
             model_client=self.model_client,
             system_message=f"""你是一个专门的文件分析助手。
 
-用户上传了以下文件内容：
-{file_content}
+{file_context}
 
 现在用户会向你提问关于这个文件的问题。请基于文件内容回答用户的问题，但绝对不要在回复中重复显示文件的原始内容。
 
@@ -496,40 +1260,47 @@ class ChatService:
 
         try:
             # 使用 run_stream 方法获取流式响应
-            stream = file_analysis_agent.run_stream(task=analysis_message)
+            stream = file_analysis_agent.run_stream(task=analysis_message, cancellation_token=cancellation_token)
             async for item in stream:
                 if isinstance(item, ModelClientStreamingChunkEvent):
                     if item.content:
-                        yield json.dumps({
+                        yield {
                             "type": "chunk",
                             "content": item.content
-                        }) + "\n"
+                        }
                 elif isinstance(item, TextMessage):
-                    yield json.dumps({
+                    self.token_usage.record(session_id, item.models_usage)
+                    yield {
                         "type": "chunk",
-                        "content": item.content
-                    }) + "\n"
+                        "content": item.content,
+                        "final": True
+                    }
         except Exception as e:
-            yield json.dumps({
+            yield {
                 "type": "error",
                 "content": f"抱歉，处理您的请求时出现了错误：{str(e)}"
-            }) + "\n"
+            }
 
     async def handle_user_proxy_response(self, session_id: str, user_input: str, approved: bool = True):
         """处理用户代理审批响应"""
         try:
-            # 将用户输入存储到会话中，供user_input_callback使用
-            if not hasattr(self, 'user_responses'):
-                self.user_responses = {}
-
-            self.user_responses[session_id] = user_input
+            # 批准时总是发送APPROVE结束流程（附加意见只记录日志），拒绝时将用户意见交给智能体继续修改
+            comment = user_input.strip() if user_input else ""
+            if approved:
+                content = "APPROVE"
+            else:
+                content = comment or "请根据评审意见修改测试用例"
+            suspended = await self.is_suspended(session_id)
+            delivered = await self.put_feedback({"content": content}, session_id)
 
             print(f"收到用户代理响应 - Session: {session_id}, Input: {user_input}, Approved: {approved}")
 
             return {
                 "status": "success",
                 "user_input": user_input,
-                "approved": approved
+                "approved": approved,
+                "delivered": delivered,
+                "resume": suspended
             }
 
         except Exception as e:
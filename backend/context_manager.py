@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from autogen_core.model_context import ChatCompletionContext
+from autogen_core.models import (
+    ChatCompletionClient,
+    FunctionExecutionResultMessage,
+    LLMMessage,
+    RequestUsage,
+    SystemMessage,
+    UserMessage,
+)
+
+from retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """你负责压缩对话历史。请把下面的已有摘要和新的对话内容合并成一份简洁的中文摘要，
+保留用户的需求、关键事实、已经得出的结论、用户偏好和尚未完成的事项，省略寒暄和重复内容，不超过{max_tokens}个字。"""
+
+
+def message_tokens(message: LLMMessage) -> int:
+    """估算单条消息的token数"""
+    content = message.content
+    if isinstance(content, str):
+        return estimate_tokens(content) + 4
+    if isinstance(content, list):
+        return sum(estimate_tokens(str(getattr(item, "content", item))) for item in content) + 4
+    return estimate_tokens(str(content)) + 4
+
+
+def _message_text(message: LLMMessage) -> str:
+    source = getattr(message, "source", None) or type(message).__name__
+    content = message.content
+    if not isinstance(content, str):
+        content = str(content)
+    return f"[{source}] {content}"
+
+
+class SummarizingChatCompletionContext(ChatCompletionContext):
+    """
+    按token预算截取的模型上下文，超出预算的较早消息由模型压缩成摘要
+
+    发送给模型的是“摘要 + 预算内最近的消息”，因此每轮请求的大小有上限，与会话长度无关。
+    摘要在后台生成，不阻塞当前请求；摘要完成前较早的消息只是不发送，不会丢失。
+    """
+
+    def __init__(
+        self,
+        model_client: ChatCompletionClient,
+        token_budget: int = 6000,
+        summary_max_tokens: int = 800,
+        on_usage: Optional[Callable[[RequestUsage], None]] = None,
+        initial_messages: Optional[List[LLMMessage]] = None,
+    ):
+        """
+        初始化上下文
+
+        Args:
+            model_client: 用于生成摘要的模型客户端
+            token_budget: 每次请求发送的历史消息token预算（不含摘要）
+            summary_max_tokens: 摘要长度上限
+            on_usage: 生成摘要消耗token时的回调，用于会话token统计
+        """
+        super().__init__(initial_messages)
+        self._model_client = model_client
+        self._token_budget = token_budget
+        self._summary_max_tokens = summary_max_tokens
+        self._on_usage = on_usage
+        self._summary = ""
+        self._summary_task: Optional[asyncio.Task] = None
+        # clear / load_state 后递增，作废进行中的摘要结果
+        self._generation = 0
+
+    async def add_message(self, message: LLMMessage) -> None:
+        await super().add_message(message)
+        self._maybe_summarize()
+
+    async def get_messages(self) -> List[LLMMessage]:
+        window = self._window_start()
+        messages = self._messages[window:]
+        if self._summary:
+            return [SystemMessage(content=f"以下是之前对话的摘要：\n{self._summary}")] + messages
+        return messages
+
+    async def clear(self) -> None:
+        await super().clear()
+        self._summary = ""
+        self._generation += 1
+
+    async def save_state(self) -> Mapping[str, Any]:
+        state = dict(await super().save_state())
+        state["summary"] = self._summary
+        return state
+
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        await super().load_state({"messages": state.get("messages", [])})
+        self._summary = state.get("summary", "")
+        self._generation += 1
+
+    def _window_start(self) -> int:
+        """返回预算内最近消息的起始下标（至少保留最后一条）"""
+        total = 0
+        start = len(self._messages)
+        while start > 0:
+            cost = message_tokens(self._messages[start - 1])
+            if total + cost > self._token_budget and start < len(self._messages):
+                break
+            total += cost
+            start -= 1
+        # 工具结果不能脱离对应的调用单独出现
+        while start < len(self._messages) - 1 and isinstance(self._messages[start], FunctionExecutionResultMessage):
+            start += 1
+        return start
+
+    def _maybe_summarize(self):
+        if self._summary_task is not None and not self._summary_task.done():
+            return
+        if sum(message_tokens(message) for message in self._messages) <= self._token_budget:
+            return
+        # 保留一半预算的最近消息原文，更早的部分压缩进摘要
+        total = 0
+        cut = len(self._messages)
+        while cut > 0 and total + message_tokens(self._messages[cut - 1]) <= self._token_budget // 2:
+            total += message_tokens(self._messages[cut - 1])
+            cut -= 1
+        # 与滑动窗口一致，至少保留最后一条消息原文
+        cut = min(cut, len(self._messages) - 1)
+        while cut < len(self._messages) - 1 and isinstance(self._messages[cut], FunctionExecutionResultMessage):
+            cut += 1
+        if cut <= 0:
+            return
+        self._summary_task = asyncio.create_task(self._summarize(cut, self._generation))
+
+    async def _summarize(self, cut: int, generation: int):
+        older = self._messages[:cut]
+        transcript = "\n".join(_message_text(message) for message in older)
+        prompt = SUMMARY_PROMPT.format(max_tokens=self._summary_max_tokens)
+        start = time.time()
+        try:
+            result = await self._model_client.create([
+                SystemMessage(content=prompt),
+                UserMessage(content=f"已有摘要：\n{self._summary or '（无）'}\n\n新的对话内容：\n{transcript}", source="user"),
+            ])
+        except Exception as e:
+            logger.warning(f"生成对话摘要失败，继续使用滑动窗口: {str(e)}")
+            return
+        if self._on_usage is not None and result.usage is not None:
+            self._on_usage(result.usage)
+        if generation != self._generation or not isinstance(result.content, str):
+            return
+        self._summary = result.content.strip()
+        # 生成摘要期间只会追加新消息，前cut条仍是被压缩的那部分
+        del self._messages[:cut]
+        logger.info(f"对话历史已压缩: {cut}条消息 -> 摘要{estimate_tokens(self._summary)} tokens，耗时{time.time() - start:.1f}秒")
+
+
+class TokenUsageTracker:
+    """按会话统计token消耗（模型返回的usage），只保留最近活跃的若干会话"""
+
+    def __init__(self, max_sessions: int = 10000):
+        self.max_sessions = max_sessions
+        self._usage: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+
+    def record(self, session_id: str, usage: Optional[RequestUsage], kind: str = "chat"):
+        if usage is None:
+            return
+        entry = self._usage.get(session_id)
+        if entry is None:
+            entry = {"prompt_tokens": 0, "completion_tokens": 0, "requests": 0, "summary_requests": 0}
+            self._usage[session_id] = entry
+            while len(self._usage) > self.max_sessions:
+                self._usage.popitem(last=False)
+        else:
+            self._usage.move_to_end(session_id)
+        entry["prompt_tokens"] += usage.prompt_tokens
+        entry["completion_tokens"] += usage.completion_tokens
+        entry["requests" if kind == "chat" else "summary_requests"] += 1
+
+    def get(self, session_id: str) -> Dict[str, int]:
+        entry = self._usage.get(session_id)
+        if entry is None:
+            return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "requests": 0, "summary_requests": 0}
+        return {**entry, "total_tokens": entry["prompt_tokens"] + entry["completion_tokens"]}
+
+    def pop(self, session_id: str):
+        self._usage.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "tracked_sessions": len(self._usage),
+            "prompt_tokens": sum(entry["prompt_tokens"] for entry in self._usage.values()),
+            "completion_tokens": sum(entry["completion_tokens"] for entry in self._usage.values()),
+        }
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 缓存格式版本，格式变化时递增以使旧缓存失效
+CACHE_FORMAT_VERSION = 1
+
+# 影响Marker输出结果的配置项，参与缓存键计算
+CACHE_KEY_CONFIG_FIELDS = (
+    "use_llm",
+    "llm_service",
+    "openai_model",
+    "openai_base_url",
+    "ollama_model",
+    "output_format",
+    "extract_images",
+    "disable_image_extraction",
+    "max_pages",
+)
+
+MANIFEST_NAME = "manifest.json"
+CONTENT_NAME = "content.md"
+IMAGES_DIR = "images"
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp')
+
+
+class DocumentCache:
+    """基于文件内容哈希的文档提取结果缓存（磁盘持久化，LRU + 容量上限淘汰）"""
+
+    def __init__(self, cache_dir: str = "cache/marker", max_bytes: int = 1024 * 1024 * 1024, max_entries: int = 500):
+        """
+        初始化文档缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+            max_entries: 缓存条目数上限
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> 条目大小，按访问顺序排列（最久未使用的在前）
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    @classmethod
+    def from_env(cls) -> Optional["DocumentCache"]:
+        """根据环境变量创建缓存，MARKER_CACHE_ENABLED=false 时返回None"""
+        if os.getenv("MARKER_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+            return None
+        try:
+            return cls(
+                cache_dir=os.getenv("MARKER_CACHE_DIR", "cache/marker"),
+                max_bytes=int(os.getenv("MARKER_CACHE_MAX_MB", "1024")) * 1024 * 1024,
+                max_entries=int(os.getenv("MARKER_CACHE_MAX_ENTRIES", "500")),
+            )
+        except Exception as e:
+            logger.error(f"初始化文档缓存失败: {str(e)}")
+            return None
+
+    @staticmethod
+    def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+        """计算文件内容的SHA256"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(chunk_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, config: Dict) -> str:
+        """根据内容哈希和相关配置生成缓存键"""
+        relevant = {field: config.get(field) for field in CACHE_KEY_CONFIG_FIELDS}
+        payload = json.dumps(
+            {"v": CACHE_FORMAT_VERSION, "hash": content_hash, "config": relevant},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict, Dict]]:
+        """
+        读取缓存
+
+        Returns:
+            (text, metadata, images)，未命中时返回None
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        entry_dir = self.cache_dir / key
+        try:
+            with open(entry_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            with open(entry_dir / CONTENT_NAME, 'r', encoding='utf-8') as f:
+                text = f.read()
+            images = {
+                name: self._load_image(entry_dir / IMAGES_DIR / stored)
+                for name, stored in manifest.get("images", {}).items()
+            }
+            # 更新修改时间，使重启后仍能恢复LRU顺序
+            os.utime(entry_dir / MANIFEST_NAME)
+        except Exception as e:
+            logger.warning(f"读取文档缓存失败，丢弃条目 {key}: {str(e)}")
+            self._remove(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return text, manifest.get("metadata", {}), images
+
+    def put(self, key: str, text: str, metadata: Dict, images: Dict):
+        """写入缓存，失败时只记录日志，不影响主流程"""
+        tmp_dir = self.cache_dir / f".tmp-{key}-{uuid.uuid4().hex}"
+        try:
+            (tmp_dir / IMAGES_DIR).mkdir(parents=True)
+            with open(tmp_dir / CONTENT_NAME, 'w', encoding='utf-8') as f:
+                f.write(text)
+
+            stored_images = {}
+            for index, (name, image) in enumerate((images or {}).items()):
+                suffix = Path(name).suffix.lower()
+                stored_name = f"{index}{suffix if suffix in IMAGE_SUFFIXES else '.png'}"
+                self._save_image(image, tmp_dir / IMAGES_DIR / stored_name)
+                stored_images[name] = stored_name
+
+            with open(tmp_dir / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+                json.dump({"metadata": metadata or {}, "images": stored_images}, f, ensure_ascii=False, default=str)
+
+            size = self._dir_size(tmp_dir)
+            entry_dir = self.cache_dir / key
+            with self._lock:
+                if key in self._entries:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    self._entries.move_to_end(key)
+                    return
+                os.replace(tmp_dir, entry_dir)
+                self._entries[key] = size
+                self._total_bytes += size
+            self._evict()
+        except Exception as e:
+            logger.warning(f"写入文档缓存失败: {str(e)}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            keys = list(self._entries.keys())
+        for key in keys:
+            self._remove(key)
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _load_index(self):
+        """启动时扫描缓存目录，按最近访问时间重建LRU索引"""
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            if not entry_dir.is_dir():
+                continue
+            if entry_dir.name.startswith(".tmp-"):
+                # 清理上次异常退出留下的临时目录
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            manifest = entry_dir / MANIFEST_NAME
+            if not manifest.exists():
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            entries.append((manifest.stat().st_mtime, entry_dir.name, self._dir_size(entry_dir)))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        """按LRU顺序淘汰超出容量限制的条目"""
+        while True:
+            with self._lock:
+                over_limit = len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+                if not over_limit or not self._entries:
+                    return
+                key = next(iter(self._entries))
+            self._remove(key)
+
+    def _remove(self, key: str):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._total_bytes -= size
+        shutil.rmtree(self.cache_dir / key, ignore_errors=True)
+
+    @staticmethod
+    def _dir_size(path: Path) -> int:
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+    @staticmethod
+    def _save_image(image, path: Path):
+        if isinstance(image, (bytes, bytearray)):
+            with open(path, 'wb') as f:
+                f.write(image)
+        else:
+            # PIL图像，按扩展名推断格式
+            image.save(path)
+
+    @staticmethod
+    def _load_image(path: Path):
+        try:
+            from PIL import Image
+        except ImportError:
+            with open(path, 'rb') as f:
+                return f.read()
+        image = Image.open(path)
+        image.load()
+        return image
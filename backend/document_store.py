@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StoredDocument:
+    """服务端保存的已解析文档"""
+    doc_id: str
+    content: str
+    metadata: Dict = field(default_factory=dict)
+    created_at: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.content.encode('utf-8'))
+
+
+class DocumentStore:
+    """
+    已解析文档存储：磁盘持久化 + 内存热点缓存，按空闲TTL过期、按容量淘汰
+
+    文档文件的读写在线程池中执行，不阻塞事件循环；索引只在事件循环中修改
+    """
+
+    def __init__(
+        self,
+        store_dir: str = "documents",
+        ttl_seconds: int = 24 * 3600,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 512 * 1024 * 1024
+    ):
+        """
+        初始化文档存储
+
+        Args:
+            store_dir: 文档保存目录
+            ttl_seconds: 文档空闲过期时间（秒），每次访问后重新计时
+            max_memory_bytes: 内存缓存的文档总大小上限
+            max_disk_bytes: 磁盘上的文档总大小上限
+        """
+        self.store_dir = Path(store_dir)
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        # 内存热点缓存：doc_id -> 文档，按访问顺序排列
+        self._memory: "OrderedDict[str, StoredDocument]" = OrderedDict()
+        self._memory_bytes = 0
+        # 磁盘索引：doc_id -> (文件大小, 最近访问时间)，按访问顺序排列
+        self._disk: "OrderedDict[str, tuple]" = OrderedDict()
+        self._disk_bytes = 0
+
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    async def put(self, content: str, metadata: Optional[Dict] = None) -> str:
+        """保存文档，返回文档ID"""
+        doc = StoredDocument(
+            doc_id=uuid.uuid4().hex,
+            content=content,
+            metadata=metadata or {},
+            created_at=time.time(),
+        )
+        loop = asyncio.get_running_loop()
+        disk_size = await loop.run_in_executor(None, self._write_file, doc)
+
+        self._disk[doc.doc_id] = (disk_size, time.time())
+        self._disk_bytes += disk_size
+        self._cache_in_memory(doc)
+        self._evict()
+        return doc.doc_id
+
+    async def get(self, doc_id: str) -> Optional[StoredDocument]:
+        """读取文档，不存在或已过期时返回None"""
+        self._purge_expired()
+        if doc_id not in self._disk:
+            return None
+
+        size, _ = self._disk[doc_id]
+        self._disk[doc_id] = (size, time.time())
+        self._disk.move_to_end(doc_id)
+
+        loop = asyncio.get_running_loop()
+        doc = self._memory.get(doc_id)
+        if doc is not None:
+            self._memory.move_to_end(doc_id)
+        else:
+            try:
+                doc = await loop.run_in_executor(None, self._read_file, doc_id)
+            except Exception as e:
+                logger.warning(f"读取文档失败，丢弃 {doc_id}: {str(e)}")
+                self.delete(doc_id)
+                return None
+            if doc_id not in self._disk:
+                # 读取期间文档已被删除或淘汰
+                return None
+            if doc_id not in self._memory:
+                self._cache_in_memory(doc)
+                self._evict()
+
+        # 更新修改时间，使重启后仍能恢复访问时间
+        await loop.run_in_executor(None, self._touch, doc_id)
+        return doc
+
+    def delete(self, doc_id: str) -> bool:
+        """删除文档"""
+        doc = self._memory.pop(doc_id, None)
+        if doc is not None:
+            self._memory_bytes -= doc.size
+        entry = self._disk.pop(doc_id, None)
+        if entry is None:
+            return False
+        self._disk_bytes -= entry[0]
+        try:
+            self._path(doc_id).unlink()
+        except FileNotFoundError:
+            pass
+        return True
+
+    def get_stats(self) -> Dict:
+        """获取存储统计信息"""
+        return {
+            "documents": len(self._disk),
+            "memory_documents": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+            "max_memory_bytes": self.max_memory_bytes,
+            "max_disk_bytes": self.max_disk_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+    def _path(self, doc_id: str) -> Path:
+        return self.store_dir / f"{doc_id}.json"
+
+    def _write_file(self, doc: StoredDocument) -> int:
+        """写入文档文件（先写临时文件再替换），返回文件大小"""
+        path = self._path(doc.doc_id)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"content": doc.content, "metadata": doc.metadata, "created_at": doc.created_at}, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+        return path.stat().st_size
+
+    def _read_file(self, doc_id: str) -> StoredDocument:
+        with open(self._path(doc_id), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return StoredDocument(doc_id=doc_id, content=data["content"], metadata=data.get("metadata", {}), created_at=data.get("created_at", 0.0))
+
+    def _touch(self, doc_id: str):
+        try:
+            os.utime(self._path(doc_id))
+        except OSError:
+            pass
+
+    def _cache_in_memory(self, doc: StoredDocument):
+        if doc.size > self.max_memory_bytes:
+            return
+        self._memory[doc.doc_id] = doc
+        self._memory_bytes += doc.size
+
+    def _load_index(self):
+        """启动时扫描目录重建磁盘索引"""
+        entries = []
+        for path in self.store_dir.glob("*.json"):
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for tmp_path in self.store_dir.glob("*.tmp"):
+            tmp_path.unlink()
+
+        for mtime, doc_id, size in sorted(entries):
+            self._disk[doc_id] = (size, mtime)
+            self._disk_bytes += size
+        self._purge_expired()
+        self._evict()
+
+    def _purge_expired(self):
+        """删除空闲超时的文档（索引按访问顺序排列，过期的都在前面）"""
+        deadline = time.time() - self.ttl_seconds
+        while self._disk:
+            doc_id, (_, last_access) = next(iter(self._disk.items()))
+            if last_access >= deadline:
+                break
+            self.delete(doc_id)
+
+    def _evict(self):
+        """按LRU顺序淘汰超出内存和磁盘容量限制的文档"""
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, doc = self._memory.popitem(last=False)
+            self._memory_bytes -= doc.size
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            self.delete(next(iter(self._disk)))
+
+
+# 创建全局实例
+document_store = DocumentStore(
+    store_dir=os.getenv("DOCUMENT_STORE_DIR", "documents"),
+    ttl_seconds=int(os.getenv("DOCUMENT_TTL_SECONDS", str(24 * 3600))),
+    max_memory_bytes=int(os.getenv("DOCUMENT_STORE_MEMORY_MB", "64")) * 1024 * 1024,
+    max_disk_bytes=int(os.getenv("DOCUMENT_STORE_DISK_MB", "512")) * 1024 * 1024,
+)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import time
+import cProfile
+import logging
+import functools
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from metrics import metrics_registry, RATE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+EXTRACTIONS = metrics_registry.counter(
+    "document_extractions_total", "文档提取次数（按格式、提取方式和结果）", ("format", "method", "status"))
+EXTRACTION_DURATION = metrics_registry.histogram(
+    "document_extraction_duration_seconds", "单个文档提取总耗时", ("format", "method"))
+EXTRACTION_STAGE_DURATION = metrics_registry.histogram(
+    "document_extraction_stage_seconds", "文档提取各阶段耗时", ("format", "stage"))
+EXTRACTION_BYTES = metrics_registry.counter(
+    "document_extraction_bytes_total", "文档提取输入文件字节数（in）和输出文本字节数（out）", ("format", "direction"))
+EXTRACTION_PAGES = metrics_registry.counter(
+    "document_extraction_pages_total", "已提取的PDF页数", ("format", "method"))
+EXTRACTION_PAGES_PER_SECOND = metrics_registry.histogram(
+    "document_extraction_pages_per_second", "PDF提取速度（页/秒）", ("method",), buckets=RATE_BUCKETS)
+EXTRACTION_CACHE_HITS = metrics_registry.counter(
+    "document_extraction_cache_hits_total", "命中提取结果缓存的次数", ("format",))
+
+_UNSAFE_FILENAME = re.compile(r'[^\w.-]+')
+
+_current_trace: ContextVar[Optional["ExtractionTrace"]] = ContextVar("extraction_trace", default=None)
+
+
+class ExtractionTrace:
+    """
+    单个文档提取过程的分阶段计时和计数，结束时写入全局指标并附加到结果元数据
+
+    开启采样时，用cProfile记录各阶段中的同步处理（模型推理、文本解析等），
+    生成的 .prof 文件可以用 pstats / snakeviz 查看
+    """
+
+    def __init__(self, filename: str, bytes_in: int = 0, profile: bool = False, profile_dir: str = "profiles", profile_min_seconds: float = 0.0):
+        self.filename = filename
+        self.format = Path(filename).suffix.lower().lstrip('.') or "unknown"
+        self.bytes_in = bytes_in
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self.profile_dir = profile_dir
+        self.profile_min_seconds = profile_min_seconds
+
+    @classmethod
+    def from_env(cls, file_path: str, filename: str, profile: Optional[bool] = None) -> "ExtractionTrace":
+        """
+        创建提取追踪
+
+        Args:
+            profile: 是否采样，None 时由环境变量决定：设置了 EXTRACTION_PROFILE_DIR 即开启，
+                     只保存耗时超过 EXTRACTION_PROFILE_MIN_SECONDS 的文档；显式传 True 时总是保存
+        """
+        profile_dir = os.getenv("EXTRACTION_PROFILE_DIR", "")
+        min_seconds = float(os.getenv("EXTRACTION_PROFILE_MIN_SECONDS", "0"))
+        if profile is None:
+            profile = bool(profile_dir)
+        else:
+            min_seconds = 0.0
+        try:
+            bytes_in = os.path.getsize(file_path)
+        except OSError:
+            bytes_in = 0
+        return cls(filename, bytes_in, profile, profile_dir or "profiles", min_seconds)
+
+    @contextmanager
+    def activate(self) -> Iterator["ExtractionTrace"]:
+        """设为当前追踪，期间 stage() / profiled() 记录到这里"""
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    @contextmanager
+    def stage(self, name: str, profile: bool = False) -> Iterator[None]:
+        """
+        记录一个阶段的耗时
+
+        Args:
+            profile: 是否在当前线程中采样；只能用于不包含 await 的同步代码块，否则会采到其他请求
+        """
+        start = time.perf_counter()
+        profiling = profile and self._enable_profiler()
+        try:
+            yield
+        finally:
+            if profiling:
+                self.profiler.disable()
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def profiled(self, func: Callable) -> Callable:
+        """包装在线程池中执行的同步函数，使其在执行线程中被采样"""
+        if self.profiler is None:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any):
+            profiling = self._enable_profiler()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if profiling:
+                    self.profiler.disable()
+        return wrapper
+
+    def _enable_profiler(self) -> bool:
+        if self.profiler is None:
+            return False
+        try:
+            self.profiler.enable()
+            return True
+        except ValueError as e:
+            # 同一线程中已有其他采样在进行
+            logger.debug(f"跳过采样: {str(e)}")
+            return False
+
+    def finish(self, result: Dict) -> Dict:
+        """写入全局指标，并把本次提取的统计附加到 result['metadata']['extraction_stats']"""
+        total = time.perf_counter() - self.start
+        metadata = result.get('metadata')
+        if metadata is None:
+            metadata = result['metadata'] = {}
+        success = result.get('success', False)
+        method = metadata.get('extraction_method', 'none')
+        content = result.get('content') or ''
+        bytes_out = len(content.encode('utf-8'))
+        pages = metadata.get('pages') or 0
+
+        EXTRACTIONS.inc(format=self.format, method=method, status="ok" if success else "error")
+        EXTRACTION_DURATION.observe(total, format=self.format, method=method)
+        for name, duration in self.stages.items():
+            EXTRACTION_STAGE_DURATION.observe(duration, format=self.format, stage=name)
+        EXTRACTION_BYTES.inc(self.bytes_in, format=self.format, direction="in")
+        EXTRACTION_BYTES.inc(bytes_out, format=self.format, direction="out")
+        if metadata.get('cache_hit'):
+            EXTRACTION_CACHE_HITS.inc(format=self.format)
+
+        pages_per_second = None
+        if success and pages:
+            EXTRACTION_PAGES.inc(pages, format=self.format, method=method)
+            if total > 0 and not metadata.get('cache_hit'):
+                pages_per_second = pages / total
+                EXTRACTION_PAGES_PER_SECOND.observe(pages_per_second, method=method)
+
+        stats = {
+            'total_seconds': round(total, 4),
+            'stages': {name: round(duration, 4) for name, duration in self.stages.items()},
+            'bytes_in': self.bytes_in,
+            'bytes_out': bytes_out,
+            'pages_per_second': round(pages_per_second, 2) if pages_per_second is not None else None,
+        }
+        profile_path = self._dump_profile(total)
+        if profile_path:
+            stats['profile'] = profile_path
+        metadata['extraction_stats'] = stats
+        return result
+
+    def _dump_profile(self, total: float) -> Optional[str]:
+        if self.profiler is None or total < self.profile_min_seconds:
+            return None
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = _UNSAFE_FILENAME.sub('_', Path(self.filename).name)
+            path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{name}.prof")
+            self.profiler.dump_stats(path)
+        except Exception as e:
+            logger.warning(f"保存提取采样失败: {str(e)}")
+            return None
+        logger.info(f"文档提取耗时{total:.2f}秒，采样已保存: {path}")
+        return path
+
+
+def stage(name: str, profile: bool = False):
+    """在当前追踪中记录阶段耗时，没有进行中的追踪时不做任何事"""
+    trace = _current_trace.get()
+    return trace.stage(name, profile) if trace is not None else nullcontext()
+
+
+def profiled(func: Callable) -> Callable:
+    """当前追踪开启采样时包装线程池中执行的同步函数"""
+    trace = _current_trace.get()
+    return trace.profiled(func) if trace is not None else func
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 路由规则：同时命中 trigger、action、object 且未命中 exclude 时使用测试团队
+DEFAULT_RULES: Dict[str, List[str]] = {
+    "trigger": [
+        # 明确的测试用例设计请求
+        "设计测试用例", "编写测试用例", "写测试用例", "制定测试用例",
+        "创建测试用例", "生成测试用例", "测试用例设计", "测试用例编写",
+        "测试用例", "用例设计", "用例编写", "用例制定", "用例创建",
+        # 明确的测试计划/方案设计
+        "设计测试计划", "编写测试计划", "制定测试计划", "测试计划设计",
+        "设计测试方案", "编写测试方案", "制定测试方案", "测试方案设计",
+        "测试计划", "测试方案", "测试策略",
+        # 测试相关的动作词
+        "测试", "用例", "test case", "test plan", "testing",
+        # 英文版本
+        "design test case", "write test case", "create test case",
+        "test case design", "test plan design", "design test plan",
+    ],
+    "exclude": [
+        # 简历相关
+        "简历", "resume", "cv", "工作经历", "项目经验",
+        # 面试相关
+        "面试", "求职", "招聘", "职位", "岗位", "人才", "候选人",
+        # 纯文档分析（不涉及测试设计）
+        "分析这个文档", "总结这个文件", "评价这个材料", "这个文档说了什么",
+        "文档内容", "文件内容", "材料内容",
+    ],
+    "action": [
+        "设计", "编写", "写", "制定", "创建", "生成", "帮我", "请", "如何",
+        "design", "write", "create", "generate", "help", "how to",
+    ],
+    "object": [
+        "测试用例", "测试计划", "测试方案", "用例", "测试",
+        "test case", "test plan", "testing", "test",
+    ],
+}
+
+CATEGORIES = ("trigger", "exclude", "action", "object")
+
+
+@dataclass
+class RoutingDecision:
+    """路由结果及命中的关键词"""
+    use_team: bool
+    reason: str
+    evidence: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def _trie_pattern(keywords: Iterable[str]) -> str:
+    """把关键词构建成前缀树再转成正则，分支按最长优先匹配"""
+    trie: Dict = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        terminal = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char != ""]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if terminal:
+            # 可选分支贪婪匹配，保证先尝试更长的关键词
+            body = f"(?:{body})?" if len(branches) == 1 and len(branches[0]) > 1 else f"{body}?"
+        return body
+
+    return build(trie)
+
+
+class IntentRouter:
+    """
+    预编译的意图路由器
+
+    所有类别的关键词合并成一个前缀树正则，对消息只扫描一遍。正则在每个位置只返回最长的关键词，
+    因此预先计算每个关键词所包含的其他关键词（子串闭包），命中长关键词即视为同时命中其子串；
+    每次命中后从下一个字符继续搜索，不会漏掉相互重叠的关键词，结果与逐个 `in` 判断完全一致。
+    """
+
+    def __init__(self, rules: Optional[Dict[str, List[str]]] = None):
+        rules = rules or DEFAULT_RULES
+        self.rules: Dict[str, List[str]] = {
+            category: [keyword.lower() for keyword in rules.get(category, []) if keyword]
+            for category in CATEGORIES
+        }
+
+        keyword_categories: Dict[str, Set[str]] = {}
+        for category, keywords in self.rules.items():
+            for keyword in keywords:
+                keyword_categories.setdefault(keyword, set()).add(category)
+
+        # 关键词 -> 命中它即同时命中的 (类别, 关键词)
+        self._closure: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+        for keyword in keyword_categories:
+            self._closure[keyword] = tuple(
+                (category, other)
+                for other, categories in keyword_categories.items() if other in keyword
+                for category in categories
+            )
+
+        pattern = _trie_pattern(keyword_categories)
+        self._regex = re.compile(pattern) if pattern else None
+
+    @classmethod
+    def from_file(cls, path: str) -> "IntentRouter":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_env(cls) -> "IntentRouter":
+        """INTENT_ROUTER_RULES 指向JSON规则文件时从文件加载，否则使用默认规则"""
+        path = os.getenv("INTENT_ROUTER_RULES")
+        if path:
+            try:
+                return cls.from_file(path)
+            except Exception as e:
+                logger.error(f"加载路由规则失败，使用默认规则: {str(e)}")
+        return cls()
+
+    def match(self, message: str) -> Dict[str, List[str]]:
+        """单遍扫描消息，返回各类别命中的关键词"""
+        found: Dict[str, Set[str]] = {category: set() for category in CATEGORIES}
+        if self._regex is None:
+            return {category: [] for category in CATEGORIES}
+        text = message.lower()
+        seen: Set[str] = set()
+        match = self._regex.search(text)
+        while match is not None:
+            keyword = match.group()
+            if keyword not in seen:
+                seen.add(keyword)
+                for category, other in self._closure[keyword]:
+                    found[category].add(other)
+            # 命中通常很少，从命中位置的下一个字符继续，以找到重叠的关键词
+            match = self._regex.search(text, match.start() + 1)
+        return {category: sorted(keywords) for category, keywords in found.items()}
+
+    def route(self, message: str) -> RoutingDecision:
+        """判断是否应该使用测试用例编写团队"""
+        evidence = self.match(message)
+        if not evidence["trigger"]:
+            reason = "no_trigger"
+        elif evidence["exclude"]:
+            reason = "excluded"
+        elif not evidence["action"]:
+            reason = "no_action"
+        elif not evidence["object"]:
+            reason = "no_object"
+        else:
+            reason = "test_design"
+        return RoutingDecision(use_team=reason == "test_design", reason=reason, evidence=evidence)
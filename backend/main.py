@@ -1,16 +1,26 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import json
-from typing import AsyncGenerator, Optional
+import math
+import os
+from typing import Any, AsyncGenerator, Dict, Literal, Optional
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from autogen_core import CancellationToken
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.types import Receive, Scope, Send
 
 from chat_service import ChatService
 from test_chat_service import test_chat_service
 from file_service import file_service
+from marker_service import marker_service
+from upload_service import upload_service, UploadTooLargeError, UploadSizeLimitMiddleware
+from document_store import document_store
+from stream_encoder import stream_encoder
+from admission import admission_controller, AdmissionTicket, AdmissionQueueFull, RateLimitExceeded
+from metrics import metrics_registry
 
 app = FastAPI(title="AutoGen Chat API", version="1.0.0")
 
@@ -23,21 +33,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 上传接口在接收请求体时就检查大小，超限的文件不会被完整读取和落盘
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=("/upload", "/upload/stream"),
+    max_bytes=upload_service.max_bytes,
+)
+
 # 初始化聊天服务
 chat_service = ChatService()
 
 class ChatRequest(BaseModel):
     message: str
     session_id: str = "default"
+    # agent_end 事件内容：full（完整内容）/ digest（只含长度和sha256），默认使用服务配置
+    agent_end_content: Optional[Literal["full", "digest"]] = None
+    # 在流末尾追加 stats 事件（首段输出耗时、输出速度、各智能体耗时等）
+    include_stats: bool = False
 
 
 
 class FileAnalysisRequest(BaseModel):
     message: str
     session_id: str = "default"
-    file_name: str
-    file_type: str
-    file_content: str
+    file_name: Optional[str] = None
+    file_type: Optional[str] = None
+    # 优先使用上传接口返回的document_id，file_content仅为兼容旧客户端
+    document_id: Optional[str] = None
+    file_content: Optional[str] = None
+    include_stats: bool = False
 
 class ChatResponse(BaseModel):
     content: str
@@ -49,6 +73,7 @@ class FileUploadResponse(BaseModel):
     message: str
     file_info: Optional[dict] = None
     content: Optional[str] = None
+    document_id: Optional[str] = None
 
 class MarkerConfigRequest(BaseModel):
     enable_llm: bool = False
@@ -65,35 +90,182 @@ class UserProxyResponse(BaseModel):
 
 class UserFeedback(BaseModel):
     content: str
+    session_id: str = "default"
+
+class ResumeRequest(BaseModel):
+    session_id: str = "default"
+    user_input: Optional[str] = None
+    agent_end_content: Optional[Literal["full", "digest"]] = None
+    include_stats: bool = False
+
+async def sweep_sessions(interval: int = 60):
+    """定期清理空闲超时的会话"""
+    while True:
+        await asyncio.sleep(interval)
+        chat_service.sessions.purge_expired()
+
+@app.on_event("startup")
+async def startup_event():
+    # 可选：服务启动后在后台预热Marker模型
+    if os.getenv("MARKER_WARMUP", "false").lower() in ("1", "true", "yes"):
+        marker_service.start_background_warmup()
+    app.state.session_sweeper = asyncio.create_task(sweep_sessions())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    marker_service.shutdown()
+    await chat_service.close()
 
 @app.get("/")
 async def root():
     return {"message": "AutoGen Chat API is running"}
 
+async def watch_disconnect(http_request: Request, cancellation_token: CancellationToken, interval: float = 1.0):
+    """轮询客户端连接状态，断开时取消运行"""
+    while not cancellation_token.is_cancelled():
+        if await http_request.is_disconnected():
+            print("客户端已断开，取消运行")
+            cancellation_token.cancel()
+            return
+        await asyncio.sleep(interval)
+
+async def guard_disconnect(
+    http_request: Request,
+    cancellation_token: CancellationToken,
+    events: AsyncGenerator[Dict[str, Any], None]
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """客户端断开时取消令牌并结束事件流；事件流结束或被关闭时同样取消，确保上游模型请求被中止"""
+    watcher = asyncio.create_task(watch_disconnect(http_request, cancellation_token))
+    try:
+        async for event in events:
+            yield event
+    except asyncio.CancelledError:
+        # 由断开检测触发的取消只结束本次运行，其他取消照常向上传递
+        if not cancellation_token.is_cancelled() or asyncio.current_task().cancelling():
+            raise
+    finally:
+        watcher.cancel()
+        cancellation_token.cancel()
+
+# 部署在反向代理后面时开启，按 X-Forwarded-For 中的客户端地址识别匿名调用方
+TRUST_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+
+def admission_key(http_request: Request) -> str:
+    """调用方标识：优先使用X-API-Key，没有时使用客户端地址（会话ID由客户端任意指定，不能用于限流）"""
+    api_key = http_request.headers.get("x-api-key")
+    if api_key:
+        return api_key
+    forwarded = http_request.headers.get("x-forwarded-for") if TRUST_FORWARDED_FOR else None
+    if forwarded:
+        return f"ip:{forwarded.split(',')[0].strip()}"
+    return f"ip:{http_request.client.host if http_request.client else 'unknown'}"
+
+def admit(http_request: Request) -> AdmissionTicket:
+    """申请模型调用名额：按调用方限速和限制并发，超限时立即返回429/503"""
+    key = admission_key(http_request)
+    try:
+        return admission_controller.enter(key)
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except AdmissionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+async def queued(
+    ticket: AdmissionTicket,
+    cancellation_token: CancellationToken,
+    events: AsyncGenerator[Dict[str, Any], None]
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """排队期间推送队列位置，获得名额后再开始运行，结束时归还名额"""
+    try:
+        async for position in ticket.wait(cancellation_token):
+            yield {"type": "queue", "position": position, "message": f"当前请求较多，正在排队（第{position}位）"}
+        async for event in events:
+            yield event
+    finally:
+        ticket.release()
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """持有准入名额的流式响应：无论正常结束、客户端断开还是在开始发送前失败，响应结束时都归还名额"""
+
+    def __init__(self, ticket: AdmissionTicket, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # 事件流还没开始迭代时不会执行queued中的finally，排队中的凭证需要在这里移出队列
+            self.ticket.release()
+
 @app.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, http_request: Request):
     """流式聊天接口 - 使用真实大模型"""
+    ticket = admit(http_request)
+    cancellation_token = CancellationToken()
 
-    async def generate_response() -> AsyncGenerator[str, None]:
+    async def generate_response() -> AsyncGenerator[Dict[str, Any], None]:
         try:
             # 使用真实的AutoGen聊天服务
-            async for chunk in chat_service.chat_stream(request.message, request.session_id):
-                # chat_service已经返回了JSON格式的字符串，直接输出
-                yield f"data: {chunk.strip()}\n\n"
+            async for event in chat_service.chat_events(
+                request.message,
+                request.session_id,
+                request.agent_end_content,
+                cancellation_token,
+                include_stats=request.include_stats
+            ):
+                yield event
 
             # 发送结束事件
-            yield f"data: {json.dumps({'type': 'complete', 'message': 'All agents completed'})}\n\n"
+            yield {'type': 'complete', 'message': 'All agents completed'}
 
         except Exception as e:
-            error_data = {
+            yield {
                 "type": "error",
                 "content": f"Error: {str(e)}",
                 "finished": True
             }
-            yield f"data: {json.dumps(error_data)}\n\n"
 
-    return StreamingResponse(
-        generate_response(),
+    return AdmittedStreamingResponse(
+        ticket,
+        stream_encoder.encode(guard_disconnect(http_request, cancellation_token, queued(ticket, cancellation_token, generate_response()))),
+        media_type="text/plain",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Content-Type": "text/event-stream",
+        }
+    )
+
+@app.post("/chat/resume/stream")
+async def chat_resume_stream(request: ResumeRequest, http_request: Request):
+    """恢复等待用户审批而挂起的团队运行"""
+    ticket = admit(http_request)
+    cancellation_token = CancellationToken()
+
+    async def generate_response() -> AsyncGenerator[Dict[str, Any], None]:
+        try:
+            async for event in chat_service.resume_events(
+                request.session_id,
+                request.user_input,
+                request.agent_end_content,
+                cancellation_token,
+                include_stats=request.include_stats
+            ):
+                yield event
+
+            yield {'type': 'complete', 'message': 'All agents completed'}
+
+        except Exception as e:
+            yield {
+                "type": "error",
+                "content": f"Error: {str(e)}",
+                "finished": True
+            }
+
+    return AdmittedStreamingResponse(
+        ticket,
+        stream_encoder.encode(guard_disconnect(http_request, cancellation_token, queued(ticket, cancellation_token, generate_response()))),
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -103,13 +275,15 @@ async def chat_stream(request: ChatRequest):
     )
 
 @app.post("/chat/stream/demo")
-async def chat_stream_demo(request: ChatRequest):
+async def chat_stream_demo(request: ChatRequest, http_request: Request):
     """流式聊天接口 - 使用演示服务（智能体时间轴）"""
 
     async def generate_response() -> AsyncGenerator[str, None]:
         try:
             # 直接使用测试服务的流式输出
             async for chunk in test_chat_service.chat_stream(request.message, request.session_id):
+                if await http_request.is_disconnected():
+                    break
                 yield f"data: {chunk.strip()}\n\n"
 
         except Exception as e:
@@ -142,9 +316,29 @@ async def chat(request: ChatRequest):
 @app.delete("/chat/session/{session_id}")
 async def clear_session(session_id: str):
     """清除会话历史"""
-    chat_service.clear_session(session_id)
+    await chat_service.clear_session(session_id)
     return {"message": f"Session {session_id} cleared"}
 
+@app.get("/chat/sessions/stats")
+async def get_session_stats():
+    """获取会话统计信息"""
+    return chat_service.get_session_stats()
+
+@app.get("/chat/sessions/{session_id}/usage")
+async def get_session_usage(session_id: str):
+    """获取会话累计token消耗"""
+    return chat_service.get_session_usage(session_id)
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """获取准入控制统计信息（并发数、排队数、限流/拒绝次数）"""
+    return admission_controller.get_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus文本格式的运行指标"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -155,8 +349,8 @@ async def upload_file(file: UploadFile = File(...)):
     try:
         print(f"收到文件上传请求: {file.filename}, 大小: {file.size}")
 
-        # 检查文件大小 (10MB限制)
-        if file.size and file.size > 10 * 1024 * 1024:
+        # 检查文件大小 (10MB限制)，未声明大小时在落盘过程中检查
+        if file.size and file.size > upload_service.max_bytes:
             print(f"文件大小超限: {file.size}")
             return FileUploadResponse(
                 success=False,
@@ -171,29 +365,37 @@ async def upload_file(file: UploadFile = File(...)):
                 message=f"不支持的文件类型: {file.filename}"
             )
 
-        # 读取文件内容
-        file_content = await file.read()
-        print(f"文件内容读取完成，大小: {len(file_content)}")
-
-        # 保存文件
-        file_path = await file_service.save_uploaded_file(file_content, file.filename)
-        print(f"文件保存成功: {file_path}")
+        # 分块写入磁盘，边写边计算哈希并检查大小
+        try:
+            saved = await upload_service.save_stream(file)
+        except UploadTooLargeError as e:
+            print(f"文件大小超限: {file.filename}")
+            return FileUploadResponse(
+                success=False,
+                message=str(e)
+            )
+        print(f"文件保存成功: {saved.path}, 大小: {saved.size}")
 
         # 提取文件内容
-        extraction_result = await file_service.extract_text_from_file(file_path, file.filename)
+        extraction_result = await file_service.extract_text_from_file(saved.path, file.filename)
         print(f"文件内容提取结果: {extraction_result['success']}")
 
         if extraction_result['success']:
+            file_info = {
+                "filename": file.filename,
+                "size": saved.size,
+                "sha256": saved.sha256,
+                "type": file_service.get_file_type(file.filename),
+                "metadata": extraction_result['metadata']
+            }
+            # 解析结果保存在服务端，后续文件分析请求只需携带document_id
+            document_id = await document_store.put(extraction_result['content'], file_info)
             return FileUploadResponse(
                 success=True,
                 message="文件上传并解析成功",
-                file_info={
-                    "filename": file.filename,
-                    "size": len(file_content),
-                    "type": file_service.get_file_type(file.filename),
-                    "metadata": extraction_result['metadata']
-                },
-                content=extraction_result['content']
+                file_info=file_info,
+                content=extraction_result['content'],
+                document_id=document_id
             )
         else:
             print(f"文件解析失败: {extraction_result['error']}")
@@ -215,33 +417,110 @@ async def upload_file(file: UploadFile = File(...)):
 
 
 
+@app.post("/upload/stream")
+async def upload_file_stream(file: UploadFile = File(...), pages_per_chunk: int = Form(5)):
+    """文件上传并流式解析接口 - PDF按页范围逐段返回提取结果"""
+    # 检查文件大小 (10MB限制)
+    if file.size and file.size > upload_service.max_bytes:
+        raise HTTPException(status_code=413, detail="文件大小超过10MB限制")
+
+    # 检查文件类型
+    if not file_service.is_supported_file(file.filename):
+        raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file.filename}")
+
+    # 先保存文件，流式响应开始后请求体将不可再读
+    try:
+        saved = await upload_service.save_stream(file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    file_path = saved.path
+    filename = file.filename
+    file_size = saved.size
+
+    file_info = {
+        "filename": filename,
+        "size": file_size,
+        "sha256": saved.sha256,
+        "type": file_service.get_file_type(filename)
+    }
+
+    async def generate_events() -> AsyncGenerator[str, None]:
+        chunks = []
+        try:
+            async for event in marker_service.stream_document_content(
+                file_path,
+                filename,
+                pages_per_chunk=pages_per_chunk,
+                use_marker=file_service.use_marker
+            ):
+                if event['type'] == 'start':
+                    event['file_info'] = file_info
+                elif event['type'] == 'chunk':
+                    chunks.append(event['content'])
+                elif event['type'] == 'complete':
+                    event['document_id'] = await document_store.put(
+                        '\n\n'.join(chunks),
+                        {**file_info, "metadata": event['metadata']}
+                    )
+                yield f"data: {json.dumps(event)}\n\n"
+
+        except Exception as e:
+            error_data = {
+                "type": "error",
+                "error": f"文件解析失败: {str(e)}"
+            }
+            yield f"data: {json.dumps(error_data)}\n\n"
+
+    return StreamingResponse(
+        generate_events(),
+        media_type="text/plain",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Content-Type": "text/event-stream",
+        }
+    )
+
 @app.post("/chat/file-analysis/stream")
-async def chat_file_analysis_stream(request: FileAnalysisRequest):
+async def chat_file_analysis_stream(request: FileAnalysisRequest, http_request: Request):
     """文件分析流式聊天接口 - 隐式处理文件内容"""
-
-    async def generate_response() -> AsyncGenerator[str, None]:
+    if request.document_id:
+        document = await document_store.get(request.document_id)
+        if document is None:
+            raise HTTPException(status_code=404, detail="文档不存在或已过期，请重新上传")
+        file_content = document.content
+    elif request.file_content is not None:
+        file_content = request.file_content
+    else:
+        raise HTTPException(status_code=400, detail="需要提供document_id或file_content")
+    ticket = admit(http_request)
+    cancellation_token = CancellationToken()
+
+    async def generate_response() -> AsyncGenerator[Dict[str, Any], None]:
         try:
             # 使用专门的文件分析服务
-            async for chunk in chat_service.file_analysis_stream(
+            async for event in chat_service.file_analysis_events(
                 request.message,
-                request.file_content,
-                request.session_id
+                file_content,
+                request.session_id,
+                cancellation_token=cancellation_token,
+                include_stats=request.include_stats
             ):
-                yield f"data: {chunk.strip()}\n\n"
+                yield event
 
             # 发送结束事件
-            yield f"data: {json.dumps({'type': 'complete', 'message': 'Analysis completed'})}\n\n"
+            yield {'type': 'complete', 'message': 'Analysis completed'}
 
         except Exception as e:
-            error_data = {
+            yield {
                 "type": "error",
                 "content": f"Error: {str(e)}",
                 "finished": True
             }
-            yield f"data: {json.dumps(error_data)}\n\n"
 
-    return StreamingResponse(
-        generate_response(),
+    return AdmittedStreamingResponse(
+        ticket,
+        stream_encoder.encode(guard_disconnect(http_request, cancellation_token, queued(ticket, cancellation_token, generate_response()))),
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -250,14 +529,37 @@ async def chat_file_analysis_stream(request: FileAnalysisRequest):
         }
     )
 
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str):
+    """删除服务端保存的文档"""
+    if not document_store.delete(document_id):
+        raise HTTPException(status_code=404, detail="文档不存在或已过期")
+    return {"message": f"Document {document_id} deleted"}
+
+@app.get("/documents/stats")
+async def get_document_stats():
+    """获取文档存储统计信息"""
+    return document_store.get_stats()
+
 @app.post("/chat/feedback")
 async def handle_user_feedback(request: UserFeedback):
     """接收用户反馈并放入队列"""
     try:
-        await chat_service.put_feedback({"content": request.content})
+        suspended = await chat_service.is_suspended(request.session_id)
+        delivered = await chat_service.put_feedback({"content": request.content}, request.session_id)
+        if not delivered and not suspended:
+            return {
+                "success": False,
+                "message": "当前会话没有等待反馈的审批",
+                "delivered": False,
+                "resume": False
+            }
         return {
             "success": True,
-            "message": "用户反馈已接收"
+            "message": "用户反馈已接收",
+            "delivered": delivered,
+            # 挂起的运行需要调用 /chat/resume/stream 继续
+            "resume": suspended
         }
     except Exception as e:
         print(f"处理用户反馈失败: {str(e)}")
@@ -276,6 +578,12 @@ async def handle_user_proxy_response(request: UserProxyResponse):
             request.user_input,
             request.approved
         )
+        if not result["delivered"] and not result["resume"]:
+            return {
+                "success": False,
+                "message": "当前会话没有等待反馈的审批",
+                "result": result
+            }
 
         return {
             "success": True,
@@ -330,7 +638,19 @@ async def get_marker_status():
     return {
         "marker_enabled": file_service.use_marker,
         "supported_formats": file_service.get_supported_formats(),
-        "service_status": "active"
+        "service_status": "active",
+        "model_status": marker_service.get_model_status(),
+        "cache": marker_service.get_cache_stats(),
+        "pool": marker_service.get_pool_stats()
+    }
+
+@app.post("/marker/warmup")
+async def warmup_marker():
+    """在后台预热Marker模型"""
+    marker_service.start_background_warmup()
+    return {
+        "success": True,
+        "model_status": marker_service.get_model_status()
     }
 
 @app.get("/test/user-proxy-event")
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+from marker_registry import ConverterRegistry
+
+logger = logging.getLogger(__name__)
+
+# 工作进程内的转换器注册表：模型只在进程启动时加载一次
+_worker_registry = ConverterRegistry(max_converters=int(os.getenv("MARKER_MAX_CONVERTERS", "4")))
+
+
+def _worker_init():
+    """工作进程初始化：加载Marker模型"""
+    _worker_registry.load_artifacts()
+
+
+def _worker_convert(file_path: str, config: Dict) -> Tuple[str, Dict, Dict]:
+    """在工作进程中转换PDF，返回 (text, metadata, images)"""
+    from marker.output import text_from_rendered
+
+    # 配置变化时只重建转换器，复用已加载的模型
+    rendered = _worker_registry.get(config)(file_path)
+    return text_from_rendered(rendered)
+
+
+def _worker_ping() -> int:
+    """空任务，用于触发工作进程启动和模型加载"""
+    return os.getpid()
+
+
+class PoolBusyError(RuntimeError):
+    """转换队列已满，拒绝新的转换请求"""
+
+
+class MarkerProcessPool:
+    """Marker PDF转换专用进程池，带有界等待队列"""
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 4):
+        """
+        初始化进程池
+
+        Args:
+            max_workers: 工作进程数量
+            max_pending: 工作进程全忙时允许排队等待的请求数
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._running = asyncio.Semaphore(max_workers)
+        self._admitted = 0
+        self._in_flight = 0
+        # 模型加载状态：cold/warming/ready/failed
+        self.status = "cold"
+
+    @classmethod
+    def from_env(cls) -> Optional["MarkerProcessPool"]:
+        """根据环境变量创建进程池，MARKER_POOL_WORKERS=0 时返回None（在进程内转换）"""
+        max_workers = int(os.getenv("MARKER_POOL_WORKERS", "1"))
+        if max_workers <= 0:
+            return None
+        return cls(
+            max_workers=max_workers,
+            max_pending=int(os.getenv("MARKER_POOL_MAX_PENDING", "4")),
+        )
+
+    async def convert(self, file_path: str, config: Dict) -> Tuple[str, Dict, Dict]:
+        """
+        提交PDF转换任务
+
+        Raises:
+            PoolBusyError: 正在处理和排队的请求已达上限
+            BrokenProcessPool: 工作进程异常退出
+        """
+        if self._admitted >= self.max_workers + self.max_pending:
+            raise PoolBusyError(f"PDF转换队列已满（{self._admitted}个请求处理中）")
+
+        self._admitted += 1
+        try:
+            # 只向进程池提交与工作进程数相同的任务，其余在此排队
+            async with self._running:
+                self._in_flight += 1
+                try:
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(self._get_executor(), _worker_convert, file_path, dict(config))
+                    self.status = "ready"
+                    return result
+                except BrokenProcessPool:
+                    logger.error("Marker工作进程异常退出，重建进程池")
+                    self._reset_executor()
+                    raise
+                finally:
+                    self._in_flight -= 1
+        finally:
+            self._admitted -= 1
+
+    async def warmup(self):
+        """启动所有工作进程并完成模型加载"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            await asyncio.gather(*[
+                loop.run_in_executor(executor, _worker_ping)
+                for _ in range(self.max_workers)
+            ])
+            self.status = "ready"
+            logger.info("Marker工作进程预热完成")
+        except BrokenProcessPool:
+            logger.error("Marker工作进程预热失败")
+            self._reset_executor()
+            self.status = "failed"
+
+    def get_stats(self) -> Dict:
+        """获取进程池状态"""
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "in_flight": self._in_flight,
+            "queued": self._admitted - self._in_flight,
+            "status": self.status,
+        }
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            if self.status != "ready":
+                self.status = "warming"
+            # 使用spawn避免fork后的torch/线程状态问题
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_worker_init,
+            )
+        return self._executor
+
+    def _reset_executor(self):
+        executor, self._executor = self._executor, None
+        self.status = "cold"
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ConverterRegistry:
+    """Marker转换器注册表：模型权重只加载一次，按配置缓存转换器"""
+
+    def __init__(self, max_converters: int = 4):
+        """
+        初始化转换器注册表
+
+        Args:
+            max_converters: 最多缓存的转换器数量（不同配置），超出时淘汰最久未使用的
+        """
+        self.max_converters = max_converters
+        self._artifact_dict = None
+        self._converters: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def config_key(config: Dict) -> str:
+        """生成配置对应的注册表键"""
+        return json.dumps(config, sort_keys=True, default=str)
+
+    @property
+    def loaded(self) -> bool:
+        """模型是否已加载"""
+        return self._artifact_dict is not None
+
+    def load_artifacts(self):
+        """加载Marker模型（只执行一次）"""
+        with self._lock:
+            self._load_artifacts_locked()
+
+    def get(self, config: Dict):
+        """
+        获取指定配置的PDF转换器，不存在时基于已加载的模型创建
+
+        只重建处理器列表和渲染器，不会重新加载模型权重
+        """
+        from marker.converters.pdf import PdfConverter
+        from marker.config.parser import ConfigParser
+
+        key = self.config_key(config)
+        with self._lock:
+            converter = self._converters.get(key)
+            if converter is not None:
+                self._converters.move_to_end(key)
+                return converter
+
+            self._load_artifacts_locked()
+            config = dict(config)
+            config_parser = ConfigParser(config)
+            converter = PdfConverter(
+                config=config,
+                artifact_dict=self._artifact_dict,
+                processor_list=config_parser.get_processors(),
+                renderer=config_parser.get_renderer(),
+            )
+            self._converters[key] = converter
+            while len(self._converters) > self.max_converters:
+                self._converters.popitem(last=False)
+
+            logger.info(f"Marker转换器已创建（当前缓存 {len(self._converters)} 个配置）")
+            return converter
+
+    def get_stats(self) -> Dict:
+        """获取注册表状态"""
+        return {
+            "artifacts_loaded": self.loaded,
+            "converters": len(self._converters),
+            "max_converters": self.max_converters,
+        }
+
+    def _load_artifacts_locked(self):
+        if self._artifact_dict is None:
+            from marker.models import create_model_dict
+
+            self._artifact_dict = create_model_dict()
+            logger.info("Marker模型加载完成")
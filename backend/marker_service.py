@@ -2,16 +2,21 @@
 import os
 import json
 import tempfile
-from typing import Dict, Optional, Tuple, List
+from typing import AsyncGenerator, Dict, Optional, Tuple, List
 from pathlib import Path
 import asyncio
 import logging
+import threading
+
+from concurrent.futures.process import BrokenProcessPool
+
+from document_cache import DocumentCache
+from extraction_trace import ExtractionTrace, profiled, stage
+from marker_pool import MarkerProcessPool, PoolBusyError
+from marker_registry import ConverterRegistry
 
 # 导入marker组件
 try:
-    from marker.converters.pdf import PdfConverter
-    from marker.models import create_model_dict
-    from marker.config.parser import ConfigParser
     from marker.output import text_from_rendered
     MARKER_AVAILABLE = True
 except ImportError:
@@ -23,12 +28,13 @@ logger = logging.getLogger(__name__)
 class MarkerDocumentService:
     """基于Marker的通用文档分析服务 - 支持多种文档类型"""
 
-    def __init__(self, config: Optional[Dict] = None):
+    def __init__(self, config: Optional[Dict] = None, cache: Optional[DocumentCache] = None):
         """
         初始化Marker文档服务
 
         Args:
             config: 配置字典，包含LLM服务配置等
+            cache: 提取结果缓存，默认根据环境变量创建
         """
         # 默认配置
         self.default_config = {
@@ -43,14 +49,19 @@ class MarkerDocumentService:
         # 合并用户配置
         self.config = {**self.default_config, **(config or {})}
 
-        # 初始化配置解析器
-        if MARKER_AVAILABLE:
-            self.config_parser = ConfigParser(self.config)
-        else:
-            self.config_parser = None
+        # PDF转换进程池，未启用时在进程内转换
+        self.pdf_pool = MarkerProcessPool.from_env() if MARKER_AVAILABLE else None
 
-        # 初始化转换器
-        self._init_converters()
+        # 转换器按需加载：首个PDF到达或后台预热时才加载模型
+        # （使用进程池时模型在工作进程中加载）
+        # 模型只加载一次，不同配置只重建处理器和渲染器
+        self.converters = ConverterRegistry(max_converters=int(os.getenv("MARKER_MAX_CONVERTERS", "4")))
+        self._converter_lock = threading.Lock()
+        self._model_status = "cold" if MARKER_AVAILABLE else "unavailable"
+        self._warmup_task: Optional[asyncio.Task] = None
+
+        # 提取结果缓存（按文件内容哈希 + 相关配置）
+        self.cache = cache if cache is not None else DocumentCache.from_env()
 
         # 支持的文件类型映射
         self.supported_formats = {
@@ -77,36 +88,55 @@ class MarkerDocumentService:
             '.ppt': 'office'
         }
     
-    def _init_converters(self):
-        """初始化各种文档转换器"""
-        if not MARKER_AVAILABLE:
-            logger.warning("Marker未安装，转换器将不可用")
-            self.pdf_converter = None
-            return
-
-        try:
-            # 创建模型字典
-            artifact_dict = create_model_dict()
+    def _ensure_converter(self, config: Optional[Dict] = None, retry_failed: bool = False):
+        """
+        获取进程内PDF转换器（线程安全），首次调用时加载模型
 
-            # 获取处理器列表
-            processor_list = self.config_parser.get_processors()
+        Args:
+            config: 转换配置，默认使用服务配置
+            retry_failed: 模型加载失败后是否重试
 
-            # 获取渲染器
-            renderer = self.config_parser.get_renderer()
+        Returns:
+            PDF转换器，加载失败时返回None
+        """
+        with self._converter_lock:
+            if self._model_status == "failed" and not retry_failed:
+                return None
 
-            # 创建PDF转换器
-            self.pdf_converter = PdfConverter(
-                config=self.config,
-                artifact_dict=artifact_dict,
-                processor_list=processor_list,
-                renderer=renderer,
-            )
+            try:
+                if not self.converters.loaded:
+                    self._model_status = "warming"
+                converter = self.converters.get(config or self.config)
+                self._model_status = "ready"
+                return converter
+            except Exception as e:
+                logger.error(f"初始化Marker转换器失败: {str(e)}")
+                if not self.converters.loaded:
+                    self._model_status = "failed"
+                return None
 
-            logger.info("Marker转换器初始化成功")
+    async def warmup(self):
+        """预加载Marker模型"""
+        if not MARKER_AVAILABLE:
+            return
+        if self.pdf_pool:
+            await self.pdf_pool.warmup()
+        else:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._ensure_converter, None, True)
 
-        except Exception as e:
-            logger.error(f"初始化Marker转换器失败: {str(e)}")
-            self.pdf_converter = None
+    def start_background_warmup(self):
+        """在后台预热模型，不阻塞调用方"""
+        if not MARKER_AVAILABLE:
+            return
+        if self._warmup_task is None or self._warmup_task.done():
+            self._warmup_task = asyncio.create_task(self.warmup())
+
+    def get_model_status(self) -> str:
+        """获取模型加载状态：unavailable/cold/warming/ready/failed"""
+        if self.pdf_pool:
+            return self.pdf_pool.status
+        return self._model_status
     
     def enable_llm_service(self, llm_config: Dict):
         """
@@ -122,31 +152,48 @@ class MarkerDocumentService:
                 **llm_config
             })
             
-            # 重新初始化转换器
-            self._init_converters()
-            
+            # 无需重新加载模型：下次转换时按新配置从注册表获取转换器
+
             logger.info("LLM服务已启用")
             
         except Exception as e:
             logger.error(f"启用LLM服务失败: {str(e)}")
     
-    async def extract_document_content(self, file_path: str, filename: str = None) -> Dict:
+    async def extract_document_content(
+        self,
+        file_path: str,
+        filename: str = None,
+        config: Optional[Dict] = None,
+        profile: Optional[bool] = None
+    ) -> Dict:
         """
         使用Marker提取文档内容 - 支持多种文档类型
 
         Args:
             file_path: 文件路径
             filename: 文件名（用于确定文件类型）
+            config: 本次请求的配置覆盖项（如LLM设置），不影响服务默认配置
+            profile: 是否对本次提取做cProfile采样，默认由 EXTRACTION_PROFILE_DIR 决定
 
         Returns:
-            包含提取结果的字典
+            包含提取结果的字典，metadata['extraction_stats'] 中是各阶段耗时和字节数统计
         """
         if filename is None:
             filename = os.path.basename(file_path)
 
+        trace = ExtractionTrace.from_env(file_path, filename, profile)
+        if Path(filename).suffix.lower() not in self.supported_formats:
+            # 不支持的扩展名统一归为other，避免任意扩展名变成指标标签
+            trace.format = "other"
+        with trace.activate():
+            result = await self._extract_document_content(file_path, filename, config)
+        return trace.finish(result)
+
+    async def _extract_document_content(self, file_path: str, filename: str, config: Optional[Dict]) -> Dict:
         # 获取文件类型
-        file_ext = Path(filename).suffix.lower()
-        file_type = self.supported_formats.get(file_ext, 'unknown')
+        with stage("detect"):
+            file_ext = Path(filename).suffix.lower()
+            file_type = self.supported_formats.get(file_ext, 'unknown')
 
         if file_type == 'unknown':
             return {
@@ -171,7 +218,7 @@ class MarkerDocumentService:
 
             # 根据文件类型选择处理方法
             if file_type == 'pdf':
-                return await self._process_pdf(abs_path, filename)
+                return await self._process_pdf(abs_path, filename, {**self.config, **(config or {})})
             elif file_type == 'text':
                 return await self._process_text_file(abs_path, filename)
             elif file_type == 'office':
@@ -195,60 +242,87 @@ class MarkerDocumentService:
                 'images': {}
             }
     
-    async def _process_pdf(self, file_path: str, filename: str) -> Dict:
-        """处理PDF文件"""
-        if not MARKER_AVAILABLE or not self.pdf_converter:
+    async def _process_pdf(self, file_path: str, filename: str, config: Optional[Dict] = None, page_offset: int = 0) -> Dict:
+        """
+        处理PDF文件
+
+        Args:
+            page_offset: 文件首页在原文档中的页码偏移（分段处理时的临时文件），降级处理时用于页码标记
+        """
+        config = config or self.config
+        if not MARKER_AVAILABLE:
             # 使用基础PDF处理
-            return await self._fallback_pdf_processing(file_path, filename)
+            return await self._fallback_pdf_processing(file_path, filename, page_offset)
 
         try:
-            # 在线程池中运行转换（因为marker是同步的）
             loop = asyncio.get_event_loop()
-            rendered = await loop.run_in_executor(
-                None,
-                self._convert_pdf_sync,
-                file_path
-            )
 
-            if rendered is None:
-                return {
-                    'success': False,
-                    'error': 'PDF转换失败',
-                    'content': '',
-                    'metadata': {},
-                    'images': {}
-                }
-
-            # 提取文本和图像
-            if MARKER_AVAILABLE:
-                text, metadata, images = text_from_rendered(rendered)
+            # 先查询缓存，相同内容和配置的文档直接返回
+            cache_key = None
+            if self.cache:
+                with stage("cache_lookup"):
+                    content_hash = await loop.run_in_executor(None, DocumentCache.hash_file, file_path)
+                    cache_key = self.cache.make_key(content_hash, config)
+                    cached = await loop.run_in_executor(None, self.cache.get, cache_key)
+                if cached:
+                    text, metadata, images = cached
+                    return self._build_pdf_result(text, metadata, images, filename, config, cache_hit=True)
+
+            if self.pdf_pool:
+                # 在专用进程池中转换，工作进程直接返回文本和图像（在工作进程中执行，不参与采样）
+                with stage("convert"):
+                    text, metadata, images = await self.pdf_pool.convert(file_path, config)
             else:
-                # 这个分支不应该被执行，因为前面已经检查了MARKER_AVAILABLE
-                text = "Marker处理失败"
-                metadata = {}
-                images = {}
+                # 首次使用时加载模型，之后按配置复用转换器
+                with stage("model_load"):
+                    converter = await loop.run_in_executor(None, profiled(self._ensure_converter), config)
+                if converter is None:
+                    return await self._fallback_pdf_processing(file_path, filename, page_offset)
+
+                # 在线程池中运行转换（因为marker是同步的）
+                with stage("convert"):
+                    rendered = await loop.run_in_executor(
+                        None,
+                        profiled(self._convert_pdf_sync),
+                        converter,
+                        file_path
+                    )
+
+                if rendered is None:
+                    return {
+                        'success': False,
+                        'error': 'PDF转换失败',
+                        'content': '',
+                        'metadata': {},
+                        'images': {}
+                    }
+
+                # 提取文本和图像
+                with stage("text_from_rendered", profile=True):
+                    text, metadata, images = text_from_rendered(rendered)
 
             # 处理图像引用
-            processed_text = self._process_image_references(text, images)
+            with stage("image_references", profile=True):
+                processed_text = self._process_image_references(text, images)
 
-            # 构建元数据
-            doc_metadata = {
-                'type': 'pdf_marker',
-                'pages': metadata.get('pages', 0) if metadata else 0,
-                'size': len(processed_text),
-                'images_count': len(images),
-                'extraction_method': 'marker',
-                'llm_enabled': self.config.get('use_llm', False),
-                'filename': filename
-            }
+            if cache_key:
+                with stage("cache_store"):
+                    await loop.run_in_executor(None, self.cache.put, cache_key, processed_text, metadata, images)
+
+            return self._build_pdf_result(processed_text, metadata, images, filename, config)
 
+        except PoolBusyError as e:
+            logger.warning(str(e))
             return {
-                'success': True,
-                'content': processed_text,
-                'metadata': doc_metadata,
-                'images': images
+                'success': False,
+                'error': 'PDF处理队列已满，请稍后重试',
+                'content': '',
+                'metadata': {},
+                'images': {}
             }
-
+        except BrokenProcessPool:
+            # 工作进程崩溃（如模型加载失败），本次降级为基础处理
+            return await self._fallback_pdf_processing(file_path, filename, page_offset)
         except Exception as e:
             logger.error(f"PDF处理失败: {str(e)}")
             return {
@@ -259,10 +333,45 @@ class MarkerDocumentService:
                 'images': {}
             }
 
-    def _convert_pdf_sync(self, file_path: str):
+    def _build_pdf_result(self, text: str, metadata: Dict, images: Dict, filename: str, config: Dict, cache_hit: bool = False) -> Dict:
+        """构建Marker PDF处理结果"""
+        doc_metadata = {
+            'type': 'pdf_marker',
+            'pages': metadata.get('pages', 0) if metadata else 0,
+            'size': len(text),
+            'images_count': len(images),
+            'extraction_method': 'marker',
+            'llm_enabled': config.get('use_llm', False),
+            'filename': filename,
+            'cache_hit': cache_hit
+        }
+
+        return {
+            'success': True,
+            'content': text,
+            'metadata': doc_metadata,
+            'images': images
+        }
+
+    def get_pool_stats(self) -> Optional[Dict]:
+        """获取PDF转换状态：启用进程池时返回进程池状态，否则返回进程内转换器注册表状态"""
+        if self.pdf_pool:
+            return self.pdf_pool.get_stats()
+        return self.converters.get_stats() if MARKER_AVAILABLE else None
+
+    def shutdown(self):
+        """释放转换进程池等资源"""
+        if self.pdf_pool:
+            self.pdf_pool.shutdown()
+
+    def get_cache_stats(self) -> Optional[Dict]:
+        """获取提取缓存统计信息，未启用缓存时返回None"""
+        return self.cache.get_stats() if self.cache else None
+
+    def _convert_pdf_sync(self, converter, file_path: str):
         """同步转换PDF文件"""
         try:
-            return self.pdf_converter(file_path)
+            return converter(file_path)
         except Exception as e:
             logger.error(f"PDF转换过程中出错: {str(e)}")
             return None
@@ -271,17 +380,19 @@ class MarkerDocumentService:
         """处理文本文件 - 使用Marker的智能格式化"""
         try:
             # 读取文本内容
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            with stage("read"):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
 
             # 对于代码文件，保持原格式并添加语法高亮标记
             file_ext = Path(filename).suffix.lower()
-            if file_ext in ['.py', '.js', '.html', '.css', '.java', '.cpp', '.c', '.go', '.rs']:
-                language = self._get_language_from_extension(file_ext)
-                processed_content = f"```{language}\n{content}\n```"
-            else:
-                # 对于普通文本文件，使用Marker的智能格式化
-                processed_content = self._format_text_content(content, file_ext)
+            with stage("format", profile=True):
+                if file_ext in ['.py', '.js', '.html', '.css', '.java', '.cpp', '.c', '.go', '.rs']:
+                    language = self._get_language_from_extension(file_ext)
+                    processed_content = f"```{language}\n{content}\n```"
+                else:
+                    # 对于普通文本文件，使用Marker的智能格式化
+                    processed_content = self._format_text_content(content, file_ext)
 
             # 构建元数据
             doc_metadata = {
@@ -303,10 +414,12 @@ class MarkerDocumentService:
         except UnicodeDecodeError:
             # 尝试其他编码
             try:
-                with open(file_path, 'r', encoding='gbk') as f:
-                    content = f.read()
+                with stage("read"):
+                    with open(file_path, 'r', encoding='gbk') as f:
+                        content = f.read()
 
-                processed_content = self._format_text_content(content, Path(filename).suffix.lower())
+                with stage("format", profile=True):
+                    processed_content = self._format_text_content(content, Path(filename).suffix.lower())
 
                 return {
                     'success': True,
@@ -446,12 +559,13 @@ class MarkerDocumentService:
         """处理Word文档"""
         try:
             from docx import Document
-            doc = Document(file_path)
+            with stage("parse", profile=True):
+                doc = Document(file_path)
 
-            paragraphs = []
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    paragraphs.append(para.text)
+                paragraphs = []
+                for para in doc.paragraphs:
+                    if para.text.strip():
+                        paragraphs.append(para.text)
 
             content = '\n\n'.join(paragraphs)
 
@@ -483,23 +597,24 @@ class MarkerDocumentService:
         """处理Excel文件"""
         try:
             from openpyxl import load_workbook
-            workbook = load_workbook(file_path, read_only=True)
+            with stage("parse", profile=True):
+                workbook = load_workbook(file_path, read_only=True)
 
-            sheets_content = []
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                sheet_data = []
+                sheets_content = []
+                for sheet_name in workbook.sheetnames:
+                    sheet = workbook[sheet_name]
+                    sheet_data = []
 
-                # 转换为Markdown表格格式
-                for row_idx, row in enumerate(sheet.iter_rows(values_only=True, max_row=50)):  # 限制行数
-                    if any(cell is not None for cell in row):
-                        row_data = [str(cell) if cell is not None else '' for cell in row]
-                        sheet_data.append('| ' + ' | '.join(row_data) + ' |')
-                        if row_idx == 0:  # 添加表头分隔符
-                            sheet_data.append('| ' + ' | '.join(['---'] * len(row_data)) + ' |')
+                    # 转换为Markdown表格格式
+                    for row_idx, row in enumerate(sheet.iter_rows(values_only=True, max_row=50)):  # 限制行数
+                        if any(cell is not None for cell in row):
+                            row_data = [str(cell) if cell is not None else '' for cell in row]
+                            sheet_data.append('| ' + ' | '.join(row_data) + ' |')
+                            if row_idx == 0:  # 添加表头分隔符
+                                sheet_data.append('| ' + ' | '.join(['---'] * len(row_data)) + ' |')
 
-                if sheet_data:
-                    sheets_content.append(f"## {sheet_name}\n\n" + '\n'.join(sheet_data))
+                    if sheet_data:
+                        sheets_content.append(f"## {sheet_name}\n\n" + '\n'.join(sheet_data))
 
             content = f"# {filename}\n\n" + '\n\n'.join(sheets_content)
 
@@ -554,22 +669,19 @@ class MarkerDocumentService:
         ext = Path(filename).suffix.lower()
         return ext in self.supported_formats
 
-    async def _fallback_pdf_processing(self, file_path: str, filename: str) -> Dict:
-        """当Marker不可用时的PDF基础处理"""
+    async def _fallback_pdf_processing(self, file_path: str, filename: str, page_offset: int = 0) -> Dict:
+        """当Marker不可用时的PDF基础处理，page_offset 为文件首页在原文档中的页码偏移"""
         try:
             import PyPDF2
 
-            with open(file_path, 'rb') as file:
+            with open(file_path, 'rb') as file, stage("fallback_parse", profile=True):
                 pdf_reader = PyPDF2.PdfReader(file)
                 text_content = []
 
-                for page_num, page in enumerate(pdf_reader.pages):
-                    try:
-                        text = page.extract_text()
-                        if text.strip():
-                            text_content.append(f"=== 第 {page_num + 1} 页 ===\n{text}")
-                    except Exception as page_error:
-                        text_content.append(f"=== 第 {page_num + 1} 页 ===\n[页面解析失败: {str(page_error)}]")
+                for page_num, page in enumerate(pdf_reader.pages, start=page_offset):
+                    text = self._format_pdf_page(page, page_num)
+                    if text:
+                        text_content.append(text)
 
                 content = '\n\n'.join(text_content)
 
@@ -594,6 +706,136 @@ class MarkerDocumentService:
                 'images': {}
             }
 
+    def _format_pdf_page(self, page, page_num: int) -> Optional[str]:
+        """提取单页文本并添加页码标记，空白页返回None"""
+        try:
+            text = page.extract_text()
+            if text.strip():
+                return f"=== 第 {page_num + 1} 页 ===\n{text}"
+            return None
+        except Exception as page_error:
+            return f"=== 第 {page_num + 1} 页 ===\n[页面解析失败: {str(page_error)}]"
+
+    async def stream_document_content(
+        self,
+        file_path: str,
+        filename: str = None,
+        pages_per_chunk: int = 5,
+        use_marker: bool = True,
+        config: Optional[Dict] = None
+    ) -> AsyncGenerator[Dict, None]:
+        """
+        分段提取文档内容，PDF按页范围逐段产出结果
+
+        Args:
+            file_path: 文件路径
+            filename: 文件名（用于确定文件类型）
+            pages_per_chunk: 每段包含的页数
+            use_marker: 是否使用Marker处理PDF，否则使用PyPDF2逐页提取
+            config: 本次请求的配置覆盖项
+
+        Yields:
+            事件字典：start / chunk / complete / error
+        """
+        if filename is None:
+            filename = os.path.basename(file_path)
+        file_ext = Path(filename).suffix.lower()
+        pages_per_chunk = max(1, pages_per_chunk)
+
+        if self.supported_formats.get(file_ext) != 'pdf':
+            # 非PDF文件处理很快，整体提取后一次性返回
+            result = await self.extract_document_content(file_path, filename, config)
+            if not result['success']:
+                yield {'type': 'error', 'error': result['error']}
+                return
+            yield {'type': 'start', 'filename': filename, 'total_pages': None}
+            yield {'type': 'chunk', 'page_start': None, 'page_end': None, 'content': result['content']}
+            yield {'type': 'complete', 'metadata': result['metadata']}
+            return
+
+        try:
+            import PyPDF2
+        except ImportError:
+            PyPDF2 = None
+
+        loop = asyncio.get_event_loop()
+        abs_path = os.path.abspath(file_path)
+
+        try:
+            if PyPDF2 is None:
+                raise RuntimeError("PyPDF2未安装，无法分段处理PDF")
+            reader = await loop.run_in_executor(None, PyPDF2.PdfReader, abs_path)
+            total_pages = len(reader.pages)
+        except Exception as e:
+            # 无法分页时退化为整体提取
+            logger.warning(f"PDF分页失败，改为整体提取: {str(e)}")
+            result = await self.extract_document_content(file_path, filename, config)
+            if not result['success']:
+                yield {'type': 'error', 'error': result['error']}
+                return
+            yield {'type': 'start', 'filename': filename, 'total_pages': result['metadata'].get('pages')}
+            yield {'type': 'chunk', 'page_start': 1, 'page_end': result['metadata'].get('pages'), 'content': result['content']}
+            yield {'type': 'complete', 'metadata': result['metadata']}
+            return
+
+        use_marker = use_marker and MARKER_AVAILABLE
+        config = {**self.config, **(config or {})}
+        extraction_method = 'marker' if use_marker else 'pypdf2_fallback'
+        yield {'type': 'start', 'filename': filename, 'total_pages': total_pages, 'extraction_method': extraction_method}
+
+        total_size = 0
+        images_count = 0
+        for start in range(0, total_pages, pages_per_chunk):
+            end = min(start + pages_per_chunk, total_pages)
+
+            if use_marker:
+                chunk_path = await loop.run_in_executor(None, self._split_pdf_sync, reader, start, end)
+                try:
+                    result = await self._process_pdf(chunk_path, filename, config, page_offset=start)
+                finally:
+                    os.unlink(chunk_path)
+                if not result['success']:
+                    yield {'type': 'error', 'error': result['error'], 'page_start': start + 1, 'page_end': end}
+                    return
+                content = result['content']
+                images_count += len(result['images'])
+                # 进程池降级等情况下分段结果可能来自基础处理
+                extraction_method = result['metadata'].get('extraction_method', extraction_method)
+            else:
+                pages = await loop.run_in_executor(
+                    None,
+                    lambda: [self._format_pdf_page(reader.pages[i], i) for i in range(start, end)]
+                )
+                content = '\n\n'.join(page for page in pages if page)
+
+            total_size += len(content)
+            yield {'type': 'chunk', 'page_start': start + 1, 'page_end': end, 'content': content}
+
+        yield {
+            'type': 'complete',
+            'metadata': {
+                'type': 'pdf_marker' if extraction_method == 'marker' else 'pdf_basic',
+                'pages': total_pages,
+                'size': total_size,
+                'images_count': images_count,
+                'extraction_method': extraction_method,
+                'filename': filename
+            }
+        }
+
+    def _split_pdf_sync(self, reader, start: int, end: int) -> str:
+        """将PDF的 [start, end) 页写入临时文件，返回临时文件路径"""
+        import PyPDF2
+
+        writer = PyPDF2.PdfWriter()
+        for page_index in range(start, end):
+            writer.add_page(reader.pages[page_index])
+
+        fd, chunk_path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            writer.write(f)
+        return chunk_path
+
 
 # 创建全局实例
 marker_service = MarkerDocumentService()
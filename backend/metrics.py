@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import time
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Any, AsyncGenerator, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 耗时类指标的默认分桶（秒），覆盖从毫秒级的路由到分钟级的团队运行
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 输出速度分桶（tokens/秒）
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320, 640)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram:
+    """分桶直方图，导出 _bucket / _sum / _count"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合：[各桶计数（非累计）..., +Inf桶计数], 总和
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def observe(self, value: float, **labels: Any):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels: Any) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def get_sum(self, **labels: Any) -> float:
+        entry = self._values.get(self._key(labels))
+        return entry[1][0] if entry else 0.0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表：同名指标只创建一次，render() 输出Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help: str, labelnames: Sequence[str], **kwargs: Any):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+metrics_registry = MetricsRegistry()
+
+CHAT_REQUESTS = metrics_registry.counter(
+    "chat_requests_total", "流式聊天请求数", ("endpoint", "mode", "status"))
+CHAT_DURATION = metrics_registry.histogram(
+    "chat_request_duration_seconds", "流式聊天请求总耗时", ("endpoint", "mode"))
+CHAT_TTFT = metrics_registry.histogram(
+    "chat_time_to_first_token_seconds", "从收到请求到产出第一段模型输出的耗时", ("endpoint", "mode"))
+CHAT_TOKENS_PER_SECOND = metrics_registry.histogram(
+    "chat_output_tokens_per_second", "首段输出之后的输出速度（估算token数）", ("endpoint", "mode"), buckets=RATE_BUCKETS)
+CHAT_OUTPUT_TOKENS = metrics_registry.counter(
+    "chat_output_tokens_total", "流式输出的估算token数", ("endpoint", "mode"))
+CHAT_PHASE_DURATION = metrics_registry.histogram(
+    "chat_phase_duration_seconds", "请求各准备阶段耗时（路由、会话加载、文件上下文构建等）", ("endpoint", "phase"))
+CHAT_AGENT_DURATION = metrics_registry.histogram(
+    "chat_agent_duration_seconds", "团队模式下每个智能体从 agent_start 到 agent_end 的耗时", ("agent",))
+
+
+class RequestTimer:
+    """
+    单次流式请求的计时：首段输出耗时、输出速度、各准备阶段和各智能体的耗时、总耗时
+
+    track() 包装事件流并观察事件，结束时写入全局指标，可选在末尾追加一个 stats 事件
+    """
+
+    def __init__(self, endpoint: str, mode: str = "single"):
+        self.endpoint = endpoint
+        self.mode = mode
+        self.start = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.output_tokens = 0
+        self.failed = False
+        self.cancelled = False
+        self.phases: Dict[str, float] = {}
+        self.agents: List[Dict[str, Any]] = []
+        self._open_agents: Dict[str, Dict[str, Any]] = {}
+        # 上一个智能体结束（或准备阶段完成）的时间，下一个智能体的耗时从这里算起
+        self._turn_start = self.start
+        # 自上一条完整消息以来已有流式片段输出的智能体，其随后的完整消息（final chunk）是重复发送的内容
+        self._streamed: Set[str] = set()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """记录一个准备阶段的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._turn_start = time.perf_counter()
+            self.phases[name] = self.phases.get(name, 0.0) + self._turn_start - start
+
+    def observe(self, event: Dict[str, Any]):
+        now = time.perf_counter()
+        event_type = event.get("type")
+        if event_type == "chunk":
+            content = event.get("content") or ""
+            agent_name = event.get("agent", "")
+            if event.get("final"):
+                # 完整消息到达说明该智能体这一轮已输出完毕（agent_end 要等下一个智能体开始输出时才发出）
+                agent = self._open_agents.get(agent_name)
+                if agent is not None:
+                    agent["finished"] = now
+                if agent_name in self._streamed:
+                    # 内容已通过流式片段计入，不重复统计
+                    self._streamed.discard(agent_name)
+                    return
+            elif content:
+                self._streamed.add(agent_name)
+            if content:
+                if self.first_token_at is None:
+                    self.first_token_at = now
+                self.last_token_at = now
+                tokens = estimate_tokens(content)
+                self.output_tokens += tokens
+                agent = self._open_agents.get(event.get("agent", ""))
+                if agent is not None:
+                    agent["tokens"] += tokens
+        elif event_type == "agent_start":
+            # agent_start 在该智能体第一段输出到达时才发出；没有其他智能体在输出时，从上一个智能体结束算起，包含模型的响应等待
+            start = now if self._open_agents else self._turn_start
+            entry = {"agent": event.get("agent", ""), "start": start, "finished": None, "duration": None, "tokens": 0}
+            self._open_agents[entry["agent"]] = entry
+            self.agents.append(entry)
+        elif event_type == "agent_end":
+            entry = self._open_agents.pop(event.get("agent", ""), None)
+            if entry is not None:
+                finished = entry["finished"] or now
+                entry["duration"] = finished - entry["start"]
+                self._turn_start = finished
+        elif event_type == "error":
+            self.failed = True
+
+    def finish(self) -> Dict[str, Any]:
+        """写入全局指标，返回本次请求的统计"""
+        total = time.perf_counter() - self.start
+        labels = {"endpoint": self.endpoint, "mode": self.mode}
+        status = "cancelled" if self.cancelled else "error" if self.failed else "ok"
+        CHAT_REQUESTS.inc(status=status, **labels)
+        CHAT_DURATION.observe(total, **labels)
+        CHAT_OUTPUT_TOKENS.inc(self.output_tokens, **labels)
+
+        ttft = None
+        tokens_per_second = None
+        if self.first_token_at is not None:
+            ttft = self.first_token_at - self.start
+            CHAT_TTFT.observe(ttft, **labels)
+            streaming = self.last_token_at - self.first_token_at
+            if streaming > 0:
+                tokens_per_second = self.output_tokens / streaming
+                CHAT_TOKENS_PER_SECOND.observe(tokens_per_second, **labels)
+        for name, duration in self.phases.items():
+            CHAT_PHASE_DURATION.observe(duration, endpoint=self.endpoint, phase=name)
+        for entry in self.agents:
+            if entry["duration"] is not None:
+                CHAT_AGENT_DURATION.observe(entry["duration"], agent=entry["agent"])
+
+        return {
+            "endpoint": self.endpoint,
+            "mode": self.mode,
+            "status": status,
+            "total_seconds": round(total, 3),
+            "time_to_first_token_seconds": round(ttft, 3) if ttft is not None else None,
+            "output_tokens": self.output_tokens,
+            "tokens_per_second": round(tokens_per_second, 1) if tokens_per_second is not None else None,
+            "phases": {name: round(duration, 4) for name, duration in self.phases.items()},
+            "agents": [
+                {
+                    "agent": entry["agent"],
+                    "duration_seconds": round(entry["duration"], 3) if entry["duration"] is not None else None,
+                    "output_tokens": entry["tokens"],
+                }
+                for entry in self.agents
+            ],
+        }
+
+    async def track(self, events: AsyncGenerator[Dict[str, Any], None], include_stats: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+        """观察事件流；正常结束时可在末尾追加 stats 事件，被取消或中途关闭时只记录指标"""
+        completed = False
+        try:
+            async for event in events:
+                self.observe(event)
+                yield event
+            completed = True
+        finally:
+            if not completed:
+                self.cancelled = True
+            stats = self.finish()
+        if include_stats:
+            yield {"type": "stats", **stats}
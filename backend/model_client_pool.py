@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional, Sequence, Tuple, Union
+
+import httpx
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimitedChatCompletionClient(ChatCompletionClient):
+    """为共享模型客户端增加全局并发上限：超出上限的调用排队等待"""
+
+    def __init__(self, client: ChatCompletionClient, limiter: asyncio.Semaphore, stats: Dict[str, int]):
+        self._client = client
+        self._limiter = limiter
+        self._stats = stats
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[Any] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        async with self._slot():
+            return await self._client.create(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[Any] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        # 流式调用在整个流结束前一直占用并发名额
+        async with self._slot():
+            async for item in self._client.create_stream(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                yield item
+
+    async def close(self) -> None:
+        # 共享客户端由工厂统一关闭
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self):
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+    def _slot(self):
+        return _LimiterSlot(self._limiter, self._stats)
+
+
+class _LimiterSlot:
+    """占用一个并发名额，同时统计排队和执行中的调用数"""
+
+    def __init__(self, limiter: asyncio.Semaphore, stats: Dict[str, int]):
+        self._limiter = limiter
+        self._stats = stats
+
+    async def __aenter__(self):
+        self._stats["waiting"] += 1
+        try:
+            await self._limiter.acquire()
+        finally:
+            self._stats["waiting"] -= 1
+        self._stats["in_flight"] += 1
+        self._stats["total_requests"] += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._stats["in_flight"] -= 1
+        self._limiter.release()
+
+
+class ModelClientFactory:
+    """共享模型客户端工厂：每个端点一个keep-alive连接池，每个端点/模型一个客户端，全局限制并发调用数"""
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        max_concurrent_requests: int = 32,
+        timeout: float = 120.0
+    ):
+        """
+        初始化客户端工厂
+
+        Args:
+            max_connections: 每个端点的最大连接数
+            max_keepalive_connections: 每个端点保持的空闲keep-alive连接数
+            keepalive_expiry: 空闲连接保持时间（秒）
+            max_concurrent_requests: 全局同时进行的模型调用数上限
+            timeout: 单次请求超时时间（秒）
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.max_concurrent_requests = max_concurrent_requests
+        self._limiter = asyncio.Semaphore(max_concurrent_requests)
+        self._stats = {"in_flight": 0, "waiting": 0, "total_requests": 0}
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._clients: Dict[Tuple[str, str, str], ConcurrencyLimitedChatCompletionClient] = {}
+
+    @classmethod
+    def from_env(cls) -> "ModelClientFactory":
+        return cls(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10")),
+            max_concurrent_requests=int(os.getenv("LLM_MAX_CONCURRENT_REQUESTS", "32")),
+            timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "120")),
+        )
+
+    def get(self, model: str, base_url: str, api_key: Optional[str], model_info: ModelInfo) -> ChatCompletionClient:
+        """获取指定端点和模型的共享客户端"""
+        key = (base_url, model, hashlib.sha256((api_key or "").encode('utf-8')).hexdigest())
+        client = self._clients.get(key)
+        if client is None:
+            http_client = self._http_clients.get(base_url)
+            if http_client is None:
+                http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+                self._http_clients[base_url] = http_client
+            client = ConcurrencyLimitedChatCompletionClient(
+                OpenAIChatCompletionClient(
+                    model=model,
+                    base_url=base_url,
+                    api_key=api_key,
+                    model_info=model_info,
+                    http_client=http_client,
+                ),
+                self._limiter,
+                self._stats,
+            )
+            self._clients[key] = client
+            logger.info(f"创建共享模型客户端: {model} @ {base_url}")
+        return client
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取客户端与并发统计"""
+        return {
+            **self._stats,
+            "max_concurrent_requests": self.max_concurrent_requests,
+            "clients": len(self._clients),
+            "endpoints": len(self._http_clients),
+        }
+
+    async def aclose(self):
+        """关闭所有连接池"""
+        for http_client in self._http_clients.values():
+            await http_client.aclose()
+        self._http_clients.clear()
+        self._clients.clear()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_task(text: str) -> str:
+    """归一化任务文本：全角转半角、统一小写、合并空白"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+@dataclass
+class CachedTeamRun:
+    """缓存的一次团队运行：各智能体的完整发言和运行结束时的团队状态"""
+    transcript: List[Dict[str, str]]
+    state: Dict[str, Any]
+    suspended: bool
+    # 挂起时检查点中除团队状态外的其他字段（如并行评审的评审意见）
+    checkpoint_extra: Dict[str, Any] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+    # 按序列化后的字节数估算占用内存，创建时计算一次
+    size: int = field(init=False, default=0)
+
+    def __post_init__(self):
+        self.size = (
+            sum(len(message["content"].encode('utf-8')) for message in self.transcript)
+            + len(json.dumps(self.state, default=str).encode('utf-8'))
+            + len(json.dumps(self.checkpoint_extra, default=str).encode('utf-8'))
+        )
+
+
+class TeamResponseCache:
+    """测试团队响应缓存：相同任务、相同系统提示和模型的新会话直接回放之前的运行结果"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 24 * 3600):
+        """
+        初始化响应缓存
+
+        Args:
+            max_entries: 最大缓存条目数
+            max_bytes: 缓存内容总字节数上限
+            ttl_seconds: 条目有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, CachedTeamRun]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["TeamResponseCache"]:
+        """TEAM_RESPONSE_CACHE_ENABLED 开启时创建缓存"""
+        if os.getenv("TEAM_RESPONSE_CACHE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            max_entries=int(os.getenv("TEAM_RESPONSE_CACHE_MAX_ENTRIES", "256")),
+            max_bytes=int(float(os.getenv("TEAM_RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024),
+            ttl_seconds=int(os.getenv("TEAM_RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600))),
+        )
+
+    @staticmethod
+    def make_key(task: str, system_messages: Sequence[str], model: str, variant: str = "") -> str:
+        """根据归一化的任务文本、各智能体系统提示、模型名和团队运行方式生成缓存键"""
+        payload = json.dumps({
+            "task": normalize_task(task),
+            "system_messages": list(system_messages),
+            "model": model,
+            "variant": variant,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedTeamRun]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.time() - entry.created_at > self.ttl_seconds:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: CachedTeamRun):
+        if entry.size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "size_mb": round(self._bytes / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import re
+import math
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+_CJK_RUN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+_WORD = re.compile(r'[a-z0-9_]+')
+_CJK_CHAR = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+_HEADING = re.compile(r'^#{1,6}\s')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文约每字1个token，其他字符约每4个字符1个token"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文/数字按单词切分，中文按单字 + 相邻二字切分"""
+    text = text.lower()
+    terms = _WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        terms.extend(run)
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+@dataclass
+class Chunk:
+    """文档片段"""
+    index: int
+    text: str
+    heading: str = ""
+
+
+def chunk_markdown(text: str, max_chars: int = 1200) -> List[Chunk]:
+    """
+    按段落切分Markdown文本，相邻段落合并到不超过max_chars
+
+    每个片段记录所属的最近一级标题，便于在提示中保留上下文
+    """
+    chunks: List[Chunk] = []
+    buffer: List[str] = []
+    buffer_len = 0
+    heading = ""
+    buffer_heading = ""
+
+    def flush():
+        nonlocal buffer, buffer_len
+        if buffer:
+            chunks.append(Chunk(index=len(chunks), text='\n\n'.join(buffer), heading=buffer_heading))
+            buffer = []
+            buffer_len = 0
+
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if _HEADING.match(paragraph):
+            # 新标题开始新的片段
+            flush()
+            heading = paragraph.split('\n', 1)[0].lstrip('#').strip()
+
+        # 超长段落按行（必要时按字符）切开
+        pieces = [paragraph]
+        if len(paragraph) > max_chars:
+            pieces = []
+            current = ""
+            for line in paragraph.split('\n'):
+                if len(line) > max_chars and current:
+                    # 先输出已缓冲的行，保持原文顺序
+                    pieces.append(current)
+                    current = ""
+                while len(line) > max_chars:
+                    pieces.append(line[:max_chars])
+                    line = line[max_chars:]
+                if current and len(current) + len(line) + 1 > max_chars:
+                    pieces.append(current)
+                    current = ""
+                current = f"{current}\n{line}" if current else line
+            if current:
+                pieces.append(current)
+
+        for piece in pieces:
+            if buffer and buffer_len + len(piece) > max_chars:
+                flush()
+            if not buffer:
+                buffer_heading = heading
+            buffer.append(piece)
+            buffer_len += len(piece) + 2
+
+    flush()
+    return chunks
+
+
+class BM25Index:
+    """基于BM25的本地检索索引（纯Python，CPU运行）"""
+
+    def __init__(self, chunks: List[Chunk], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        # 倒排索引：term -> [(片段序号, 词频)]
+        self.postings: Dict[str, List[tuple]] = {}
+        self.doc_lengths: List[int] = []
+
+        for chunk in chunks:
+            terms = tokenize(f"{chunk.heading}\n{chunk.text}")
+            self.doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, []).append((chunk.index, tf))
+
+        n = len(chunks)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def search(self, query: str, top_k: int = 5) -> List[Chunk]:
+        """检索与查询最相关的片段，按在文档中的原始顺序返回"""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[index] / (self.avg_length or 1))
+                scores[index] = scores.get(index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if not scores:
+            # 没有任何词命中时退回到文档开头的片段
+            return self.chunks[:top_k]
+        best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        return [self.chunks[index] for index in sorted(best)]
+
+
+class RetrievalIndexCache:
+    """按文档内容哈希缓存检索索引，同一文档的后续提问无需重建；可在线程池中并发调用"""
+
+    def __init__(self, max_entries: int = 32, chunk_chars: int = 1200):
+        self.max_entries = max_entries
+        self.chunk_chars = chunk_chars
+        self._indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content: str, key: Optional[str] = None) -> BM25Index:
+        """获取文档的检索索引，不存在时构建"""
+        key = key or hashlib.sha256(content.encode('utf-8')).hexdigest()
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+
+        # 构建索引较慢，不持有锁；并发构建同一文档时保留先完成的那个
+        index = BM25Index(chunk_markdown(content, self.chunk_chars))
+        with self._lock:
+            existing = self._indexes.get(key)
+            if existing is not None:
+                self._indexes.move_to_end(key)
+                return existing
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        return index
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from autogen_core.model_context import BufferedChatCompletionContext
+from autogen_core.models import LLMMessage
+
+logger = logging.getLogger(__name__)
+
+
+class CappedChatCompletionContext(BufferedChatCompletionContext):
+    """只保留最近N条消息的模型上下文：与BufferedChatCompletionContext不同，超出的消息会被丢弃而不只是不发送"""
+
+    async def add_message(self, message: LLMMessage) -> None:
+        await super().add_message(message)
+        if len(self._messages) > self._buffer_size:
+            del self._messages[:-self._buffer_size]
+
+
+@dataclass
+class SessionEntry:
+    """会话条目"""
+    value: Any
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+
+
+class SessionManager:
+    """会话管理：空闲TTL过期 + 会话数上限LRU淘汰，支持按dict方式访问"""
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        idle_ttl_seconds: int = 3600,
+        on_evict: Optional[Callable[[str, Any, str], None]] = None
+    ):
+        """
+        初始化会话管理器
+
+        Args:
+            max_sessions: 最大会话数，超出时淘汰最久未使用的会话
+            idle_ttl_seconds: 会话空闲超时时间（秒）
+            on_evict: 会话被淘汰时的回调 (session_id, value, reason)
+        """
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.on_evict = on_evict
+        # 按最近访问顺序排列，最久未使用的在前
+        self._entries: "OrderedDict[str, SessionEntry]" = OrderedDict()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __contains__(self, session_id: str) -> bool:
+        self.purge_expired()
+        return session_id in self._entries
+
+    def __getitem__(self, session_id: str) -> Any:
+        value = self.get(session_id)
+        if value is None:
+            raise KeyError(session_id)
+        return value
+
+    def __setitem__(self, session_id: str, value: Any):
+        if session_id in self._entries:
+            entry = self._entries[session_id]
+            entry.value = value
+            entry.last_access = time.time()
+            self._entries.move_to_end(session_id)
+            return
+
+        self._entries[session_id] = SessionEntry(value=value)
+        self.created += 1
+        self.purge_expired()
+        while len(self._entries) > self.max_sessions:
+            oldest = next(iter(self._entries))
+            self._remove(oldest, "lru")
+            self.evicted += 1
+
+    def __delitem__(self, session_id: str):
+        del self._entries[session_id]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def get(self, session_id: str, default: Any = None) -> Any:
+        """获取会话并刷新访问时间"""
+        self.purge_expired()
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return default
+        entry.last_access = time.time()
+        self._entries.move_to_end(session_id)
+        return entry.value
+
+    def pop(self, session_id: str, default: Any = None) -> Any:
+        entry = self._entries.pop(session_id, None)
+        return entry.value if entry is not None else default
+
+    def purge_expired(self) -> int:
+        """清理空闲超时的会话，返回清理数量"""
+        deadline = time.time() - self.idle_ttl_seconds
+        count = 0
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if entry.last_access >= deadline:
+                break
+            self._remove(session_id, "ttl")
+            count += 1
+        self.expired += count
+        return count
+
+    def get_stats(self) -> Dict:
+        """获取会话统计信息"""
+        now = time.time()
+        return {
+            "active_sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "created_total": self.created,
+            "expired_total": self.expired,
+            "evicted_total": self.evicted,
+            "oldest_idle_seconds": round(now - next(iter(self._entries.values())).last_access, 1) if self._entries else 0,
+        }
+
+    def _remove(self, session_id: str, reason: str):
+        entry = self._entries.pop(session_id)
+        logger.info(f"会话已淘汰: {session_id} ({reason})")
+        if self.on_evict:
+            try:
+                self.on_evict(session_id, entry.value, reason)
+            except Exception as e:
+                logger.warning(f"会话淘汰回调失败: {str(e)}")
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(ABC):
+    """
+    会话状态存储接口（Redis兼容的子集：get / set(ex=) / delete）
+
+    子类必须实现这三个异步方法，缺少时在创建实例时即报错；
+    不继承本类、但实现了这三个方法的对象（如 redis.asyncio.Redis 客户端）也可以直接作为存储
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ex: Optional[int] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储，仅用于单进程部署或开发调试"""
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ex: Optional[int] = None) -> None:
+        self._data[key] = (value, time.time() + ex if ex else None)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """基于SQLite的本地存储，同一台机器上的多个worker进程可以共享"""
+
+    def __init__(self, path: str = "data/sessions.db"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ex: Optional[int] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ex)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] < time.time():
+                self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+                return None
+            return row[0]
+
+    def _set(self, key: str, value: str, ex: Optional[int]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ex if ex else None),
+            )
+            # 顺带清理过期数据
+            self._conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+    def _delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+
+class FileSessionStore(SessionStore):
+    """基于文件的存储，每个键一个JSON文件，适合挂载共享目录的多节点部署"""
+
+    def __init__(self, directory: str = "data/sessions"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ex: Optional[int] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ex)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+    def _get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                item = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if item.get("expires_at") is not None and item["expires_at"] < time.time():
+            self._delete(key)
+            return None
+        return item["value"]
+
+    def _set(self, key: str, value: str, ex: Optional[int]):
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"key": key, "value": value, "expires_at": time.time() + ex if ex else None}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _delete(self, key: str):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def create_session_store_from_env() -> Optional[SessionStore]:
+    """
+    根据环境变量创建会话存储
+
+    SESSION_STORE: none（默认，不持久化）/ memory / sqlite / file / redis
+    SESSION_STORE_PATH: sqlite数据库文件或文件存储目录
+    REDIS_URL: redis连接地址（需要安装redis包）
+    """
+    kind = os.getenv("SESSION_STORE", "none").lower()
+    try:
+        if kind == "memory":
+            return MemorySessionStore()
+        if kind == "sqlite":
+            return SQLiteSessionStore(os.getenv("SESSION_STORE_PATH", "data/sessions.db"))
+        if kind == "file":
+            return FileSessionStore(os.getenv("SESSION_STORE_PATH", "data/sessions"))
+        if kind == "redis":
+            import redis.asyncio as redis
+
+            return redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
+    except Exception as e:
+        logger.error(f"初始化会话存储失败（{kind}），会话将不会持久化: {str(e)}")
+        return None
+    return None
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+import re
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, RequestUsage, SystemMessage, UserMessage
+
+logger = logging.getLogger(__name__)
+
+_TABLE_SEPARATOR = re.compile(r'^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$')
+_SECTION_HEADING = re.compile(r'^#{1,3}\s')
+
+
+@dataclass
+class ReviewBlock:
+    """一个待评审的测试用例片段"""
+    title: str
+    text: str
+
+
+def _cells(line: str) -> List[str]:
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+
+def _module_column(header: str) -> Optional[int]:
+    return next(
+        (index for index, name in enumerate(_cells(header)) if "模块" in name or "module" in name.lower()),
+        None
+    )
+
+
+def _row_module(row: str, module_column: Optional[int]) -> str:
+    cells = _cells(row)
+    module = cells[module_column] if module_column is not None and module_column < len(cells) else ""
+    return module.strip('* ') or "测试用例"
+
+
+def split_review_blocks(markdown: str, max_rows: int = 20) -> List[ReviewBlock]:
+    """
+    将测试用例文档切分成可独立评审的片段
+
+    优先按Markdown表格的“模块”列分组（每组最多max_rows行，每个片段都带表头）；
+    文档中没有表格时按二级/三级标题切分；都没有时整篇作为一个片段
+    """
+    lines = markdown.splitlines()
+    blocks: List[ReviewBlock] = []
+    i = 0
+    while i < len(lines):
+        # 表格：表头行 + 分隔行 + 数据行
+        if lines[i].lstrip().startswith('|') and i + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[i + 1].strip()):
+            header, separator = lines[i], lines[i + 1]
+            module_column = _module_column(header)
+            groups: Dict[str, List[str]] = {}
+            j = i + 2
+            while j < len(lines) and lines[j].lstrip().startswith('|'):
+                groups.setdefault(_row_module(lines[j], module_column), []).append(lines[j])
+                j += 1
+            for module, rows in groups.items():
+                parts = [rows[k:k + max_rows] for k in range(0, len(rows), max_rows)]
+                for index, part in enumerate(parts):
+                    title = module if len(parts) == 1 else f"{module}（{index + 1}/{len(parts)}）"
+                    blocks.append(ReviewBlock(title=title, text="\n".join([header, separator, *part])))
+            i = j
+            continue
+        i += 1
+
+    if blocks:
+        return blocks
+
+    # 没有表格时按标题切分
+    sections: List[List[str]] = []
+    for line in lines:
+        if _SECTION_HEADING.match(line) or not sections:
+            sections.append([])
+        sections[-1].append(line)
+    sections = [section for section in sections if "\n".join(section).strip()]
+    if len(sections) <= 1:
+        return [ReviewBlock(title="测试用例", text=markdown)]
+    return [
+        ReviewBlock(title=section[0].lstrip('#').strip() or f"第{index + 1}部分", text="\n".join(section))
+        for index, section in enumerate(sections)
+    ]
+
+
+class IncrementalReviewSplitter:
+    """
+    增量切分：主智能体流式输出时逐段喂入，每当表格中凑齐一个模块（或max_rows行）的完整行就产出一个片段
+
+    文档中没有表格时，结束时再按 split_review_blocks 整体切分
+    """
+
+    def __init__(self, max_rows: int = 20):
+        self.max_rows = max_rows
+        self.fed = False
+        self._text: List[str] = []
+        self._line = ""
+        self._candidate_header: Optional[str] = None
+        self._header: Optional[str] = None
+        self._separator = ""
+        self._module_column: Optional[int] = None
+        self._module = ""
+        self._module_parts = 0
+        self._rows: List[str] = []
+        self._emitted = 0
+
+    def feed(self, text: str) -> List[ReviewBlock]:
+        """喂入新的输出文本，返回已经完整的片段"""
+        self.fed = True
+        self._text.append(text)
+        lines = (self._line + text).split('\n')
+        self._line = lines.pop()
+        blocks: List[ReviewBlock] = []
+        for line in lines:
+            blocks.extend(self._process_line(line))
+        return blocks
+
+    def finish(self) -> List[ReviewBlock]:
+        """输出结束，返回剩余的片段"""
+        blocks: List[ReviewBlock] = []
+        if self._line:
+            blocks.extend(self._process_line(self._line))
+            self._line = ""
+        blocks.extend(self._flush())
+        if not self._emitted and not blocks:
+            document = "".join(self._text)
+            if document.strip():
+                blocks = split_review_blocks(document, self.max_rows)
+        return blocks
+
+    def _process_line(self, line: str) -> List[ReviewBlock]:
+        stripped = line.strip()
+        if self._header is not None:
+            if not stripped.startswith('|'):
+                # 表格结束
+                blocks = self._flush()
+                self._header = None
+                return blocks
+            module = _row_module(line, self._module_column)
+            blocks = self._flush() if self._rows and module != self._module else []
+            if module != self._module:
+                self._module, self._module_parts = module, 0
+            self._rows.append(line)
+            if len(self._rows) >= self.max_rows:
+                blocks.extend(self._flush())
+            return blocks
+
+        if stripped.startswith('|'):
+            if self._candidate_header is not None and _TABLE_SEPARATOR.match(stripped):
+                self._header, self._separator = self._candidate_header, line
+                self._module_column = _module_column(self._header)
+                self._module, self._module_parts = "", 0
+                self._candidate_header = None
+            else:
+                self._candidate_header = line
+        else:
+            self._candidate_header = None
+        return []
+
+    def _flush(self) -> List[ReviewBlock]:
+        if not self._rows:
+            return []
+        self._module_parts += 1
+        title = self._module if self._module_parts == 1 else f"{self._module}（续{self._module_parts - 1}）"
+        block = ReviewBlock(title=title, text="\n".join([self._header, self._separator, *self._rows]))
+        self._rows = []
+        self._emitted += 1
+        return [block]
+
+
+class BlockReviewer:
+    """按片段评审：每个片段单独调用一次评审模型，可并行（限制并发数）或流式输出"""
+
+    def __init__(
+        self,
+        model_client: ChatCompletionClient,
+        system_message: str,
+        max_concurrency: int = 4,
+        on_usage: Optional[Callable[[RequestUsage], None]] = None
+    ):
+        self.model_client = model_client
+        self.system_message = system_message
+        self.max_concurrency = max_concurrency
+        self.on_usage = on_usage
+
+    def _messages(self, requirement: str, block: ReviewBlock, index: int, total: Optional[int] = None):
+        position = f"第{index + 1}/{total}部分" if total else f"第{index + 1}部分"
+        return [
+            SystemMessage(content=self.system_message),
+            UserMessage(
+                content=(
+                    f"需求描述：\n{requirement}\n\n"
+                    f"以下是测试用例的{position}（{block.title}），请只评审这一部分；"
+                    f"如果这一部分没有需要修改的问题，请在结尾写 APPROVE。\n\n{block.text}"
+                ),
+                source="user"
+            ),
+        ]
+
+    async def _review_block(
+        self,
+        semaphore: asyncio.Semaphore,
+        requirement: str,
+        block: ReviewBlock,
+        index: int,
+        total: int,
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> str:
+        async with semaphore:
+            try:
+                result = await self.model_client.create(
+                    self._messages(requirement, block, index, total),
+                    cancellation_token=cancellation_token
+                )
+            except Exception as e:
+                logger.warning(f"评审片段失败: {block.title}, {str(e)}")
+                return f"（该部分评审失败：{str(e)}）"
+        if self.on_usage is not None and result.usage is not None:
+            self.on_usage(result.usage)
+        return result.content if isinstance(result.content, str) else str(result.content)
+
+    async def review(
+        self,
+        requirement: str,
+        blocks: List[ReviewBlock],
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        并行评审所有片段
+
+        产出 {"index", "title", "content"}，严格按片段顺序；某个片段完成前，后面已完成的结果先缓存
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [
+            asyncio.create_task(self._review_block(semaphore, requirement, block, index, len(blocks), cancellation_token))
+            for index, block in enumerate(blocks)
+        ]
+        try:
+            for index, task in enumerate(tasks):
+                content = await task
+                yield {"index": index, "title": blocks[index].title, "content": content}
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def review_stream(
+        self,
+        requirement: str,
+        block: ReviewBlock,
+        index: int,
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[str, None]:
+        """流式评审单个片段，逐段产出评审内容"""
+        try:
+            async for item in self.model_client.create_stream(
+                self._messages(requirement, block, index),
+                cancellation_token=cancellation_token
+            ):
+                if isinstance(item, CreateResult):
+                    if self.on_usage is not None and item.usage is not None:
+                        self.on_usage(item.usage)
+                elif item:
+                    yield item
+        except Exception as e:
+            logger.warning(f"评审片段失败: {block.title}, {str(e)}")
+            yield f"（该部分评审失败：{str(e)}）"
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+import hashlib
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SAVE_DURATION = metrics_registry.histogram(
+    "upload_save_duration_seconds", "上传文件分块落盘耗时")
+UPLOAD_BYTES = metrics_registry.counter(
+    "upload_bytes_total", "已保存的上传文件字节数")
+
+
+class UploadTooLargeError(Exception):
+    """上传文件超过大小限制"""
+
+
+@dataclass
+class SavedUpload:
+    """已保存到磁盘的上传文件"""
+    path: str
+    filename: str
+    size: int
+    sha256: str
+
+
+class UploadService:
+    """上传文件流式落盘服务：分块写入临时文件，边写边计算哈希并检查大小"""
+
+    def __init__(self, upload_dir: str = "uploads", max_bytes: int = 10 * 1024 * 1024, chunk_size: int = 256 * 1024):
+        """
+        初始化上传服务
+
+        Args:
+            upload_dir: 上传文件保存目录
+            max_bytes: 单个文件大小上限（字节）
+            chunk_size: 每次读取的块大小（字节）
+        """
+        self.upload_dir = Path(upload_dir)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+
+    async def save_stream(self, upload: UploadFile) -> SavedUpload:
+        """
+        将上传文件分块写入磁盘，内存占用与文件大小无关
+
+        Raises:
+            UploadTooLargeError: 文件超过大小限制（已写入的部分会被删除）
+        """
+        suffix = Path(upload.filename or '').suffix.lower()
+        final_path = self.upload_dir / f"{uuid.uuid4().hex}{suffix}"
+        tmp_path = final_path.with_name(final_path.name + ".part")
+
+        digest = hashlib.sha256()
+        size = 0
+        start = time.perf_counter()
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as out:
+                while True:
+                    chunk = await upload.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLargeError(f"文件大小超过{self.max_bytes // (1024 * 1024)}MB限制")
+                    digest.update(chunk)
+                    await out.write(chunk)
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+
+        elapsed = time.perf_counter() - start
+        UPLOAD_SAVE_DURATION.observe(elapsed)
+        UPLOAD_BYTES.inc(size)
+        logger.info(f"上传文件已保存: {upload.filename} -> {final_path} ({size} 字节，耗时{elapsed:.3f}秒)")
+        return SavedUpload(
+            path=str(final_path),
+            filename=upload.filename,
+            size=size,
+            sha256=digest.hexdigest(),
+        )
+
+
+# multipart 边界和表单字段的额外开销
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """
+    上传请求体大小限制：FastAPI 在调用接口前就会把整个 multipart 请求体读完并落到临时文件，
+    save_stream 中的检查来不及阻止大文件占用网络和磁盘，因此在接收请求体时就检查
+
+    声明了 Content-Length 且超限时直接返回413；分块传输时边接收边计数，超限立即中止
+    """
+
+    def __init__(self, app: ASGIApp, paths: Sequence[str], max_bytes: int, overhead_bytes: int = MULTIPART_OVERHEAD_BYTES):
+        """
+        Args:
+            paths: 需要限制的上传接口路径
+            max_bytes: 单个文件大小上限（字节）
+            overhead_bytes: 请求体中除文件外允许的额外字节数
+        """
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_bytes + overhead_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"文件大小超过{self.max_bytes // (1024 * 1024)}MB限制"
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            response = JSONResponse({"detail": detail}, status_code=413, headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # 接口读取请求体时抛出的 HTTPException 会被 FastAPI 原样转为响应
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# 创建全局实例
+upload_service = UploadService(
+    upload_dir=os.getenv("UPLOAD_DIR", "uploads"),
+    max_bytes=int(os.getenv("UPLOAD_MAX_MB", "10")) * 1024 * 1024,
+)
@@ -103,6 +103,7 @@ const FileUpload = ({ onFileSelect, onFileRemove, disabled = false, maxSize = 10
                 size: file.size,
                 type: getFileTypeInfo(file.name).type,
                 content: response.content,
+                documentId: response.document_id,
                 metadata: response.file_info?.metadata || {}
               }
 
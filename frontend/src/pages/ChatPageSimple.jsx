@@ -64,6 +64,204 @@ function ChatPageSimple() {
     }
   }, [messages, sessionId, chatTitle])
 
+  // 读取服务端事件流并更新对应的助手消息；审批挂起后恢复运行时传入之前的智能体映射继续追加
+  const readEventStream = async (response, assistantMessageId, agentsMap = new Map()) => {
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    // 服务端会合并多个事件一起发送，一次读取的结尾可能是半行或被截断的多字节字符，留到下次读取拼接
+    let buffer = ''
+    let queued = false
+
+    while (true) {
+      const { done, value } = await reader.read()
+      buffer += done ? decoder.decode() : decoder.decode(value, { stream: true })
+      const lines = buffer.split('\n')
+      buffer = done ? '' : lines.pop()
+
+      for (const line of lines) {
+        if (line.startsWith('data: ')) {
+          try {
+            const jsonStr = line.slice(6)
+            if (jsonStr.trim()) {
+              const data = JSON.parse(jsonStr)
+              console.log('Received data:', data)
+
+              if (queued && data.type !== 'queue') {
+                // 获得运行名额后移除排队提示
+                queued = false
+                setMessages(prev => prev.map(msg =>
+                  msg.id === assistantMessageId
+                    ? { ...msg, queueMessage: null }
+                    : msg
+                ))
+              }
+
+              if (data.type === 'agent_start') {
+                // 为每个智能体启动创建一个唯一的实例ID
+                const timestamp = Date.now()
+                const uniqueId = `${data.agent}_${timestamp}`
+
+                const newAgent = {
+                  id: uniqueId,
+                  originalId: data.agent, // 保存原始智能体ID
+                  agent_info: data.agent_info,
+                  content: '',
+                  status: 'working',
+                  startTime: new Date().toISOString(),
+                  order: agentsMap.size // 用于排序
+                }
+
+                agentsMap.set(uniqueId, newAgent)
+                setCurrentAgent(uniqueId)
+                setCurrentAgents(Array.from(agentsMap.values()))
+
+              } else if (data.type === 'chunk' && data.content) {
+                // 处理智能体内容
+                if (data.agent) {
+                  // 查找当前正在工作的智能体实例
+                  let targetAgent = null
+                  let targetAgentId = null
+
+                  // 查找具有相同originalId且状态为working的智能体
+                  for (const [id, agent] of agentsMap.entries()) {
+                    if (agent.originalId === data.agent && agent.status === 'working') {
+                      targetAgent = agent
+                      targetAgentId = id
+                      break
+                    }
+                  }
+
+                  if (targetAgent && targetAgentId) {
+                    targetAgent.content += data.content
+                    agentsMap.set(targetAgentId, targetAgent)
+                    setCurrentAgents(Array.from(agentsMap.values()))
+
+                    setMessages(prev => prev.map(msg =>
+                      msg.id === assistantMessageId
+                        ? {
+                            ...msg,
+                            agents: Array.from(agentsMap.values())
+                          }
+                        : msg
+                    ))
+                  }
+                } else {
+                  // 处理普通文本内容（没有智能体信息时）
+                  setMessages(prev => prev.map(msg =>
+                    msg.id === assistantMessageId
+                      ? {
+                          ...msg,
+                          content: msg.content + data.content
+                        }
+                      : msg
+                  ))
+                }
+
+              } else if (data.type === 'agent_end') {
+                // 查找要结束的智能体实例
+                for (const [id, agent] of agentsMap.entries()) {
+                  if (agent.originalId === data.agent && agent.status === 'working') {
+                    agent.status = 'completed'
+                    agent.endTime = new Date().toISOString()
+                    agentsMap.set(id, agent)
+                    setCurrentAgents(Array.from(agentsMap.values()))
+                    break
+                  }
+                }
+
+              } else if (data.type === 'user_proxy') {
+                // 用户代理需要审批
+                console.log('User proxy approval needed:', data)
+
+                // 为用户代理创建唯一实例
+                const timestamp = Date.now()
+                const userProxyId = `user_proxy_${timestamp}`
+
+                const userProxyAgent = {
+                  id: userProxyId,
+                  originalId: 'user_proxy',
+                  agent_info: {
+                    name: 'User Proxy Agent',
+                    description: '等待用户审批',
+                    avatar: '👤',
+                    color: '#ff7875'
+                  },
+                  content: data.content || '等待用户审批...',
+                  status: 'waiting',
+                  startTime: new Date().toISOString(),
+                  order: agentsMap.size
+                }
+
+                agentsMap.set(userProxyId, userProxyAgent)
+                setCurrentAgent(userProxyId)
+                setCurrentAgents(Array.from(agentsMap.values()))
+
+                // 更新消息显示
+                setMessages(prev => prev.map(msg =>
+                  msg.id === assistantMessageId
+                    ? {
+                        ...msg,
+                        agents: Array.from(agentsMap.values())
+                      }
+                    : msg
+                ))
+
+                setUserProxyModal({
+                  visible: true,
+                  agentContent: data.content || '',
+                  agentName: data.agent || 'User Proxy Agent',
+                  isWaiting: true,
+                  // suspended 表示服务端已挂起运行（TEAM_SUSPEND_ON_APPROVAL），本次事件流随后结束，审批后需要调用恢复接口
+                  pendingResponse: { userProxyId, assistantMessageId, agentsMap, suspended: Boolean(data.suspended) }
+                })
+                // 不要return，让流处理继续
+
+              } else if (data.type === 'queue') {
+                // 服务繁忙时请求先排队，单独显示当前排队位置，不计入回复内容
+                queued = true
+                setMessages(prev => prev.map(msg =>
+                  msg.id === assistantMessageId
+                    ? { ...msg, queueMessage: data.message }
+                    : msg
+                ))
+
+              } else if (data.type === 'complete') {
+                console.log('All agents completed:', data.message)
+
+              } else if (data.type === 'error') {
+                message.error(data.content)
+                setMessages(prev => prev.map(msg =>
+                  msg.id === assistantMessageId
+                    ? {
+                        ...msg,
+                        content: data.content,
+                        streaming: false,
+                        agents: Array.from(agentsMap.values())
+                      }
+                    : msg
+                ))
+              }
+            }
+          } catch (e) {
+            console.warn('解析流数据失败:', e, line)
+          }
+        }
+      }
+      if (done) break
+    }
+
+    setMessages(prev => prev.map(msg =>
+      msg.id === assistantMessageId
+        ? {
+            ...msg,
+            streaming: false,
+            queueMessage: null,
+            agents: Array.from(agentsMap.values())
+          }
+        : msg
+    ))
+  }
+
   // 发送消息
   const sendMessage = async () => {
     if (!inputValue.trim() || isStreaming) return
@@ -117,7 +315,10 @@ function ChatPageSimple() {
             session_id: sessionId,
             file_name: selectedFile.name,
             file_type: selectedFile.type,
-            file_content: selectedFile.content
+            // 服务端已保存解析结果时只传文档ID，避免重复上传文件内容
+            ...(selectedFile.documentId
+              ? { document_id: selectedFile.documentId }
+              : { file_content: selectedFile.content })
           })
         }
       } else {
@@ -130,7 +331,9 @@ function ChatPageSimple() {
           },
           body: JSON.stringify({
             message: userMessage.content,
-            session_id: sessionId
+            session_id: sessionId,
+            // 智能体内容已通过 chunk 事件逐段收到，agent_end 只需要摘要
+            agent_end_content: 'digest'
           })
         }
       }
@@ -138,190 +341,23 @@ function ChatPageSimple() {
       const response = await fetch(endpoint, requestOptions)
 
       if (!response.ok) {
-        throw new Error('网络请求失败')
+        // 429（请求过于频繁）和503（排队已满）时服务端会给出提示
+        const detail = await response.json().then(body => body.detail).catch(() => null)
+        throw new Error(detail || '网络请求失败')
       }
 
-      const reader = response.body.getReader()
-      const decoder = new TextDecoder()
-      let agentsMap = new Map()
-
-      while (true) {
-        const { done, value } = await reader.read()
-        if (done) break
-
-        const chunk = decoder.decode(value)
-        const lines = chunk.split('\n')
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            try {
-              const jsonStr = line.slice(6)
-              if (jsonStr.trim()) {
-                const data = JSON.parse(jsonStr)
-                console.log('Received data:', data)
-                
-                if (data.type === 'agent_start') {
-                  // 为每个智能体启动创建一个唯一的实例ID
-                  const timestamp = Date.now()
-                  const uniqueId = `${data.agent}_${timestamp}`
-
-                  const newAgent = {
-                    id: uniqueId,
-                    originalId: data.agent, // 保存原始智能体ID
-                    agent_info: data.agent_info,
-                    content: '',
-                    status: 'working',
-                    startTime: new Date().toISOString(),
-                    order: agentsMap.size // 用于排序
-                  }
-
-                  agentsMap.set(uniqueId, newAgent)
-                  setCurrentAgent(uniqueId)
-                  setCurrentAgents(Array.from(agentsMap.values()))
-                  
-                } else if (data.type === 'chunk' && data.content) {
-                  // 处理智能体内容
-                  if (data.agent) {
-                    // 查找当前正在工作的智能体实例
-                    let targetAgent = null
-                    let targetAgentId = null
-
-                    // 查找具有相同originalId且状态为working的智能体
-                    for (const [id, agent] of agentsMap.entries()) {
-                      if (agent.originalId === data.agent && agent.status === 'working') {
-                        targetAgent = agent
-                        targetAgentId = id
-                        break
-                      }
-                    }
-
-                    if (targetAgent && targetAgentId) {
-                      targetAgent.content += data.content
-                      agentsMap.set(targetAgentId, targetAgent)
-                      setCurrentAgents(Array.from(agentsMap.values()))
-
-                      setMessages(prev => prev.map(msg =>
-                        msg.id === assistantMessage.id
-                          ? {
-                              ...msg,
-                              agents: Array.from(agentsMap.values())
-                            }
-                          : msg
-                      ))
-                    }
-                  } else {
-                    // 处理普通文本内容（没有智能体信息时）
-                    setMessages(prev => prev.map(msg =>
-                      msg.id === assistantMessage.id
-                        ? {
-                            ...msg,
-                            content: msg.content + data.content
-                          }
-                        : msg
-                    ))
-                  }
-                  
-                } else if (data.type === 'agent_end') {
-                  // 查找要结束的智能体实例
-                  for (const [id, agent] of agentsMap.entries()) {
-                    if (agent.originalId === data.agent && agent.status === 'working') {
-                      agent.status = 'completed'
-                      agent.endTime = new Date().toISOString()
-                      agentsMap.set(id, agent)
-                      setCurrentAgents(Array.from(agentsMap.values()))
-                      break
-                    }
-                  }
-                  
-                } else if (data.type === 'user_proxy') {
-                  // 用户代理需要审批
-                  console.log('User proxy approval needed:', data)
-
-                  // 为用户代理创建唯一实例
-                  const timestamp = Date.now()
-                  const userProxyId = `user_proxy_${timestamp}`
-
-                  const userProxyAgent = {
-                    id: userProxyId,
-                    originalId: 'user_proxy',
-                    agent_info: {
-                      name: 'User Proxy Agent',
-                      description: '等待用户审批',
-                      avatar: '👤',
-                      color: '#ff7875'
-                    },
-                    content: data.content || '等待用户审批...',
-                    status: 'waiting',
-                    startTime: new Date().toISOString(),
-                    order: agentsMap.size
-                  }
-
-                  agentsMap.set(userProxyId, userProxyAgent)
-                  setCurrentAgent(userProxyId)
-                  setCurrentAgents(Array.from(agentsMap.values()))
-
-                  // 更新消息显示
-                  setMessages(prev => prev.map(msg =>
-                    msg.id === assistantMessage.id
-                      ? {
-                          ...msg,
-                          agents: Array.from(agentsMap.values())
-                        }
-                      : msg
-                  ))
-
-                  setUserProxyModal({
-                    visible: true,
-                    agentContent: data.content || '',
-                    agentName: data.agent || 'User Proxy Agent',
-                    isWaiting: true,
-                    pendingResponse: { userProxyId } // 传递user proxy ID
-                  })
-                  // 不要return，让流处理继续
-
-                } else if (data.type === 'complete') {
-                  console.log('All agents completed:', data.message)
-
-                } else if (data.type === 'error') {
-                  message.error(data.content)
-                  setMessages(prev => prev.map(msg =>
-                    msg.id === assistantMessage.id
-                      ? {
-                          ...msg,
-                          content: data.content,
-                          streaming: false,
-                          agents: Array.from(agentsMap.values())
-                        }
-                      : msg
-                  ))
-                }
-              }
-            } catch (e) {
-              console.warn('解析流数据失败:', e, jsonStr)
-            }
-          }
-        }
-      }
-      
-      setMessages(prev => prev.map(msg =>
-        msg.id === assistantMessage.id
-          ? {
-              ...msg,
-              streaming: false,
-              agents: Array.from(agentsMap.values())
-            }
-          : msg
-      ))
+      await readEventStream(response, assistantMessage.id)
       setCurrentAgent(null)
     } catch (error) {
       console.error('发送消息失败:', error)
-      message.error('发送消息失败，请重试')
+      message.error(error.message === '网络请求失败' ? '发送消息失败，请重试' : error.message)
       setMessages(prev => prev.map(msg =>
         msg.id === assistantMessage.id
           ? {
               ...msg,
               content: '抱歉，发送消息时出现错误，请重试。',
               streaming: false,
+              queueMessage: null,
               agents: []
             }
           : msg
@@ -335,53 +371,94 @@ function ChatPageSimple() {
     }
   }
 
+  // 恢复因等待审批而挂起的团队运行，继续更新原来的助手消息
+  const resumeSuspendedRun = async ({ assistantMessageId, agentsMap }) => {
+    setIsStreaming(true)
+    setMessages(prev => prev.map(msg =>
+      msg.id === assistantMessageId ? { ...msg, streaming: true } : msg
+    ))
+
+    try {
+      const response = await fetch('/api/chat/resume/stream', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          // 用户反馈已通过审批接口记录到检查点，这里不需要再传
+          session_id: sessionId,
+          agent_end_content: 'digest'
+        })
+      })
+
+      if (!response.ok) {
+        const detail = await response.json().then(body => body.detail).catch(() => null)
+        throw new Error(detail || '网络请求失败')
+      }
+
+      await readEventStream(response, assistantMessageId, agentsMap)
+    } catch (error) {
+      console.error('恢复运行失败:', error)
+      message.error(error.message === '网络请求失败' ? '恢复运行失败，请重试' : error.message)
+      setMessages(prev => prev.map(msg =>
+        msg.id === assistantMessageId ? { ...msg, streaming: false, queueMessage: null } : msg
+      ))
+    } finally {
+      setIsStreaming(false)
+      setCurrentAgent(null)
+    }
+  }
+
   // 处理用户审批
-  const handleUserApproval = async (userInput) => {
+  const handleUserApproval = async (userInput, approved = true) => {
+    const pendingResponse = userProxyModal.pendingResponse
     try {
-      // 发送用户反馈到后端的feedback队列
-      const feedbackResponse = await fetch('http://localhost:8000/chat/feedback', {
+      // 发送审批结果：批准时服务端发送APPROVE结束流程，拒绝时把意见交给智能体修改
+      const approvalResponse = await fetch('/api/chat/user-proxy-response', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          content: userInput
+          session_id: sessionId,
+          user_input: userInput,
+          approved
         })
       })
 
-      if (!feedbackResponse.ok) {
+      if (!approvalResponse.ok) {
         throw new Error('发送用户反馈失败')
       }
+      const approval = await approvalResponse.json()
+      if (!approval.success) {
+        throw new Error(approval.message || '发送用户反馈失败')
+      }
 
       // 更新user_proxy智能体状态
-      const { userProxyId } = userProxyModal.pendingResponse || {}
+      const { userProxyId, assistantMessageId, agentsMap } = pendingResponse || {}
       if (userProxyId) {
-        setCurrentAgents(prev => prev.map(agent =>
-          agent.id === userProxyId
-            ? {
-                ...agent,
-                content: `用户反馈: ${userInput}`,
-                status: 'completed',
-                endTime: new Date().toISOString()
-              }
-            : agent
-        ))
+        const feedbackContent = `用户反馈: ${userInput}`
+        const completeUserProxy = agent => agent.id === userProxyId
+          ? {
+              ...agent,
+              content: feedbackContent,
+              status: 'completed',
+              endTime: new Date().toISOString()
+            }
+          : agent
+
+        // 同步更新事件流使用的智能体映射，避免后续事件把状态覆盖回等待中
+        if (agentsMap?.has(userProxyId)) {
+          agentsMap.set(userProxyId, completeUserProxy(agentsMap.get(userProxyId)))
+        }
+        setCurrentAgents(prev => prev.map(completeUserProxy))
 
         // 更新消息中的智能体状态
         setMessages(prev => prev.map(msg =>
-          msg.type === 'assistant' && msg.streaming
+          msg.id === assistantMessageId
             ? {
                 ...msg,
-                agents: prev.find(m => m.id === msg.id)?.agents?.map(agent =>
-                  agent.id === userProxyId
-                    ? {
-                        ...agent,
-                        content: `用户反馈: ${userInput}`,
-                        status: 'completed',
-                        endTime: new Date().toISOString()
-                      }
-                    : agent
-                ) || []
+                agents: (msg.agents || []).map(completeUserProxy)
               }
             : msg
         ))
@@ -396,19 +473,23 @@ function ChatPageSimple() {
         pendingResponse: null
       })
 
-      console.log('用户反馈已发送，流处理将自动继续...')
+      if (approval.result?.resume && pendingResponse) {
+        // 运行已挂起，原来的事件流已经结束，需要开启恢复流继续（不等待，审批框可以立即结束提交状态）
+        console.log('用户反馈已记录，恢复挂起的运行...')
+        resumeSuspendedRun(pendingResponse)
+      } else {
+        console.log('用户反馈已发送，流处理将自动继续...')
+      }
 
     } catch (error) {
       console.error('处理用户审批失败:', error)
-      message.error('处理审批失败，请重试')
+      message.error(error.message === '发送用户反馈失败' ? '处理审批失败，请重试' : error.message)
     }
   }
 
-
-
   // 处理审批拒绝
   const handleUserRejection = async (userInput) => {
-    await handleUserApproval(userInput) // 使用相同的处理逻辑，后端会根据内容判断
+    await handleUserApproval(userInput, false)
   }
 
   // 关闭审批模态框
@@ -595,6 +676,12 @@ function ChatPageSimple() {
                         </div>
                       )}
 
+                      {msg.queueMessage && (
+                        <div className="message-queue-info">
+                          <Text type="secondary">{msg.queueMessage}</Text>
+                        </div>
+                      )}
+
                       {msg.type === 'assistant' && msg.agents && msg.agents.length > 0 ? (
                         <AgentTimeline
                           agents={msg.agents}